@@ -1,4 +1,3 @@
-import json
 import logging
 from datetime import datetime, timezone
 from enum import Enum
@@ -27,19 +26,20 @@ from utils.context_utils import (
     await_ask,
     get_current_quest,
     get_game_state,
+    get_reasoning_generator,
     get_server_settings,
     save_game_state,
 )
 from utils.generation_utils import (
     await_streamed_block,
-    generate_image_description,
-    generate_is_image_request,
+    generate_image_plan,
     generate_is_solution_attempt,
     generate_likelihood_estimation,
     generate_quest_arc,
     print_log,
     send_story_generation,
 )
+from utils.history_compaction import schedule_history_compaction
 from utils.interruptible_python_agent import InterruptiblePythonAgent
 from utils.moderation_utils import mark_block_as_excluded
 from utils.tags import InstructionsTag, QuestIdTag, QuestTag, TagKindExtensions
@@ -136,6 +136,13 @@ class ChatAgent(InterruptiblePythonAgent):
                 
             
             response_block = self.respond_to_user(game_state,context,quest,user_prompt=user_prompt,additional_context=additional_info)
+            # Keep the chat history from growing without bound; runs in the background.
+            schedule_history_compaction(
+                context.client,
+                context.chat_history.file,
+                quest.name,
+                get_reasoning_generator(context),
+            )
             if server_settings.enable_images_in_chat:
                 task = self.handle_image_generation(game_state, context, quest, response_block.text)
                     
@@ -178,52 +185,14 @@ class ChatAgent(InterruptiblePythonAgent):
         )
         return await_streamed_block(solution_block, context)
 
-    def generate_image_description(self, game_state: GameState, context: AgentContext,
-    quest: Quest,user_prompt:str):
+    def generate_image_plan(self, game_state: GameState, context: AgentContext,
+    quest: Quest, user_prompt: str):
+        """Decide whether an image was requested and describe it, in one call. Returns (requested, keywords)."""
         user_prompt_processed = user_prompt.replace("\n", " ")
         prompt = textwrap.dedent(
         f"""\
         <Instruction>
         Pause embodying character and revert to assistant mode.
-        
-        Imagine fitting image description keywords for an imaginary image of {game_state.player.name}, with looks like {game_state.player.appearance}.
-        Given the last message: "{user_prompt_processed}"
-
-        Give your response in the following object format with json array, write up to 20 detailed image description keywords here as list covering topics in order:
-        {{
-        "ImageDescriptionKeywords": [
-            Detailed Subject Looks,
-            Action,
-            Context,
-            Body Features,
-            Posture,
-            Detailed Imagery,
-            Environment Description,
-            Mood/Atmosphere Description,
-            Style,
-            Style Execution (etc. "full body portrait, masterpiece ,realistic,skin texture,ultra detailed,highres, RAW,8k, selfie, self shot,depth of field"" )
-        ]
-        }}
-        
-        Return the json object.
-        ```json""").rstrip()
-
-        image_description_response = generate_image_description(
-    prompt=prompt,
-    quest_name=quest.name,
-    context=context,
-    )    
-
-        #print_log(f"Image description response:\n{image_description_response.text}")
-        return image_description_response.text.strip()
-
-    def generate_plan(self, game_state: GameState, context: AgentContext,
-    quest: Quest,user_prompt:str):
-        user_prompt_processed = user_prompt.replace("\n", " ")
-        prompt = textwrap.dedent(
-        f"""\
-        <Instruction>
-        Pause embodying character and revert to assistant mode.        
 
         Task: Determine if an visual is requested, described or implied or shown as gesture, action description text and {game_state.player.name} agrees in given last two messages.
         Consider the following scenarios that might indicate an image request or visual gesture description:
@@ -233,20 +202,26 @@ class ChatAgent(InterruptiblePythonAgent):
         4. Descriptions that might prompt image generation: "Imagine this scene", "Picture this","Do you like what you see?"
         5. Gestures that might prompt image generation: *Showing*", *Exposing*", *Revealing*
         6. Action descriptions that might prompt image generation: "Take a look", "Showing a part of body", "Exposing a part of body", "Do you like what you see?"
-        
+
         Review the only following message from {game_state.player.name}: "{user_prompt_processed}" and previous user message: "{context.chat_history.last_user_message.text}".
-        
-        Provide your response in the following format:
-        <result>True/False</result>
-        <reasoning>reasoning here</reasoning>""").rstrip()
-        
-        plan_response = generate_is_image_request(
-    prompt=prompt,
-    quest_name=quest.name,
-    context=context,
-    )
-        #logging.warning(f"Image Request classification response:\n{plan_response.text}")
-        return plan_response.text.strip()
+
+        If a visual is requested, imagine fitting image description keywords for an imaginary image of {game_state.player.name}, with looks like {game_state.player.appearance}, and write up to 20 detailed image description keywords covering topics in order:
+        Detailed Subject Looks, Action, Context, Body Features, Posture, Detailed Imagery, Environment Description, Mood/Atmosphere Description, Style, Style Execution (etc. "full body portrait, masterpiece ,realistic,skin texture,ultra detailed,highres, RAW,8k, selfie, self shot,depth of field")
+
+        Give your response in the following object format, always starting with "ImageRequested":
+        {{
+        "ImageRequested": true/false,
+        "ImageDescriptionKeywords": [keywords here, only if ImageRequested is true]
+        }}
+
+        Return the json object.
+        ```json""").rstrip()
+
+        return generate_image_plan(
+            prompt=prompt,
+            quest_name=quest.name,
+            context=context,
+        )
 
     def handle_image_generation(self, game_state: GameState, context: AgentContext, quest: Quest, response_text: str):
         
@@ -263,46 +238,30 @@ class ChatAgent(InterruptiblePythonAgent):
         if not server_settings.enable_images_in_chat:
             #logging.warning(f"Image generation is disabled in server settings")
             return None
-        response_plan = self.generate_plan(game_state, context, quest, user_prompt=response_text)
-        #print_log("**Image request**: "+response_plan)
-        if "true" not in response_plan.lower():
+        image_requested, image_description_keywords = self.generate_image_plan(
+            game_state, context, quest, user_prompt=response_text
+        )
+        #print_log("**Image request**: "+str(image_requested))
+        if not image_requested:
             #logging.warning("Response did not include image suggestion")
             return None
-        image_description = self.generate_image_description(game_state, context, quest, user_prompt=response_text)
-
-        try:
-            image_description_data = json.loads(image_description)
-            if "ImageDescriptionKeywords" in image_description_data:
-                # Extract the values and remove keys if present
-                image_description_keywords = image_description_data["ImageDescriptionKeywords"]
-                cleaned_keywords = [
-                    keyword.split(":", 1)[1].strip() if ":" in keyword else keyword
-                    for keyword in image_description_keywords
-                ]
-                image_description = ", ".join(cleaned_keywords)
-                image_description.replace("Detailed Subject Looks","")\
-                .replace("Detailed Imagery","")\
-                .replace("Environment Description","")\
-                .replace("Mood/Atmosphere Description","")\
-                .replace("Style","")\
-                .replace("Style Execution","")\
-                .replace("Posture","")\
-                .replace("Cropped","")\
-                .replace("Environment Description","")\
-                .replace("Body Features","")\
-                .replace("Action","")
-
-                image_description = remove_duplicate_words(image_description)
-                
-        except json.JSONDecodeError:
-            logging.error(f"Failed to parse image description JSON. {image_description}")
-            #return None
-        except Exception:
-            logging.warning(f"Malformed response. {image_description}")
+
+        if not image_description_keywords:
+            logging.warning("Image requested, but no image description keywords were generated.")
+            return None
+        # Remove keys (e.g. "Posture: ") if present
+        cleaned_keywords = [
+            keyword.split(":", 1)[1].strip() if ":" in keyword else keyword
+            for keyword in image_description_keywords
+        ]
+        image_description = remove_duplicate_words(", ".join(cleaned_keywords))
 
         image_gen = get_chat_image_generator(context)
         if image_gen:
-            task = image_gen.request_chat_image_generation(description=image_description, context=context)
-            return task
+            # The image streams into the chat history when it's ready; the reply doesn't wait for it.
+            # The image scheduler waits on it and logs any failure.
+            return image_gen.request_chat_image_generation(
+                description=image_description, context=context, wait=False
+            )
         return None 
     
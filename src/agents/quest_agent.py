@@ -3,9 +3,9 @@ import logging
 from datetime import datetime, timezone
 from enum import Enum
 from random import randint, random
-from typing import Dict, List
+from typing import Dict, List, Optional
 
-from steamship import SteamshipError, Tag
+from steamship import Block, SteamshipError, Tag
 from steamship.agents.logging import AgentLogging
 from steamship.agents.schema import Action, AgentContext
 from steamship.agents.schema.action import FinishAction
@@ -21,6 +21,7 @@ from tools.end_quest_tool import EndQuestTool
 from utils.context_utils import (
     FinishActionException,
     await_ask,
+    emit,
     get_current_quest,
     get_game_state,
     get_server_settings,
@@ -31,11 +32,14 @@ from utils.generation_utils import (
     generate_is_solution_attempt,
     generate_likelihood_estimation,
     generate_quest_arc,
+    prepare_likelihood_estimation,
     send_story_generation,
+    submit_generation,
 )
 from utils.interruptible_python_agent import InterruptiblePythonAgent
 from utils.moderation_utils import mark_block_as_excluded
 from utils.tags import InstructionsTag, QuestIdTag, QuestTag, TagKindExtensions
+from utils.task_watcher import watch_task
 
 
 class Likelihood(str, Enum):
@@ -71,6 +75,19 @@ LIKELIHOOD_MAP: Dict[Difficulty, Dict[Likelihood, float]] = {
 }
 
 
+def paragraphs(num_paragraphs: int, short: bool = False) -> str:
+    """Phrase a paragraph count for a story prompt, e.g. "one short paragraph" or "2 paragraphs"."""
+    size = "short " if short else ""
+    if num_paragraphs == 1:
+        return f"one {size}paragraph"
+    return f"{num_paragraphs} {size}paragraphs"
+
+
+def last_paragraph(text: str) -> str:
+    parts = [part.strip() for part in text.split("\n\n") if part.strip()]
+    return parts[-1] if parts else text
+
+
 class QuestAgent(InterruptiblePythonAgent):
     """
     The quest agent goes on a quest!
@@ -235,8 +252,9 @@ class QuestAgent(InterruptiblePythonAgent):
 
             try:
                 # Was this an attempt to solve the problem, or some other action?
-                if self.is_solution_attempt(game_state, context, quest):
-                    if self.evaluate_solution(game_state, context, quest):
+                succeeded = self.evaluate_attempt(game_state, context, quest)
+                if succeeded is not None:
+                    if succeeded:
                         # TODO: tag last user message as solution
                         self.generate_solution(
                             game_state, context, quest, quest_description.goal
@@ -354,6 +372,7 @@ class QuestAgent(InterruptiblePythonAgent):
         quest: Quest,
         quest_description: QuestDescription,
     ):
+        num_paragraphs = randint(1, 2)  # noqa: S311
         if len(quest.challenges) > 0:
             # this is a specified-challenges type of quest
             solved_challenges = sum([1 if x.solution else 0 for x in quest.challenges])
@@ -372,7 +391,7 @@ class QuestAgent(InterruptiblePythonAgent):
                     f"DO NOT solve the challenge for {game_state.player.name}.\n"
                     f"The story MUST continue the current story arc of the quest. The story SHOULD allow "
                     f"{game_state.player.name} to decide how to attempt to solve the challenge.\n"
-                    f"Write exactly one paragraph in the tone of {server_settings.narrative_tone} "
+                    f"Write exactly {paragraphs(num_paragraphs)} in the tone of {server_settings.narrative_tone} "
                     f"with {server_settings.narrative_voice}."
                 )
             else:
@@ -391,7 +410,7 @@ class QuestAgent(InterruptiblePythonAgent):
                 f"DO NOT solve the challenge for {game_state.player.name}.\n"
                 f"The story should allow {game_state.player.name} to decide how to attempt to complete their "
                 f"quest. The story MUST continue the current story arc of the quest.\n"
-                f"Write exactly one paragraph in the tone of {server_settings.narrative_tone} "
+                f"Write exactly {paragraphs(num_paragraphs)} in the tone of {server_settings.narrative_tone} "
                 f"with {server_settings.narrative_voice}."
             )
         else:
@@ -408,11 +427,11 @@ class QuestAgent(InterruptiblePythonAgent):
                 f"DO NOT solve the challenge for {game_state.player.name}.\n"
                 f"The story MUST continue the current story arc of the quest. The story SHOULD allow "
                 f"{game_state.player.name} to decide how to attempt to solve the challenge.\n"
-                f"Write exactly one paragraph in the tone of {server_settings.narrative_tone} "
+                f"Write exactly {paragraphs(num_paragraphs)} in the tone of {server_settings.narrative_tone} "
                 f"with {server_settings.narrative_voice}."
             )
 
-        num_paragraphs = randint(1, 2)  # noqa: S311
+        # All paragraphs come from one generation, which streams to the player as it is written.
         problem_block = send_story_generation(
             prompt=prompt,
             quest_name=quest.name,
@@ -421,29 +440,21 @@ class QuestAgent(InterruptiblePythonAgent):
         updated_problem_block = await_streamed_block(problem_block, context)
         quest.current_problem = updated_problem_block.text
 
-        if num_paragraphs > 1:
-            # replace "Tell the" with "Continue telling the" and re-prompt
-            if prompt.startswith("Tell the story"):
-                new_prompt = prompt.removeprefix("Tell the story")
-                prompt = f"Continue telling the story{new_prompt}"
-            problem_block = send_story_generation(
-                prompt=prompt,
-                quest_name=quest.name,
-                context=context,
-            )
-            updated_problem_block = await_streamed_block(problem_block, context)
-            quest.current_problem = (
-                f"{quest.current_problem}\n{updated_problem_block.text}"
-            )
-
+        # The scene is set by the closing paragraph, where the challenge is introduced.
+        scene_description = last_paragraph(updated_problem_block.text)
+        # The scene streams into the chat history when it's ready; the player's turn doesn't wait for it.
+        # Images are waited on by the image scheduler; music is watched here.
         if image_gen := get_quest_background_image_generator(context):
             image_gen.request_scene_image_generation(
-                description=updated_problem_block.text, context=context
+                description=scene_description, context=context, wait=False
             )
         if music_gen := get_music_generator(context):
             if server_settings.generate_music:
-                music_gen.request_scene_music_generation(
-                    description=updated_problem_block.text, context=context
+                watch_task(
+                    music_gen.request_scene_music_generation(
+                        description=scene_description, context=context, wait=False
+                    ),
+                    "scene music",
                 )
 
     def is_solution_attempt(
@@ -463,22 +474,65 @@ class QuestAgent(InterruptiblePythonAgent):
         logging.debug(f"Is solution attempt: {is_solution_attempt_response.text}")
         return is_solution_attempt_response.text.upper() == "YES"
 
-    def evaluate_solution(
+    def evaluate_attempt(
         self, game_state: GameState, context: AgentContext, quest: Quest
-    ):
-        server_settings = get_server_settings(context)
-        prompt = (
+    ) -> Optional[bool]:
+        """Returns None if the latest action isn't an attempt to solve the problem, else whether the attempt succeeds.
+
+        With speculative evaluation, the likelihood is estimated while the attempt check runs. The estimate is a
+        scratch generation (see ScratchGeneration), prepared here so that the pool thread never touches the
+        context; one made for an action that turns out not to be an attempt is dropped without a trace, otherwise
+        it is emitted here, on the caller's thread.
+        """
+        if not get_server_settings(context).speculative_quest_evaluation:
+            if not self.is_solution_attempt(game_state, context, quest):
+                return None
+            return self.evaluate_solution(game_state, context, quest)
+
+        estimate = prepare_likelihood_estimation(
+            prompt=self._likelihood_prompt(game_state, quest),
+            quest_name=quest.name,
+            context=context,
+        )
+        likelihood = submit_generation(estimate.run)
+        try:
+            is_attempt = self.is_solution_attempt(game_state, context, quest)
+        except Exception:
+            likelihood.cancel()
+            raise
+        if not is_attempt:
+            likelihood.cancel()
+            return None
+        likelihood_block = likelihood.result()
+        emit(output=likelihood_block, context=context)
+        return self.roll_dice(likelihood_block.text, context, quest)
+
+    def _likelihood_prompt(self, game_state: GameState, quest: Quest) -> str:
+        return (
             f"{game_state.player.name} tries to solve the problem by: {quest.user_problem_solutions[-1]}. "
             f"How likely is this to succeed? "
             f"Please consider their abilities and whether any referenced objects are nearby or in their inventory. "
             f"ONLY RESPOND WITH ONE OF [VERY UNLIKELY, UNLIKELY, LIKELY, VERY LIKELY]"
         )
-        likelihood_block = generate_likelihood_estimation(
-            prompt=prompt,
+
+    def estimate_likelihood(
+        self, game_state: GameState, context: AgentContext, quest: Quest
+    ) -> Block:
+        return generate_likelihood_estimation(
+            prompt=self._likelihood_prompt(game_state, quest),
             quest_name=quest.name,
             context=context,
         )
-        likelihood_text = likelihood_block.text.upper()
+
+    def evaluate_solution(
+        self, game_state: GameState, context: AgentContext, quest: Quest
+    ):
+        likelihood_block = self.estimate_likelihood(game_state, context, quest)
+        return self.roll_dice(likelihood_block.text, context, quest)
+
+    def roll_dice(self, likelihood_text: str, context: AgentContext, quest: Quest) -> bool:
+        server_settings = get_server_settings(context)
+        likelihood_text = likelihood_text.upper()
         likelihood_map = LIKELIHOOD_MAP.get(server_settings.difficulty)
         if "VERY UNLIKELY" in likelihood_text:
             required_roll = likelihood_map[Likelihood.VERY_UNLIKELY]
@@ -523,7 +577,7 @@ class QuestAgent(InterruptiblePythonAgent):
         server_settings = get_server_settings(context=context)
         prompt = (
             f"{game_state.player.name} tries to solve the problem by: {quest.user_problem_solutions[-1]}, and it totally works.\n"
-            f"Describe what happens in one paragraph. As part of the description, DO NOT have "
+            f"Describe what happens in {paragraphs(num_paragraphs)}. As part of the description, DO NOT have "
             f"{game_state.player.name} completing the quest goal of {quest_goal}. "
             f"Tell the story using a tone of {server_settings.narrative_tone} and with a narrative voice of "
             f"{server_settings.narrative_voice}."
@@ -534,20 +588,6 @@ class QuestAgent(InterruptiblePythonAgent):
             context=context,
         )
         await_streamed_block(solution_block, context)
-        if num_paragraphs > 1:
-            prompt = (
-                f"Continue the story of {game_state.player.name} solving the problem by: {quest.user_problem_solutions[-1]}.\n"
-                f"Describe what happens in one paragraph. As part of the description, DO NOT have "
-                f"{game_state.player.name} completing the quest goal of {quest_goal}. "
-                f"Tell the story using a tone of {server_settings.narrative_tone} and with a narrative voice of "
-                f"{server_settings.narrative_voice}."
-            )
-            solution_block = send_story_generation(
-                prompt=prompt,
-                quest_name=quest.name,
-                context=context,
-            )
-            await_streamed_block(solution_block, context)
 
     def describe_failure(
         self, game_state: GameState, context: AgentContext, quest: Quest
@@ -556,7 +596,7 @@ class QuestAgent(InterruptiblePythonAgent):
         server_settings = get_server_settings(context=context)
         prompt = (
             f"{game_state.player.name} tries to solve the problem by: {quest.user_problem_solutions[-1]}, and it fails.\n"
-            f"Describe what happens in one short paragraph. "
+            f"Describe what happens in {paragraphs(num_paragraphs, short=True)}. "
             f"Tell the story using a tone of {server_settings.narrative_tone} and with a narrative voice of "
             f"{server_settings.narrative_voice}."
         )
@@ -566,19 +606,6 @@ class QuestAgent(InterruptiblePythonAgent):
             context=context,
         )
         await_streamed_block(solution_block, context)
-        if num_paragraphs > 1:
-            prompt = (
-                f"Continue telling the story of {game_state.player.name} failing to solve the problem by: {quest.user_problem_solutions[-1]}.\n"
-                f"Describe what happens in one short paragraph. "
-                f"Tell the story using a tone of {server_settings.narrative_tone} and with a narrative voice of "
-                f"{server_settings.narrative_voice}."
-            )
-            solution_block = send_story_generation(
-                prompt=prompt,
-                quest_name=quest.name,
-                context=context,
-            )
-            await_streamed_block(solution_block, context)
 
     def describe_non_solution(
         self, game_state: GameState, context: AgentContext, quest: Quest
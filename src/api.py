@@ -2,7 +2,6 @@ import json
 import logging
 import pathlib
 import textwrap
-import time
 from typing import Any, Dict, List, Optional, Type, Union, cast
 
 from pydantic import Field, fields
@@ -41,6 +40,7 @@ from schema.game_state import ActiveMode
 from schema.server_settings import ServerSettings
 from utils.agent_service import AgentService
 from utils.context_utils import get_game_state, get_server_settings, save_game_state, save_server_settings, with_deepinfra_key, with_openai_key
+from utils.stream_waiter import await_streams
 from utils.tags import TagKindExtensions
 from utils.context_utils import with_togetherai_key,with_falai_key,with_getimg_ai_key,with_deepinfra_key
 
@@ -362,16 +362,18 @@ class GameREPL(AgentREPL):
             context_keys={"id": "default"},
             searchable=False,
         )
+        new_blocks = [
+            block for block in context.chat_history.file.blocks
+            if block.index_in_file > self.last_seen_block
+        ]
+        streamed = await_streams(
+            [block for block in new_blocks if block.stream_state == StreamState.STARTED],
+            timeout_s=30,
+        )
+        finished = {block.id: block for block in streamed}
         for block in context.chat_history.file.blocks:
             if block.index_in_file > self.last_seen_block:
-                if block.stream_state == StreamState.STARTED:
-                    start_time = time.perf_counter()
-                    while (block.stream_state not in [
-                            StreamState.COMPLETE,
-                            StreamState.ABORTED,
-                    ] and (time.perf_counter() - start_time) < 30):
-                        time.sleep(0.4)
-                        block = Block.get(block.client, _id=block.id)
+                block = finished.get(block.id, block)
             self.print_new_img_block(block)
         self.last_seen_block = context.chat_history.file.blocks[
             -1].index_in_file
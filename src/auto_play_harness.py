@@ -27,6 +27,7 @@ from utils.context_utils import (
     save_server_settings,
 )
 from utils.dummy_generator import DummyGenerator
+from utils.stream_waiter import await_streams
 from utils.tags import QuestArcTag, QuestTag, TagKindExtensions
 from utils.generation_utils import generate_action_choices
 import json
@@ -90,16 +91,18 @@ class AutoPlayHarness:
             context_keys={"id": "default"},
             searchable=False,
         )
+        new_blocks = [
+            block for block in context.chat_history.file.blocks
+            if block.index_in_file > self.last_seen_block
+        ]
+        streamed = await_streams(
+            [block for block in new_blocks if block.stream_state == StreamState.STARTED],
+            timeout_s=30,
+        )
+        finished = {block.id: block for block in streamed}
         for block in context.chat_history.file.blocks:
             if block.index_in_file > self.last_seen_block:
-                if block.stream_state == StreamState.STARTED:
-                    start_time = time.perf_counter()
-                    while (block.stream_state not in [
-                            StreamState.COMPLETE,
-                            StreamState.ABORTED,
-                    ] and (time.perf_counter() - start_time) < 30):
-                        time.sleep(0.4)
-                        block = Block.get(block.client, _id=block.id)
+                block = finished.get(block.id, block)
                 for tag in block.tags:
                     if (tag.kind == TagKindExtensions.QUEST
                             and tag.name == QuestTag.QUEST_CONTENT):
@@ -8,7 +8,7 @@ from steamship.invocable.package_mixin import PackageMixin
 from generators.image_generators.avatar_generator import SelfieTool,SelfieToolFalAi
 
 from utils.context_utils import print_log
-from utils.generation_utils import generate_action_choices
+from utils.generation_utils import get_action_choices
 
 
 class HelpMixin(PackageMixin):
@@ -23,10 +23,13 @@ class HelpMixin(PackageMixin):
 
     @post("/generate_action_choices")
     def generate_action_choices(self, **kwargs) -> List[str]:
-        """Generate (synchronously) a JSON List of multiple choice options for user actions in a quest."""
+        """Generate a JSON List of multiple choice options for user actions in a quest.
+
+        Usually served from the choices prefetched when the last story block finished; otherwise generated now.
+        """
         try:
             context = self.agent_service.build_default_context()
-            choices_json_block = generate_action_choices(context=context)
+            choices_json_block = get_action_choices(context=context)
             cleaned_block_text = choices_json_block.text.split("\n\n")[0]
             choices = json.loads(choices_json_block.text)
             choices_data = choices.get("choices", [])
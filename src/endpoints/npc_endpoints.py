@@ -102,13 +102,10 @@ class NpcMixin(PackageMixin):
             new_item = Item(name=item[0], description=item[1], id=str(uuid.uuid4()))
             npc.inventory.append(new_item)
         if image_gen := get_item_image_generator(context):
-            tasks = []
-            for item in npc.inventory:
-                task = image_gen.request_item_image_generation(
-                    item=item, context=context
-                )
-                tasks.append(task)
-                block = task.wait().blocks[0]
-                item.picture_url = block.raw_data_url
+            tasks = image_gen.request_item_image_generations(
+                npc.inventory, context=context
+            )
+            for item, task in zip(npc.inventory, tasks, strict=True):
+                item.picture_url = task.output.blocks[0].raw_data_url
         save_game_state(game_state=game_state, context=context)
         return npc.inventory
@@ -21,6 +21,7 @@ from schema.server_settings_schema import SCHEMA
 from utils.agent_service import AgentService
 from utils.context_utils import get_server_settings, get_theme, save_server_settings
 from utils.generation_utils import print_log
+from utils.image_scheduler import IMAGE_PRIORITY_KEY, ImagePriority
 
 
 class ServerSettingsMixin(PackageMixin):
@@ -147,6 +148,8 @@ class ServerSettingsMixin(PackageMixin):
     ) -> Block:
         context = self.agent_service.build_default_context()
         self._update_server_settings(context, unsaved_server_settings)
+        # Previews wait behind any images players are waiting for.
+        context.metadata[IMAGE_PRIORITY_KEY] = ImagePriority.PREVIEW
 
         server_settings = get_server_settings(context)
 
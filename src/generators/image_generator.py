@@ -1,10 +1,27 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
 from pydantic.main import BaseModel
-from steamship import Task
+from steamship import Block, PluginInstance, Tag, Task, TaskState
 from steamship.agents.schema import AgentContext
+from steamship.data.operations.generator import GenerateResponse
 
 from schema.objects import Item
+from utils.context_utils import get_server_settings
+from utils.image_cache import cache_image, get_cached_image, image_key, image_seed
+from utils.image_scheduler import (
+    IMAGE_PRIORITY_KEY,
+    ImagePriority,
+    image_job_key,
+    schedule_image_job,
+)
+
+# A merchant's whole inventory renders at once.
+ITEM_IMAGE_CONCURRENCY = 5
+_ITEM_IMAGE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=ITEM_IMAGE_CONCURRENCY, thread_name_prefix="item-images"
+)
 
 
 class ImageGenerator(BaseModel, ABC):
@@ -12,14 +29,30 @@ class ImageGenerator(BaseModel, ABC):
     def request_item_image_generation(self, item: Item, context: AgentContext) -> Task:
         pass
 
+    def request_item_image_generations(
+        self, items: List[Item], context: AgentContext
+    ) -> List[Task]:
+        """Request images for several items at once, returning their completed tasks in the order of `items`."""
+        futures = [
+            _ITEM_IMAGE_EXECUTOR.submit(
+                self.request_item_image_generation, item=item, context=context
+            )
+            for item in items
+        ]
+        tasks = [future.result() for future in futures]
+        for task in tasks:
+            task.wait()
+        return tasks
+
     @abstractmethod
     def request_profile_image_generation(self, context: AgentContext) -> Task:
         pass
 
     @abstractmethod
     def request_scene_image_generation(
-        self, description: str, context: AgentContext
+        self, description: str, context: AgentContext, wait: bool = True
     ) -> Task:
+        """With `wait=False`, returns the pending task at once; the image streams into the chat history when ready."""
         pass
 
     @abstractmethod
@@ -36,3 +69,74 @@ class ImageGenerator(BaseModel, ABC):
     ) -> Task:
         """Request character image generation. This is for static generation from the editor."""
         pass
+
+
+def generate_image(
+    context: AgentContext,
+    plugin: PluginInstance,
+    provider: str,
+    prompt: str,
+    options: dict,
+    tags: Optional[List[Tag]] = None,
+    theme_seed: Optional[int] = None,
+    wait: bool = True,
+    streaming: bool = True,
+    priority: ImagePriority = ImagePriority.SCENE,
+) -> Task:
+    """Generate an image with `plugin` into the chat history, through the image job scheduler.
+
+    In the deterministic seed mode, the seed is fixed and identical requests are served from the image cache
+    without calling `plugin`.
+    """
+    cache_key = None
+    if get_server_settings(context).deterministic_image_seeds:
+        options = {**options, "seed": image_seed(prompt, theme_seed)}
+        cache_key = image_key(provider, prompt, options)
+        if cached := get_cached_image(cache_key):
+            return _cached_image_task(context, cached, tags)
+
+    output_file_id = context.chat_history.file.id
+    return schedule_image_job(
+        provider=provider,
+        priority=context.metadata.get(IMAGE_PRIORITY_KEY, priority),
+        key=image_job_key(provider, prompt, options, output_file_id, tags),
+        submit=lambda: plugin.generate(
+            text=prompt,
+            tags=tags,
+            streaming=streaming,
+            append_output_to_file=True,
+            output_file_id=output_file_id,
+            make_output_public=True,
+            options=options,
+        ),
+        wait=wait,
+        on_complete=(
+            (lambda done: _cache_generated_image(cache_key, done)) if cache_key else None
+        ),
+    )
+
+
+def _cache_generated_image(key: str, task: Task):
+    if task.state == TaskState.succeeded and task.output and task.output.blocks:
+        block = task.output.blocks[0]
+        cache_image(key, block.raw_data_url, block.mime_type)
+
+
+def _cached_image_task(
+    context: AgentContext, cached: Tuple[str, Optional[str]], tags: Optional[List[Tag]]
+) -> Task:
+    """A completed task whose output is a copy of the cached image, appended to the chat history like a new one."""
+    url, mime_type = cached
+    block = Block.create(
+        context.client,
+        file_id=context.chat_history.file.id,
+        tags=tags,
+        url=url,
+        mime_type=mime_type,
+        public_data=True,
+    )
+    return Task(
+        client=context.client,
+        state=TaskState.succeeded,
+        output=GenerateResponse(blocks=[block]),
+    )
@@ -8,6 +8,9 @@ import logging
 import os
 import re
 from utils.context_utils import print_log
+from generators.image_generator import generate_image
+from utils.image_scheduler import ImagePriority
+from utils.plugin_pool import use_pooled_plugin
 
 class SelfieToolFalAi(ImageGeneratorTool):
 
@@ -62,7 +65,8 @@ class SelfieToolFalAi(ImageGeneratorTool):
             }
 
 
-        image_generator = context.client.use_plugin(
+        image_generator = use_pooled_plugin(
+            context.client,
             plugin_handle=self.generator_plugin_handle,
             config=self.generator_plugin_config,
             version="1.0.5")
@@ -73,15 +77,15 @@ class SelfieToolFalAi(ImageGeneratorTool):
 
 
 
-        task = image_generator.generate(
-            text=prompt,
-            make_output_public=True,
-            append_output_to_file=True,
-            streaming=stream,
-            output_file_id=context.chat_history.file.id,
+        task = generate_image(
+            context,
+            image_generator,
+            provider=self.generator_plugin_handle,
+            prompt=prompt,
             options=options,
+            streaming=stream,
+            priority=ImagePriority.CHAT,
         )
-        task.wait()
         blocks = task.output.blocks
         output_blocks = []
 
@@ -123,7 +127,8 @@ class SelfieTool(ImageGeneratorTool):
 
 
         self.generator_plugin_config["api_key"] = context.metadata[_GETIMG_AI_API_KEY]
-        image_generator = context.client.use_plugin(
+        image_generator = use_pooled_plugin(
+            context.client,
             plugin_handle=self.generator_plugin_handle,
             config=self.generator_plugin_config,
             version="1.0.2")
@@ -136,15 +141,15 @@ class SelfieTool(ImageGeneratorTool):
             "negative_prompt": current_negative_prompt
         }
         #print_log(str(options))
-        task = image_generator.generate(
-            text=prompt,
-            make_output_public=True,
-            append_output_to_file=True,
-            output_file_id=context.chat_history.file.id,
-            streaming=stream,
+        task = generate_image(
+            context,
+            image_generator,
+            provider=self.generator_plugin_handle,
+            prompt=prompt,
             options=options,
+            streaming=stream,
+            priority=ImagePriority.CHAT,
         )
-        task.wait()
         blocks = task.output.blocks
         output_blocks = []
 
@@ -7,10 +7,12 @@ from steamship import PluginInstance, SteamshipError, Tag, Task
 from steamship.agents.schema import AgentContext
 from steamship.data import TagValueKey
 
-from generators.image_generator import ImageGenerator
+from generators.image_generator import ImageGenerator, generate_image
 from schema.image_theme import CustomStableDiffusionTheme, StableDiffusionTheme
 from schema.objects import Item
 from utils.context_utils import get_game_state, get_server_settings, get_theme
+from utils.image_scheduler import ImagePriority
+from utils.plugin_pool import use_pooled_plugin
 from utils.tags import (
     CampTag,
     CharacterTag,
@@ -34,19 +36,19 @@ class CustomStableDiffusionWithLorasImageGenerator(ImageGenerator):
 
     def get_theme(self, theme_name: str, context) -> CustomStableDiffusionTheme:
         #server_settings = get_server_settings(context)
-        theme = get_theme(theme_name, context)
+        theme = get_theme(theme_name, context, CustomStableDiffusionTheme)
         if theme.is_dalle:
             raise SteamshipError(
                 f"Theme {theme_name} is DALL-E but this is the SD Generator"
             )
-        d = theme.dict()
-        return CustomStableDiffusionTheme.parse_obj(d)
+        return theme
 
     def _get_plugin_instance(self, context: AgentContext):
         self.generator_plugin_config["api_key"] = context.metadata[_FALAI_API_KEY]
         
         if self.plugin_instance is None:
-            self.plugin_instance = context.client.use_plugin(
+            self.plugin_instance = use_pooled_plugin(
+                context.client,
                 plugin_handle=CustomStableDiffusionWithLorasImageGenerator.PLUGIN_HANDLE,
                 config=self.generator_plugin_config,
                 version=self.version,
@@ -62,6 +64,8 @@ class CustomStableDiffusionWithLorasImageGenerator(ImageGenerator):
         template_vars: dict,
         image_size: str,
         tags: List[Tag],
+        wait: bool = True,
+        priority: ImagePriority = ImagePriority.SCENE,
     ) -> Task:
         sd = self._get_plugin_instance(context)
 
@@ -92,17 +96,17 @@ class CustomStableDiffusionWithLorasImageGenerator(ImageGenerator):
         start = time.perf_counter()
         #logging.warning("Image theme: " + str(theme))
         #print_log(f"Generating image for Custom Fal Theme {theme.name}: "+str(prompt)+"\nNegative prompt: "+str(negative_prompt))
-        task = sd.generate(
-            text=prompt.strip(),
-            tags=tags,
-            streaming=True,
-            append_output_to_file=True,
-            output_file_id=context.chat_history.file.id,
-            make_output_public=True,
+        task = generate_image(
+            context=context,
+            plugin=sd,
+            provider=self.PLUGIN_HANDLE,
+            prompt=prompt.strip(),
             options=options,
+            tags=tags,
+            theme_seed=theme.seed,
+            wait=wait,
+            priority=priority,
         )
-        logging.debug(f"Innermost generate start task: {time.perf_counter()-start}")
-        task.wait(retry_delay_s=0.1)
         logging.debug(f"Innermost generate after wait: {time.perf_counter() - start}")
         return task
 
@@ -134,6 +138,7 @@ class CustomStableDiffusionWithLorasImageGenerator(ImageGenerator):
             },
             image_size="square_hd",
             tags=tags,
+            priority=ImagePriority.ITEM,
         )
         return task
 
@@ -188,11 +193,12 @@ class CustomStableDiffusionWithLorasImageGenerator(ImageGenerator):
             },
             image_size="portrait_4_3",
             tags=[],  # no tags, as this shouldn't be used in chathistory for anything else (at the moment)
+            priority=ImagePriority.PREVIEW,
         )
         return task
 
     def request_scene_image_generation(
-        self, description: str, context: AgentContext
+        self, description: str, context: AgentContext, wait: bool = True
     ) -> Task:
         game_state = get_game_state(context)
         server_settings = get_server_settings(context)
@@ -215,6 +221,7 @@ class CustomStableDiffusionWithLorasImageGenerator(ImageGenerator):
             },
             image_size="landscape_16_9",
             tags=tags,
+            wait=wait,
         )
         return task
 
@@ -257,10 +264,11 @@ class CustomStableDiffusionWithLorasImageGenerator(ImageGenerator):
             },
             image_size="landscape_16_9",
             tags=tags,
+            priority=ImagePriority.PREVIEW,
         )
         return task
 
-    def request_chat_image_generation(self, description: str,context: AgentContext) -> Task:
+    def request_chat_image_generation(self, description: str,context: AgentContext, wait: bool = True) -> Task:
         game_state = get_game_state(context)
         server_settings = get_server_settings(context)
 
@@ -288,5 +296,7 @@ class CustomStableDiffusionWithLorasImageGenerator(ImageGenerator):
             },
             image_size="portrait_4_3", #'{\"height\": 1152,\"width\":896 }'
             tags=tags,
+            wait=wait,
+            priority=ImagePriority.CHAT,
         )
         return task
\ No newline at end of file
@@ -8,6 +8,13 @@ from generators.image_generator import ImageGenerator
 from schema.image_theme import DalleTheme
 from schema.objects import Item
 from utils.context_utils import get_game_state, get_server_settings, get_theme
+from utils.image_scheduler import (
+    IMAGE_PRIORITY_KEY,
+    ImagePriority,
+    image_job_key,
+    schedule_image_job,
+)
+from utils.plugin_pool import use_pooled_plugin
 from utils.tags import (
     CampTag,
     CharacterTag,
@@ -23,13 +30,12 @@ class DalleImageGenerator(ImageGenerator):
     PLUGIN_HANDLE: Final[str] = "dall-e"
 
     def get_theme(self, theme_name: str, context) -> DalleTheme:
-        theme = get_theme(theme_name, context)
+        theme = get_theme(theme_name, context, DalleTheme)
         if not theme.is_dalle:
             raise SteamshipError(
                 f"Theme {theme_name} is not DALL-E but this is the DALL-E Generator"
             )
-        d = theme.dict()
-        return DalleTheme.parse_obj(d)
+        return theme
 
     def generate(
         self,
@@ -39,6 +45,7 @@ class DalleImageGenerator(ImageGenerator):
         template_vars: dict,
         image_size: str,
         tags: List[Tag],
+        priority: ImagePriority = ImagePriority.SCENE,
     ) -> Task:
         theme = self.get_theme(theme_name, context)
         prompt = theme.make_prompt(prompt, template_vars)
@@ -52,24 +59,39 @@ class DalleImageGenerator(ImageGenerator):
         if theme.model == "dall-e-2":
             image_size = "1024x1024"
 
-        # TODO(doug): cache plugin instance by client workspace
-        dalle = context.client.use_plugin(
+        config = {
+            "model": theme.model,
+            "size": image_size,
+            "quality": theme.quality,
+        }
+        dalle = use_pooled_plugin(
+            context.client,
             DalleImageGenerator.PLUGIN_HANDLE,
-            config={
-                "model": theme.model,
-                "size": image_size,
-                "quality": theme.quality,
-            },
+            config=config,
         )
 
-        return dalle.generate(
-            text=prompt,
-            tags=tags,
-            streaming=True,
-            append_output_to_file=True,
-            output_file_id=context.chat_history.file.id,
-            make_output_public=True,
-            options=options,
+        # DALL-E can't be seeded, so it skips the image cache; the callers wait on the task.
+        output_file_id = context.chat_history.file.id
+        return schedule_image_job(
+            provider=DalleImageGenerator.PLUGIN_HANDLE,
+            priority=context.metadata.get(IMAGE_PRIORITY_KEY, priority),
+            key=image_job_key(
+                DalleImageGenerator.PLUGIN_HANDLE,
+                prompt,
+                {**options, **config},
+                output_file_id,
+                tags,
+            ),
+            submit=lambda: dalle.generate(
+                text=prompt,
+                tags=tags,
+                streaming=True,
+                append_output_to_file=True,
+                output_file_id=output_file_id,
+                make_output_public=True,
+                options=options,
+            ),
+            wait=False,
         )
 
     def request_item_image_generation(self, item: Item,
@@ -99,6 +121,7 @@ class DalleImageGenerator(ImageGenerator):
             },
             image_size="1024x1024",
             tags=tags,
+            priority=ImagePriority.ITEM,
         )
 
         task.wait()
@@ -154,13 +177,15 @@ class DalleImageGenerator(ImageGenerator):
             },
             image_size="1024x1792",
             tags=[],  # no tags, as this is strictly for in-editor usage.
+            priority=ImagePriority.PREVIEW,
         )
 
         task.wait()
         return task
 
     def request_scene_image_generation(self, description: str,
-                                       context: AgentContext) -> Task:
+                                       context: AgentContext,
+                                       wait: bool = True) -> Task:
         game_state = get_game_state(context)
         server_settings = get_server_settings(context)
 
@@ -183,7 +208,8 @@ class DalleImageGenerator(ImageGenerator):
             tags=tags,
         )
 
-        task.wait()
+        if wait:
+            task.wait()
         return task
 
     def request_camp_image_generation(self, context: AgentContext) -> Task:
@@ -228,6 +254,7 @@ class DalleImageGenerator(ImageGenerator):
             },
             image_size="1024x1792",
             tags=tags,
+            priority=ImagePriority.PREVIEW,
         )
         task.wait()
         return task
@@ -7,11 +7,13 @@ from steamship import PluginInstance, SteamshipError, Tag, Task
 from steamship.agents.schema import AgentContext
 from steamship.data import TagValueKey
 
-from generators.image_generator import ImageGenerator
+from generators.image_generator import ImageGenerator, generate_image
 from schema.image_theme import FluxTheme, StableDiffusionTheme
 from schema.objects import Item
 from utils.context_utils import get_game_state, get_server_settings, get_theme
 from utils.generation_utils import print_log
+from utils.image_scheduler import ImagePriority
+from utils.plugin_pool import use_pooled_plugin
 from utils.tags import (
     CampTag,
     CharacterTag,
@@ -35,19 +37,19 @@ class FluxImageGenerator(ImageGenerator):
 
     def get_theme(self, theme_name: str, context) -> FluxTheme:
         #server_settings = get_server_settings(context)
-        theme = get_theme(theme_name, context)
+        theme = get_theme(theme_name, context, FluxTheme)
         if theme.is_dalle:
             raise SteamshipError(
                 f"Theme {theme_name} is DALL-E but this is the SD Generator")
-        d = theme.dict()
-        return FluxTheme.parse_obj(d)
+        return theme
 
     def _get_plugin_instance(self, context: AgentContext):
         self.generator_plugin_config["api_key"] = context.metadata[
             _FALAI_API_KEY]
 
         if self.plugin_instance is None:
-            self.plugin_instance = context.client.use_plugin(  #Need to update FAL plugin to support Flux api path!!
+            self.plugin_instance = use_pooled_plugin(  #Need to update FAL plugin to support Flux api path!!
+                context.client,
                 plugin_handle=FluxImageGenerator.PLUGIN_HANDLE,
                 config=self.generator_plugin_config,
                 version=self.version)
@@ -62,6 +64,8 @@ class FluxImageGenerator(ImageGenerator):
         template_vars: dict,
         image_size: str,
         tags: List[Tag],
+        wait: bool = True,
+        priority: ImagePriority = ImagePriority.SCENE,
     ) -> Task:
         sd = self._get_plugin_instance(context)
 
@@ -85,18 +89,17 @@ class FluxImageGenerator(ImageGenerator):
         start = time.perf_counter()
         #logging.warning("Image theme: " + str(theme))
         #print_log("Generating image for Flux: "+str(prompt))
-        task = sd.generate(
-            text=prompt,
-            tags=tags,
-            streaming=True,
-            append_output_to_file=True,
-            output_file_id=context.chat_history.file.id,
-            make_output_public=True,
+        task = generate_image(
+            context=context,
+            plugin=sd,
+            provider=self.PLUGIN_HANDLE,
+            prompt=prompt,
             options=options,
+            tags=tags,
+            theme_seed=theme.seed,
+            wait=wait,
+            priority=priority,
         )
-        logging.debug(
-            f"Innermost generate start task: {time.perf_counter()-start}")
-        task.wait(retry_delay_s=0.1)
         logging.debug(
             f"Innermost generate after wait: {time.perf_counter() - start}")
         return task
@@ -130,6 +133,7 @@ class FluxImageGenerator(ImageGenerator):
             },
             image_size="square_hd",
             tags=tags,
+            priority=ImagePriority.ITEM,
         )
         return task
 
@@ -184,11 +188,13 @@ class FluxImageGenerator(ImageGenerator):
             image_size="portrait_4_3",
             tags=
             [],  # no tags, as this shouldn't be used in chathistory for anything else (at the moment)
+            priority=ImagePriority.PREVIEW,
         )
         return task
 
     def request_scene_image_generation(self, description: str,
-                                       context: AgentContext) -> Task:
+                                       context: AgentContext,
+                                       wait: bool = True) -> Task:
         game_state = get_game_state(context)
         server_settings = get_server_settings(context)
 
@@ -211,6 +217,7 @@ class FluxImageGenerator(ImageGenerator):
             },
             image_size="landscape_16_9",
             tags=tags,
+            wait=wait,
         )
         return task
 
@@ -256,11 +263,13 @@ class FluxImageGenerator(ImageGenerator):
             },
             image_size="landscape_16_9",
             tags=tags,
+            priority=ImagePriority.PREVIEW,
         )
         return task
 
     def request_chat_image_generation(self, description: str,
-                                      context: AgentContext) -> Task:
+                                      context: AgentContext,
+                                      wait: bool = True) -> Task:
         game_state = get_game_state(context)
         server_settings = get_server_settings(context)
 
@@ -287,5 +296,7 @@ class FluxImageGenerator(ImageGenerator):
             },
             image_size="portrait_4_3",
             tags=tags,
+            wait=wait,
+            priority=ImagePriority.CHAT,
         )
         return task
@@ -7,10 +7,12 @@ from steamship import PluginInstance, SteamshipError, Tag, Task
 from steamship.agents.schema import AgentContext
 from steamship.data import TagValueKey
 
-from generators.image_generator import ImageGenerator
+from generators.image_generator import ImageGenerator, generate_image
 from schema.image_theme import StableDiffusionTheme
 from schema.objects import Item
 from utils.context_utils import get_game_state, get_server_settings, get_theme
+from utils.image_scheduler import ImagePriority
+from utils.plugin_pool import use_pooled_plugin
 from utils.tags import (
     CampTag,
     CharacterTag,
@@ -29,17 +31,17 @@ class StableDiffusionWithLorasImageGenerator(ImageGenerator):
     plugin_instance: Optional[PluginInstance] = None
 
     def get_theme(self, theme_name: str, context) -> StableDiffusionTheme:
-        theme = get_theme(theme_name, context)
+        theme = get_theme(theme_name, context, StableDiffusionTheme)
         if theme.is_dalle:
             raise SteamshipError(
                 f"Theme {theme_name} is DALL-E but this is the SD Generator"
             )
-        d = theme.dict()
-        return StableDiffusionTheme.parse_obj(d)
+        return theme
 
     def _get_plugin_instance(self, context: AgentContext):
         if self.plugin_instance is None:
-            self.plugin_instance = context.client.use_plugin(
+            self.plugin_instance = use_pooled_plugin(
+                context.client,
                 StableDiffusionWithLorasImageGenerator.PLUGIN_HANDLE
             )
         return self.plugin_instance
@@ -53,6 +55,8 @@ class StableDiffusionWithLorasImageGenerator(ImageGenerator):
         template_vars: dict,
         image_size: str,
         tags: List[Tag],
+        wait: bool = True,
+        priority: ImagePriority = ImagePriority.SCENE,
     ) -> Task:
         sd = self._get_plugin_instance(context)
 
@@ -80,17 +84,17 @@ class StableDiffusionWithLorasImageGenerator(ImageGenerator):
         start = time.perf_counter()
         #logging.warning("Image theme: " + str(theme))
         #print_log("Generating image for Fal: "+str(prompt)+"\nNegative prompt: "+str(negative_prompt))
-        task = sd.generate(
-            text=prompt,
-            tags=tags,
-            streaming=True,
-            append_output_to_file=True,
-            output_file_id=context.chat_history.file.id,
-            make_output_public=True,
+        task = generate_image(
+            context=context,
+            plugin=sd,
+            provider=self.PLUGIN_HANDLE,
+            prompt=prompt,
             options=options,
+            tags=tags,
+            theme_seed=theme.seed,
+            wait=wait,
+            priority=priority,
         )
-        logging.debug(f"Innermost generate start task: {time.perf_counter()-start}")
-        task.wait(retry_delay_s=0.1)
         logging.debug(f"Innermost generate after wait: {time.perf_counter() - start}")
         return task
 
@@ -122,6 +126,7 @@ class StableDiffusionWithLorasImageGenerator(ImageGenerator):
             },
             image_size="square_hd",
             tags=tags,
+            priority=ImagePriority.ITEM,
         )
         return task
 
@@ -176,11 +181,12 @@ class StableDiffusionWithLorasImageGenerator(ImageGenerator):
             },
             image_size="portrait_4_3",
             tags=[],  # no tags, as this shouldn't be used in chathistory for anything else (at the moment)
+            priority=ImagePriority.PREVIEW,
         )
         return task
 
     def request_scene_image_generation(
-        self, description: str, context: AgentContext
+        self, description: str, context: AgentContext, wait: bool = True
     ) -> Task:
         game_state = get_game_state(context)
         server_settings = get_server_settings(context)
@@ -203,6 +209,7 @@ class StableDiffusionWithLorasImageGenerator(ImageGenerator):
             },
             image_size="landscape_16_9",
             tags=tags,
+            wait=wait,
         )
         return task
 
@@ -245,10 +252,11 @@ class StableDiffusionWithLorasImageGenerator(ImageGenerator):
             },
             image_size="landscape_16_9",
             tags=tags,
+            priority=ImagePriority.PREVIEW,
         )
         return task
 
-    def request_chat_image_generation(self, description: str,context: AgentContext) -> Task:
+    def request_chat_image_generation(self, description: str,context: AgentContext, wait: bool = True) -> Task:
         game_state = get_game_state(context)
         server_settings = get_server_settings(context)
 
@@ -274,5 +282,7 @@ class StableDiffusionWithLorasImageGenerator(ImageGenerator):
             },
             image_size="portrait_4_3",
             tags=tags,
+            wait=wait,
+            priority=ImagePriority.CHAT,
         )
         return task
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""Registry of the text generation models the game can use, and the plugins that serve them.
+
+Each model name maps to a `ModelSpec` describing its provider, the plugin handle and version that serve it, the
+config field its API key goes in, and the sampling parameters it accepts beyond the common ones. The tables are built
+once at import, so resolving a model is a dictionary lookup.
+
+The story and reasoning generators accept slightly different sets of models, so each has its own table.
+"""
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+
+class ModelProvider(str, Enum):
+    OPENAI = "openai"
+    REPLICATE = "replicate"
+    TOGETHER = "together"
+    DEEPINFRA = "deepinfra"
+
+
+class ModelSpec(BaseModel):
+    name: str
+    provider: ModelProvider
+    plugin_handle: str
+    plugin_version: Optional[str] = None
+    api_key_field: Optional[str] = None
+    """The plugin config field that receives the provider's API key."""
+
+    extra_sampling_params: Tuple[str, ...] = ()
+    """Sampling parameters (named as on ServerSettings) supported beyond temperature, top_p and the penalties."""
+
+    def story_config(self, server_settings: "ServerSettings") -> dict:  # noqa: F821
+        config = {
+            "model": self.name,
+            "max_tokens": server_settings.default_story_max_tokens,
+            "temperature": server_settings.default_story_temperature,
+            "top_p": server_settings.top_p,
+            "frequency_penalty": server_settings.frequency_penalty,
+            "presence_penalty": server_settings.presence_penalty,
+        }
+        for param in self.extra_sampling_params:
+            config[param] = getattr(server_settings, param)
+        return config
+
+    def reasoning_config(self, server_settings: "ServerSettings") -> dict:  # noqa: F821
+        # The same model the reasoning prompts are counted and budgeted for (see `get_reasoning_model_name`).
+        return {
+            "model": self.name,
+            "max_tokens": 512,
+            "temperature": server_settings.reasoning_temperature,
+        }
+
+
+# Provider -> (plugin handle, plugin version, api key config field, extra sampling params)
+_PROVIDERS: Dict[ModelProvider, Tuple[str, Optional[str], Optional[str], Tuple[str, ...]]] = {
+    ModelProvider.OPENAI: ("gpt-4", "0.1.4", "openai_api_key", ()),
+    ModelProvider.REPLICATE: ("replicate-llm", None, None, ("min_p", "repetition_penalty")),
+    ModelProvider.TOGETHER: ("together-ai-generator", "1.0.2", "api_key", ("min_p", "repetition_penalty")),
+    ModelProvider.DEEPINFRA: ("deepinfra-generator", "1.0.0", "api_key", ("min_p", "repetition_penalty")),
+}
+
+_OPENAI_MODELS = [
+    "gpt-3.5-turbo",
+    "gpt-4-1106-preview",
+    "gpt-4",
+    "gpt-3.5-turbo-0613",
+    "gpt-4o-mini",
+]
+_REPLICATE_MODELS = ["dolly_v2", "llama_v2"]
+
+
+def _build_registry(models: List[Tuple[ModelProvider, List[str]]]) -> Dict[str, ModelSpec]:
+    registry = {}
+    for provider, names in models:
+        plugin_handle, plugin_version, api_key_field, extra_sampling_params = _PROVIDERS[provider]
+        for name in names:
+            # The first provider listed for a model serves it.
+            registry.setdefault(
+                name,
+                ModelSpec(
+                    name=name,
+                    provider=provider,
+                    plugin_handle=plugin_handle,
+                    plugin_version=plugin_version,
+                    api_key_field=api_key_field,
+                    extra_sampling_params=extra_sampling_params,
+                ),
+            )
+    return registry
+
+
+STORY_MODELS: Dict[str, ModelSpec] = _build_registry(
+    [
+        (ModelProvider.OPENAI, _OPENAI_MODELS),
+        (ModelProvider.REPLICATE, _REPLICATE_MODELS),
+        (
+            ModelProvider.TOGETHER,
+            [
+                "NousResearch/Nous-Hermes-2-Yi-34B",
+                "NousResearch/Nous-Hermes-2-Mixtral-8x7B-DPO",
+                "mistralai/Mixtral-8x7B-Instruct-v0.1",
+                "Gryphe/MythoMax-L2-13b",
+                "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
+            ],
+        ),
+        (
+            ModelProvider.DEEPINFRA,
+            [
+                "Sao10K/L3-70B-Euryale-v2.1",
+                "Sao10K/L3.1-70B-Euryale-v2.2",
+                "lizpreciatior/lzlv_70b_fp16_hf",
+                "cognitivecomputations/dolphin-2.9.1-llama-3-70b",
+                "Austism/chronos-hermes-13b-v2",
+                "mistralai/Mistral-Nemo-Instruct-2407",
+            ],
+        ),
+    ]
+)
+
+REASONING_MODELS: Dict[str, ModelSpec] = _build_registry(
+    [
+        (ModelProvider.OPENAI, _OPENAI_MODELS),
+        (ModelProvider.REPLICATE, _REPLICATE_MODELS),
+        (
+            ModelProvider.TOGETHER,
+            [
+                "NousResearch/Nous-Hermes-2-Yi-34B",
+                "NousResearch/Nous-Hermes-2-Mixtral-8x7B-DPO",
+                "NousResearch/Nous-Hermes-2-Mixtral-8x7B-SFT",
+                "mistralai/Mixtral-8x7B-Instruct-v0.1",
+                "teknium/OpenHermes-2p5-Mistral-7B",
+                "cognitivecomputations/dolphin-2.5-mixtral-8x7b",
+                "Gryphe/MythoMax-L2-13b",
+                "teknium/OpenHermes-2-Mistral-7B",
+                "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
+            ],
+        ),
+        (
+            ModelProvider.DEEPINFRA,
+            [
+                "Sao10K/L3-70B-Euryale-v2.1",
+                "Sao10K/L3.1-70B-Euryale-v2.2",
+                "lizpreciatior/lzlv_70b_fp16_hf",
+                "mistralai/Mixtral-8x7B-Instruct-v0.1",
+                "Austism/chronos-hermes-13b-v2",
+                "mistralai/Mistral-Nemo-Instruct-2407",
+            ],
+        ),
+    ]
+)
+
+# Story models tried, in order, when the selected one fails and ServerSettings.allow_backup_story_models is set.
+BACKUP_STORY_PLUGIN_HANDLE = "gpt-3.5-turbo"
+BACKUP_STORY_MODELS: List[str] = list(_OPENAI_MODELS)
@@ -8,8 +8,9 @@ from steamship.agents.schema import AgentContext
 class MusicGenerator(BaseModel, ABC):
     @abstractmethod
     def request_scene_music_generation(
-        self, description: str, context: AgentContext
+        self, description: str, context: AgentContext, wait: bool = True
     ) -> Task:
+        """With `wait=False`, returns the pending task at once; the music streams into the chat history when ready."""
         pass
 
     @abstractmethod
@@ -6,6 +6,7 @@ from steamship.agents.schema import AgentContext
 from generators.music_generator import MusicGenerator
 from generators.utils import safe_format
 from utils.context_utils import get_game_state, get_server_settings
+from utils.plugin_pool import use_pooled_plugin
 from utils.tags import CampTag, QuestIdTag, SceneTag, StoryContextTag, TagKindExtensions
 
 
@@ -13,12 +14,14 @@ class MetaMusicGenerator(MusicGenerator):
     PLUGIN_HANDLE: Final[str] = "music-generator"
 
     def request_scene_music_generation(
-        self, description: str, context: AgentContext
+        self, description: str, context: AgentContext, wait: bool = True
     ) -> Task:
         game_state = get_game_state(context)
         server_settings = get_server_settings(context)
-        music_gen = context.client.use_plugin(
-            self.PLUGIN_HANDLE, config={"duration": server_settings.music_duration}
+        music_gen = use_pooled_plugin(
+            context.client,
+            self.PLUGIN_HANDLE,
+            config={"duration": server_settings.music_duration},
         )
 
         prompt = safe_format(
@@ -43,14 +46,17 @@ class MetaMusicGenerator(MusicGenerator):
             make_output_public=True,
             tags=tags,
         )
-        task.wait()
+        if wait:
+            task.wait()
         return task
 
     def request_camp_music_generation(self, context: AgentContext) -> Task:
         game_state = get_game_state(context)
         server_settings = get_server_settings(context)
-        music_gen = context.client.use_plugin(
-            self.PLUGIN_HANDLE, config={"duration": server_settings.music_duration}
+        music_gen = use_pooled_plugin(
+            context.client,
+            self.PLUGIN_HANDLE,
+            config={"duration": server_settings.music_duration},
         )
 
         prompt = safe_format(
@@ -449,6 +449,15 @@ class ServerSettings(BaseModel):
         "If the primary model for stories is unavailable, allow falling back to other models.",
         type="boolean",
     )
+    speculative_quest_evaluation: bool = SettingField(
+        default=True,
+        label="Speculative quest evaluation",
+        description=
+        "Estimate how likely a player's action is to succeed while still deciding whether it is an attempt to solve "
+        "the problem, instead of one after the other. Faster turns, at the cost of an unused estimate on "
+        "investigative actions.",
+        type="boolean",
+    )
 
     auto_start_first_quest: Optional[bool] = SettingField(
         default=False,
@@ -1247,6 +1256,14 @@ Can include descriptions of genre, characters, specific items and locations that
         default="realistic_vision_v3",
         include_dynamic_options="image-themes",
     )
+    deterministic_image_seeds: bool = SettingField(
+        default=False,
+        label="Deterministic image seeds",
+        description=
+        "Seed image generation from the theme's seed (or, if it has none, from the prompt) so the same request always "
+        "renders the same image. Repeated requests are then served from the image cache instead of regenerated.",
+        type="boolean",
+    )
 
     game_engine_version: Optional[str] = SettingField(
         default=None,
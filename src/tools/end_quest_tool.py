@@ -23,6 +23,7 @@ from utils.generation_utils import (
     generate_quest_item,
     generate_quest_summary,
     send_agent_status_message,
+    submit_generation,
 )
 from utils.tags import AgentStatusMessageTag, CharacterTag, TagKindExtensions
 
@@ -80,11 +81,19 @@ class EndQuestTool(Tool):
 
         player = game_state.player
 
+        # Item images render together while the summary is written; they are collected before the quest is closed.
+        item_images = None
+
         if not failed:
             # Let's do some things to tidy up.
 
             # matching description (hopefully)
-            quest_description = game_state.quest_arc[len(game_state.quests) - 1]
+            quest_index = len(game_state.quests) - 1
+            quest_description = (
+                game_state.quest_arc[quest_index]
+                if quest_index < len(game_state.quest_arc)
+                else None
+            )
 
             new_items = []
 
@@ -99,14 +108,6 @@ class EndQuestTool(Tool):
                     item.description = prescribed_item.description
                     if item.name:
                         new_items.append(item)
-
-                    if image_gen := get_item_image_generator(context):
-                        task = image_gen.request_item_image_generation(
-                            item=item, context=context
-                        )
-                        item_image_block = task.wait().blocks[0]
-                        context.chat_history.file.refresh()
-                        item.picture_url = item_image_block.raw_data_url
             else:
                 (
                     item_name,
@@ -122,13 +123,10 @@ class EndQuestTool(Tool):
                 if item.name:
                     new_items.append(item)
 
-                if image_gen := get_item_image_generator(context):
-                    task = image_gen.request_item_image_generation(
-                        item=item, context=context
-                    )
-                    item_image_block = task.wait().blocks[0]
-                    context.chat_history.file.refresh()
-                    item.picture_url = item_image_block.raw_data_url
+            if new_items and (image_gen := get_item_image_generator(context)):
+                item_images = submit_generation(
+                    image_gen.request_item_image_generations, new_items, context
+                )
 
             if not player.inventory:
                 player.inventory = []
@@ -158,11 +156,19 @@ class EndQuestTool(Tool):
         summary_block = await_streamed_block(summary_block, context)
         quest.text_summary = summary_block.text
 
+        social_summary = None
         if social_gen := get_social_media_generator(context=context):
-            social_summary = social_gen.generate_shareable_quest_snippet(
-                quest=quest, context=context
+            social_summary = submit_generation(
+                social_gen.generate_shareable_quest_snippet, quest=quest, context=context
             )
-            quest.social_media_summary = social_summary
+
+        if item_images:
+            for item, task in zip(new_items, item_images.result(), strict=True):
+                item.picture_url = task.output.blocks[0].raw_data_url
+            context.chat_history.file.refresh()
+
+        if social_summary:
+            quest.social_media_summary = social_summary.result()
 
         # Finally.. close the quest.
         game_state.current_quest = None
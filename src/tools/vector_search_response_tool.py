@@ -1,5 +1,8 @@
 """Answers questions with the assistance of a VectorSearch plugin."""
-from typing import Any, List, Optional, Union
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple, Union
 
 from steamship import Block, Tag, Task #upm package(steamship)
 from steamship.agents.llms import OpenAI #upm package(steamship)
@@ -8,6 +11,13 @@ from steamship.agents.tools.question_answering.vector_search_tool import VectorS
 from steamship.agents.utils import with_llm #upm package(steamship)
 from steamship.utils.repl import ToolREPL #upm package(steamship)
 
+# Search results are reused for the same question for this long, so documents added to the index show up after it.
+SEARCH_RESULT_TTL_S = 10 * 60
+_MAX_CACHED_SEARCHES = 256
+
+_SEARCH_CACHE: "OrderedDict[Tuple, Tuple[float, List[str]]]" = OrderedDict()
+_SEARCH_CACHE_LOCK = threading.Lock()
+
 class VectorSearchResponseTool(VectorSearchTool):
     """Tool to answer questions with the assistance of a vector search plugin."""
 
@@ -24,14 +34,35 @@ class VectorSearchResponseTool(VectorSearchTool):
         self.load_docs_count = doc_count
         
     def answer_question(self, question: str, context: AgentContext) -> List[Block]:
+        config = context.client.config
+        key = (
+            config.workspace_id or config.workspace_handle,
+            self.embedding_index_handle,
+            self.embedding_index_instance_handle,
+            self.load_docs_count,
+            question,
+        )
+        now = time.monotonic()
+        with _SEARCH_CACHE_LOCK:
+            cached = _SEARCH_CACHE.get(key)
+            if cached is not None and now - cached[0] < SEARCH_RESULT_TTL_S:
+                _SEARCH_CACHE.move_to_end(key)
+                return [Block(text=text) for text in cached[1]]
+
         index = self.get_embedding_index(context.client)
         task = index.search(question, k=self.load_docs_count)
         result_items = task.wait()
-        blocks = []
+        texts = []
         for result in result_items.items:            
             tag = result.tag            
-            blocks.append(Block(text=tag.text))
-        return blocks
+            texts.append(tag.text)
+
+        with _SEARCH_CACHE_LOCK:
+            _SEARCH_CACHE[key] = (now, texts)
+            _SEARCH_CACHE.move_to_end(key)
+            while len(_SEARCH_CACHE) > _MAX_CACHED_SEARCHES:
+                _SEARCH_CACHE.popitem(last=False)
+        return [Block(text=text) for text in texts]
 
 
     def run(self, tool_input: List[Block], context: AgentContext) -> Union[List[Block], Task[Any]]:
@@ -1,21 +1,40 @@
 import logging
 from abc import ABC, abstractmethod
-from typing import List, Optional, Tuple
+from bisect import bisect_left
+from typing import Dict, Hashable, List, Optional, Tuple
 
-from steamship import Block, File, Tag
-from steamship.agents.schema.message_selectors import tokens
-from steamship.data.tags.tag_constants import RoleTag, TagValueKey
+from steamship import Block, File, SteamshipError
+from steamship.data.tags.tag_constants import RoleTag
 from steamship.data.tags.tag_utils import get_tag, get_tag_value_key
 
 from schema.game_state import GameState
+from utils.chat_history_index import INDEX_LOCK, get_chat_history_index, tag_key
+from utils.history_compaction import story_position
 from utils.moderation_utils import is_block_excluded
 from utils.tags import (
     CharacterTag,
+    HistorySummaryTag,
     InstructionsTag,
     QuestIdTag,
     QuestTag,
     TagKindExtensions,
 )
+from utils.token_budget import (
+    DEFAULT_BUDGET_POLICY,
+    BudgetCandidate,
+    BudgetCategory,
+    BudgetPolicy,
+    allocate_budget,
+)
+from utils.token_count_cache import (
+    PendingTokenCount,
+    block_token_count,
+    precount_blocks,
+    store_token_counts,
+)
+
+# (position in chat_history_file.blocks, inclusion reason)
+PositionResult = Tuple[int, Optional[str]]
 
 
 class ChatHistoryFilter(ABC):
@@ -26,6 +45,60 @@ class ChatHistoryFilter(ABC):
         """Returns a list of included blocks, and optional explanations of why included for debugging"""
         pass
 
+    def is_append_only(self) -> bool:
+        """Whether a block, once selected, stays selected, so that appending blocks can only add to the selection.
+
+        The results of append-only filters are memoized per chat history file and only the newly appended blocks
+        are scanned on later evaluations. Such filters should override `signature` and `positions_since`; the
+        defaults are correct but re-run `filter_blocks` over the whole file.
+        """
+        return False
+
+    def signature(self) -> Hashable:
+        """A key identifying the selection this filter makes; equal signatures must select the same blocks.
+
+        Defaults to this instance, since nothing is known about what another instance would select.
+        """
+        return type(self).__name__, id(self)
+
+    def positions_since(
+        self, chat_history_file: File, start: int
+    ) -> List[PositionResult]:
+        """The selected blocks at or after position `start` in the file, in file order.
+
+        Defaults to running `filter_blocks` and keeping the blocks from `start` on.
+        """
+        positions = {
+            id(block): position
+            for position, block in enumerate(chat_history_file.blocks or [])
+        }
+        results = [
+            (positions[id(block)], reason)
+            for block, reason in self.filter_blocks(chat_history_file)
+            if id(block) in positions
+        ]
+        return sorted(
+            (result for result in results if result[0] >= start),
+            key=lambda result: result[0],
+        )
+
+    def memoized_positions(self, chat_history_file: File) -> List[PositionResult]:
+        """The selected blocks, in file order, scanning only the blocks appended since the last evaluation."""
+        key = self.signature()
+        with INDEX_LOCK:
+            index = get_chat_history_index(chat_history_file)
+            end = len(index)
+            seen, results = index.memoized_results.get(key, (0, []))
+            if seen < end:
+                # Blocks appended (by another thread) while scanning are left for the next evaluation.
+                results = results + [
+                    result
+                    for result in self.positions_since(chat_history_file, seen)
+                    if result[0] < end
+                ]
+                index.memoized_results[key] = (end, results)
+        return results
+
     def filter_chat_history(
         self, chat_history_file: File, filter_for: Optional[str] = None
     ) -> List[int]:
@@ -50,55 +123,89 @@ class ChatHistoryFilter(ABC):
         ]
 
 
+def _blocks_at(
+    chat_history_file: File, results: List[PositionResult]
+) -> List[Tuple[Block, Optional[str]]]:
+    # Resolve positions against the current blocks, which may have been re-fetched since the results were memoized.
+    return [(chat_history_file.blocks[position], reason) for position, reason in results]
+
+
 class TagFilter(ChatHistoryFilter):
     tag_types: List[Tuple[str, str]]  # Tag names and kinds that should be included
 
     def __init__(self, tag_types: List[Tuple[str, str]]):
         self.tag_types = tag_types
 
-    def filter_blocks(
-        self, chat_history_file: File
-    ) -> List[Tuple[Block, Optional[str]]]:
-        result: List[Tuple[Block, Optional[str]]] = []
-        for block in chat_history_file.blocks:
+    def is_append_only(self) -> bool:
+        return True
+
+    def signature(self) -> Hashable:
+        return "tags", tuple(self.tag_types)
+
+    def positions_since(
+        self, chat_history_file: File, start: int
+    ) -> List[PositionResult]:
+        index = get_chat_history_index(chat_history_file)
+        positions = index.positions_for_tags(self.tag_types)
+        result: List[PositionResult] = []
+        for position in positions[bisect_left(positions, start) :]:
+            block = chat_history_file.blocks[position]
             #logging.warning(f"BLOCK {block.text}, {block.chat_role}")
             for tag in block.tags:
                 for kind, name in self.tag_types:
-                    if tag.kind == kind and tag.name == name:                       
-                        result.append((block, f"{tag.kind} {tag.name}"))
+                    if tag.kind == kind and tag.name == name:
+                        result.append((position, f"{tag.kind} {tag.name}"))
         return result
 
+    def filter_blocks(
+        self, chat_history_file: File
+    ) -> List[Tuple[Block, Optional[str]]]:
+        return _blocks_at(chat_history_file, self.memoized_positions(chat_history_file))
+
 
 class QuestNameFilter(ChatHistoryFilter):
-    quest_name: str
+    quest_name: Optional[str]
+    """None only in filters passed to `compile_filter`, where the quest is bound later with `for_quest`."""
 
-    def __init__(self, quest_name: str):
+    def __init__(self, quest_name: Optional[str]):
         self.quest_name = quest_name
 
-    def filter_blocks(
-        self, chat_history_file: File
-    ) -> List[Tuple[Block, Optional[str]]]:
-        result: List[Tuple[Block, Optional[str]]] = []
-        for block in chat_history_file.blocks:
+    def is_append_only(self) -> bool:
+        return True
+
+    def signature(self) -> Hashable:
+        return "quest", self.quest_name
+
+    def positions_since(
+        self, chat_history_file: File, start: int
+    ) -> List[PositionResult]:
+        index = get_chat_history_index(chat_history_file)
+        positions = index.positions_for_quest(self.quest_name)
+        result: List[PositionResult] = []
+        for position in positions[bisect_left(positions, start) :]:
+            block = chat_history_file.blocks[position]
             for tag in block.tags:
                 if QuestIdTag.matches(tag, self.quest_name):
-                    result.append((block, "Quest ID match"))
+                    result.append((position, "Quest ID match"))
         return result
 
+    def filter_blocks(
+        self, chat_history_file: File
+    ) -> List[Tuple[Block, Optional[str]]]:
+        return _blocks_at(chat_history_file, self.memoized_positions(chat_history_file))
+
 
 class LastInventoryFilter(ChatHistoryFilter):
     def filter_blocks(
         self, chat_history_file: File
     ) -> List[Tuple[Block, Optional[str]]]:
-        result: List[Tuple[Block, Optional[str]]] = []
-        for _, block in enumerate(chat_history_file.blocks):
-            for tag in block.tags:
-                if (
-                    tag.kind == TagKindExtensions.CHARACTER
-                    and tag.name == CharacterTag.INVENTORY
-                ):
-                    result = [(block, "Last inventory")]
-        return result
+        index = get_chat_history_index(chat_history_file)
+        positions = index.positions_for_tag(
+            TagKindExtensions.CHARACTER, CharacterTag.INVENTORY
+        )
+        if not positions:
+            return []
+        return [(chat_history_file.blocks[positions[-1]], "Last inventory")]
 
 
 class UnionFilter(ChatHistoryFilter):
@@ -107,35 +214,190 @@ class UnionFilter(ChatHistoryFilter):
     def __init__(self, filters: List[ChatHistoryFilter]):
         self.filters = filters
 
+    def is_append_only(self) -> bool:
+        return all(filter.is_append_only() for filter in self.filters)
+
+    def signature(self) -> Hashable:
+        return "union", tuple(
+            filter.signature() for filter in self.filters if filter.is_append_only()
+        )
+
+    def positions_since(
+        self, chat_history_file: File, start: int
+    ) -> List[PositionResult]:
+        # Only covers the append-only children; see filter_blocks for the others.
+        tagged: List[Tuple[int, int, Optional[str]]] = []
+        for i, filter in enumerate(self.filters):
+            if filter.is_append_only():
+                tagged.extend(
+                    (position, i, reason)
+                    for position, reason in filter.positions_since(
+                        chat_history_file, start
+                    )
+                )
+        # Order by block, then by child, so merged reasons read in child order.
+        tagged.sort(key=lambda x: (x[0], x[1]))
+        return [(position, reason) for position, _, reason in tagged]
+
     def filter_blocks(
         self, chat_history_file: File
     ) -> List[Tuple[Block, Optional[str]]]:
         all_results: List[Tuple[Block, Optional[str]]] = []
-        for filter in self.filters:
+        if any(filter.is_append_only() for filter in self.filters):
             all_results.extend(
-                filter.filter_blocks(chat_history_file=chat_history_file)
+                _blocks_at(chat_history_file, self.memoized_positions(chat_history_file))
             )
+        for filter in self.filters:
+            if not filter.is_append_only():
+                all_results.extend(
+                    filter.filter_blocks(chat_history_file=chat_history_file)
+                )
         return self.dedupe_results(all_results)
 
     def dedupe_results(
         self, input: List[Tuple[Block, Optional[str]]]
     ) -> List[Tuple[Block, Optional[str]]]:
-        input.sort(key=lambda x: x[0].index_in_file)
-        result: List[Tuple[Block, Optional[str]]] = []
-        for included in input:
-            if len(result) == 0:
-                result.append(included)
+        return _dedupe_results(input)
+
+
+def _dedupe_results(
+    input: List[Tuple[Block, Optional[str]]]
+) -> List[Tuple[Block, Optional[str]]]:
+    """Sort by position in the file and merge the reasons of blocks included more than once."""
+    input.sort(key=lambda x: x[0].index_in_file)
+    result: List[Tuple[Block, Optional[str]]] = []
+    for included in input:
+        if len(result) == 0:
+            result.append(included)
+        else:
+            last_appended = result[-1]
+            if last_appended[0].index_in_file == included[0].index_in_file:
+                result[-1] = (
+                    last_appended[0],
+                    f"{last_appended[1]} && {included[1]}",
+                )
             else:
-                last_appended = result[-1]
-                if last_appended[0].index_in_file == included[0].index_in_file:
-                    result[-1] = (
-                        last_appended[0],
-                        f"{last_appended[1]} && {included[1]}",
-                    )
-                else:
-                    result.append(included)
+                result.append(included)
+    return result
+
+
+class CompiledUnionFilter(ChatHistoryFilter):
+    """A UnionFilter tree flattened into a single pass over the blocks. Build these with `compile_filter`.
+
+    Every TagFilter in the tree becomes entries in one hash table from (kind, name) to the filters that want it,
+    and every QuestNameFilter becomes a quest check on the same pass. Only the blocks the chat history index lists
+    under one of those tags or the bound quest are visited, and each of their tags is looked at once.
+    Inclusion reasons are the same as the uncompiled tree's. Filters that can't be flattened (e.g.
+    LastInventoryFilter) are evaluated as usual and merged in.
+
+    Compiled filters are immutable and can be built once, at import time. A tree with unbound quest filters
+    (`QuestNameFilter(quest_name=None)`) is bound to a quest per call with `for_quest`, which is cheap.
+    """
+
+    def __init__(
+        self,
+        tag_table: Dict[Tuple[Optional[str], Optional[str]], List[int]],
+        quest_slots: List[int],
+        others: List[ChatHistoryFilter],
+        quest_name: Optional[str] = None,
+    ):
+        self._tag_table = tag_table
+        self._quest_slots = quest_slots
+        self._others = others
+        self._quest_name = quest_name
+        self._signature = (
+            "compiled",
+            tuple((key, tuple(slots)) for key, slots in tag_table.items()),
+            tuple(quest_slots),
+            quest_name.lower() if quest_name else None,
+        )
+
+    def for_quest(self, quest_name: Optional[str]) -> "CompiledUnionFilter":
+        """This filter with its quest filters bound to `quest_name`."""
+        return CompiledUnionFilter(
+            self._tag_table, self._quest_slots, self._others, quest_name
+        )
+
+    def is_append_only(self) -> bool:
+        return not self._others
+
+    def signature(self) -> Hashable:
+        # Covers the flattened part only; the `others` are evaluated separately in filter_blocks.
+        return self._signature
+
+    def positions_since(
+        self, chat_history_file: File, start: int
+    ) -> List[PositionResult]:
+        # Quest filters that aren't bound to a quest (e.g. outside of a quest) select nothing.
+        match_quest = bool(self._quest_slots and self._quest_name)
+        index = get_chat_history_index(chat_history_file)
+        candidates = set()
+        for kind, name in self._tag_table:
+            positions = index.positions_for_tag(kind, name)
+            candidates.update(positions[bisect_left(positions, start) :])
+        if match_quest:
+            positions = index.positions_for_quest(self._quest_name)
+            candidates.update(positions[bisect_left(positions, start) :])
+
+        blocks = chat_history_file.blocks
+        result: List[PositionResult] = []
+        for position in sorted(candidates):
+            matches: List[Tuple[int, str]] = []
+            for tag in blocks[position].tags or []:
+                for slot in self._tag_table.get(tag_key(tag.kind, tag.name), ()):
+                    matches.append((slot, f"{tag.kind} {tag.name}"))
+                if match_quest and QuestIdTag.matches(tag, self._quest_name):
+                    matches.extend((slot, "Quest ID match") for slot in self._quest_slots)
+            if matches:
+                # Reasons in the order of the filters in the original tree.
+                matches.sort(key=lambda match: match[0])
+                result.append(
+                    (position, " && ".join(reason for _, reason in matches))
+                )
         return result
 
+    def filter_blocks(
+        self, chat_history_file: File
+    ) -> List[Tuple[Block, Optional[str]]]:
+        results = _blocks_at(
+            chat_history_file, self.memoized_positions(chat_history_file)
+        )
+        if not self._others:
+            return results
+        for filter in self._others:
+            results.extend(filter.filter_blocks(chat_history_file=chat_history_file))
+        return _dedupe_results(results)
+
+
+def _leaves(filter: ChatHistoryFilter) -> List[ChatHistoryFilter]:
+    if isinstance(filter, UnionFilter):
+        return [leaf for child in filter.filters for leaf in _leaves(child)]
+    return [filter]
+
+
+def compile_filter(filter: ChatHistoryFilter) -> CompiledUnionFilter:
+    """Flatten a UnionFilter tree (or a single TagFilter / QuestNameFilter) into a CompiledUnionFilter."""
+    tag_table: Dict[Tuple[Optional[str], Optional[str]], List[int]] = {}
+    quest_slots: List[int] = []
+    others: List[ChatHistoryFilter] = []
+    quest_names = set()
+
+    # Leaves are numbered in tree order, which is the order UnionFilter merges their reasons in.
+    for slot, leaf in enumerate(_leaves(filter)):
+        if isinstance(leaf, TagFilter):
+            for kind, name in leaf.tag_types:
+                tag_table.setdefault(tag_key(kind, name), []).append(slot)
+        elif isinstance(leaf, QuestNameFilter):
+            quest_slots.append(slot)
+            quest_names.add(leaf.quest_name.lower() if leaf.quest_name else None)
+        else:
+            others.append(leaf)
+
+    if len(quest_names) > 1:
+        raise SteamshipError("A compiled filter can only match a single quest.")
+    quest_name = next(iter(quest_names)) if quest_names else None
+    return CompiledUnionFilter(tag_table, quest_slots, others, quest_name)
+
 
 ROLE_TOKEN_BUFFER_SIZE = 10
 
@@ -147,35 +409,49 @@ class TrimmingStoryContextFilter(ChatHistoryFilter):
         current_quest_id: str,
         game_state: GameState,
         max_tokens: int,
+        model_name: Optional[str] = None,
+        budget_policy: Optional[BudgetPolicy] = None,
     ):
         self._base_filter = base_filter
         self._current_quest_id = current_quest_id
         self._game_state = game_state
         self._max_tokens = max_tokens
+        # The model the prompt is for; token counts are computed with its tokenizer.
+        self._model_name = model_name
+        # How to trade off quest messages against summaries; see utils.token_budget.
+        self._budget_policy = budget_policy or DEFAULT_BUDGET_POLICY
+        self._pending_token_count_tags: List[PendingTokenCount] = []
+
+    def _quest_id(self, block: Block) -> Optional[str]:
+        return get_tag_value_key(
+            tags=block.tags,
+            kind=TagKindExtensions.QUEST,
+            name=QuestTag.QUEST_ID,
+            key="id",
+        )
 
-    def _calculate_and_store_token_count(self, block: Block) -> int:
-        if not block.text:
-            return 0
-        if value := get_tag_value_key(
-            block.tags, key=TagValueKey.NUMBER_VALUE, kind=TagKindExtensions.TOKEN_COUNT
+    def _budget_category(self, block: Block) -> Optional[BudgetCategory]:
+        if HistorySummaryTag.get(block.tags):
+            if self._quest_id(block) == self._current_quest_id:
+                return BudgetCategory.HISTORY_SUMMARY
+            return None
+        if get_tag(
+            tags=block.tags,
+            kind=TagKindExtensions.QUEST,
+            name=QuestTag.QUEST_SUMMARY,
         ):
-            return value
-        block_tokens = tokens(block)
-        if block.client and block.id:
-            tag = Tag.create(
-                block.client,
-                file_id=block.file_id,
-                block_id=block.id,
-                kind=TagKindExtensions.TOKEN_COUNT,
-                value={TagValueKey.NUMBER_VALUE: block_tokens},
-            )
-        else:
-            tag = Tag(
-                kind=TagKindExtensions.TOKEN_COUNT,
-                value={TagValueKey.NUMBER_VALUE: block_tokens},
-            )
-        block.tags.append(tag)
-        return block_tokens
+            return BudgetCategory.QUEST_SUMMARY
+        if block.chat_role in [
+            RoleTag.ASSISTANT,
+            RoleTag.USER,
+        ] and self._quest_id(block) == self._current_quest_id:
+            return BudgetCategory.QUEST_MESSAGE
+        return None
+
+    def _calculate_and_store_token_count(self, block: Block) -> int:
+        return block_token_count(
+            block, self._pending_token_count_tags, self._model_name
+        )
 
     def filter_blocks(  # noqa: C901
         self, chat_history_file: File
@@ -193,6 +469,7 @@ class TrimmingStoryContextFilter(ChatHistoryFilter):
 
         id_to_reasons = {t[0].id: t[1] for t in block_tuples}
         blocks = [t[0] for t in block_tuples]
+        precount_blocks(blocks, self._model_name)
 
         total_tokens = 0
 
@@ -208,10 +485,6 @@ class TrimmingStoryContextFilter(ChatHistoryFilter):
                 last_matching_onboarding_block = block
         #Get most recent onboarding message
         if last_matching_onboarding_block:
-            #logging.warning(
-            #    f"Selecting Onboarding block: ({last_matching_onboarding_block.index_in_file}) [{last_matching_onboarding_block.chat_role}] {last_matching_onboarding_block.text}"
-            #)
-            #selected_blocks.append(last_matching_block)
             total_tokens += (
                 self._calculate_and_store_token_count(last_matching_onboarding_block)
                 + ROLE_TOKEN_BUFFER_SIZE
@@ -219,78 +492,49 @@ class TrimmingStoryContextFilter(ChatHistoryFilter):
             logging.debug(f"Total tokens: {total_tokens }")
 
         # Also, MUST include quest beginning prompt
+        quest_instructions_block = None
         for block in reversed(blocks):
             if block.chat_role == RoleTag.SYSTEM and get_tag(
                 tags=block.tags,
                 kind=TagKindExtensions.INSTRUCTIONS,
                 name=InstructionsTag.QUEST,
             ):
-                #continue
-                if value := get_tag_value_key(
-                    tags=block.tags,
-                    kind=TagKindExtensions.QUEST,
-                    name=QuestTag.QUEST_ID,
-                    key="id",
-                ):
-                    if value == self._current_quest_id:
-                        #logging.warning(
-                        #    f"Selecting Quest Instruction block: ({block.index_in_file}) [{block.chat_role}] {block.text}"
-                        #)
-                        selected_blocks.append(block)
-                        total_tokens += (
-                            self._calculate_and_store_token_count(block)
-                            + ROLE_TOKEN_BUFFER_SIZE
-                        )
-                        logging.debug(f"Total tokens: {total_tokens}")
-                        break
-
-        # Now include any assistant/user messages that provide the context.
-        for block in reversed(blocks):
-            if block.chat_role not in [RoleTag.ASSISTANT, RoleTag.USER]:
+                if self._quest_id(block) == self._current_quest_id:
+                    quest_instructions_block = block
+                    selected_blocks.append(block)
+                    total_tokens += (
+                        self._calculate_and_store_token_count(block)
+                        + ROLE_TOKEN_BUFFER_SIZE
+                    )
+                    logging.debug(f"Total tokens: {total_tokens}")
+                    break
+
+        # Fill the rest of the budget with the most valuable quest messages and summaries.
+        candidates = []
+        for block in blocks:
+            if block is last_matching_onboarding_block or block is quest_instructions_block:
                 continue
-            if value := get_tag_value_key(
-                tags=block.tags,
-                kind=TagKindExtensions.QUEST,
-                name=QuestTag.QUEST_ID,
-                key="id",
-            ):
-                if value == self._current_quest_id:
-                    if total_tokens < self._max_tokens:
-                        block_tokens = self._calculate_and_store_token_count(block)
-                        if (
-                            block_tokens + total_tokens + ROLE_TOKEN_BUFFER_SIZE
-                            < self._max_tokens
-                        ):
-                            #logging.warning(
-                            #    f"Selecting User/Assistant block: ({block.index_in_file}) [{block.chat_role}] {block.text}"
-                            #)
-                            selected_blocks.append(block)
-                            total_tokens += block_tokens + ROLE_TOKEN_BUFFER_SIZE
-                            logging.debug(f"Total tokens: {total_tokens}")
-
-        if total_tokens < self._max_tokens:
-            for block in reversed(blocks):
-                if not get_tag(
-                    tags=block.tags,
-                    kind=TagKindExtensions.QUEST,
-                    name=QuestTag.QUEST_SUMMARY,
-                ):
-                    continue
-                if total_tokens < self._max_tokens:
-                    block_tokens = self._calculate_and_store_token_count(block)
-                    if (
-                        block_tokens + total_tokens + ROLE_TOKEN_BUFFER_SIZE
-                        < self._max_tokens
-                    ):
-                        logging.debug(
-                            f"Selecting block: ({block.index_in_file}) [{block.chat_role}] {block.text}"
-                        )
-                        selected_blocks.append(block)
-                        total_tokens += block_tokens + ROLE_TOKEN_BUFFER_SIZE
-                        logging.debug(f"Total tokens: {total_tokens}")
+            if category := self._budget_category(block):
+                candidates.append(
+                    BudgetCandidate(
+                        block=block,
+                        category=category,
+                        cost=self._calculate_and_store_token_count(block)
+                        + ROLE_TOKEN_BUFFER_SIZE,
+                    )
+                )
+        # The prompt must stay strictly under max_tokens.
+        for candidate in allocate_budget(
+            candidates, self._max_tokens - total_tokens - 1, self._budget_policy
+        ):
+            selected_blocks.append(candidate.block)
+            total_tokens += candidate.cost
 
         logging.debug(f"TOTAL_TOKENS = {total_tokens}, MAX_TOKENS = {self._max_tokens}")
-        block_list = [last_matching_onboarding_block] + sorted(selected_blocks, key=lambda b: b.index_in_file) if last_matching_onboarding_block else sorted(selected_blocks, key=lambda b: b.index_in_file)
+        store_token_counts(self._pending_token_count_tags)
+        self._pending_token_count_tags = []
+        # History summaries go where the messages they summarize were.
+        block_list = [last_matching_onboarding_block] + sorted(selected_blocks, key=story_position) if last_matching_onboarding_block else sorted(selected_blocks, key=story_position)
         return_tuples = []
         for block in block_list:
             return_tuples.append((block, id_to_reasons.get(block.id)))
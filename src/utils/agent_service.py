@@ -15,7 +15,9 @@ from steamship.invocable.invocable_response import StreamingResponse
 
 from utils.context_utils import (
     RunNextAgentException,
+    deferred_game_state_saves,
     emit,
+    flush_game_state,
     get_game_state,
     get_server_settings,
     with_game_state,
@@ -540,39 +542,44 @@ class AgentService(PackageService):
                     )
                 )
 
-            had_exception = (
-                True  # Not true, but it causes the loop to execute at least once.
-            )
-            max_exceptions_allowed = 4
-            exception_count = 0
-            while had_exception:
-                try:
-                    self._prompt(prompt, context)
-                    had_exception = False
-                except RunNextAgentException as e:
-                    exception_count += 1
-                    if exception_count > max_exceptions_allowed:
-                        raise SteamshipError(message="Maximum agent switches exceeded")
-
-                    logging.info(
-                        "Got RunNextAgentException. Loading next agent.",
-                        extra={
-                            AgentLogging.IS_MESSAGE: True,
-                            AgentLogging.MESSAGE_TYPE: AgentLogging.THOUGHT,
-                            AgentLogging.MESSAGE_AUTHOR: AgentLogging.AGENT,
-                        },
-                    )
-                    self.agent = None
+            # All game state saves made while running the agents are written once, when this block exits.
+            with deferred_game_state_saves(context):
+                had_exception = (
+                    True  # Not true, but it causes the loop to execute at least once.
+                )
+                max_exceptions_allowed = 4
+                exception_count = 0
+                while had_exception:
+                    try:
+                        self._prompt(prompt, context)
+                        had_exception = False
+                    except RunNextAgentException as e:
+                        exception_count += 1
+                        if exception_count > max_exceptions_allowed:
+                            raise SteamshipError(message="Maximum agent switches exceeded")
+
+                        logging.info(
+                            "Got RunNextAgentException. Loading next agent.",
+                            extra={
+                                AgentLogging.IS_MESSAGE: True,
+                                AgentLogging.MESSAGE_TYPE: AgentLogging.THOUGHT,
+                                AgentLogging.MESSAGE_AUTHOR: AgentLogging.AGENT,
+                            },
+                        )
+                        self.agent = None
+
+                        # Persist the state transition before the next agent picks it up.
+                        flush_game_state(context)
 
-                    had_exception = True
-                    for block in e.action.output or []:
-                        emit(output=block, context=context)
+                        had_exception = True
+                        for block in e.action.output or []:
+                            emit(output=block, context=context)
 
-                    prompt = "Hi."
-                    if e.action.input:
-                        prompt = e.action.input[0].text
-                except BaseException as e:
-                    record_and_throw_unrecoverable_error(e, context)
+                        prompt = "Hi."
+                        if e.action.input:
+                            prompt = e.action.input[0].text
+                    except BaseException as e:
+                        record_and_throw_unrecoverable_error(e, context)
 
             # timings = API_TIMINGS
             # pretty_print_timings(timings)
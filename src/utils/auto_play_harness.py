@@ -1,5 +1,4 @@
 import os
-import time
 from datetime import datetime
 from typing import List, TextIO
 
@@ -27,6 +26,7 @@ from utils.context_utils import (
     save_server_settings,
 )
 from utils.dummy_generator import DummyGenerator
+from utils.stream_waiter import await_streams
 from utils.tags import QuestArcTag, QuestTag, TagKindExtensions
 
 output_tags = [
@@ -87,20 +87,19 @@ class AutoPlayHarness:
             context_keys={"id": "default"},
             searchable=False,
         )
+        new_blocks = [
+            block
+            for block in context.chat_history.file.blocks
+            if block.index_in_file > self.last_seen_block
+        ]
+        streamed = await_streams(
+            [block for block in new_blocks if block.stream_state == StreamState.STARTED],
+            timeout_s=30,
+        )
+        finished = {block.id: block for block in streamed}
         for block in context.chat_history.file.blocks:
             if block.index_in_file > self.last_seen_block:
-                if block.stream_state == StreamState.STARTED:
-                    start_time = time.perf_counter()
-                    while (
-                        block.stream_state
-                        not in [
-                            StreamState.COMPLETE,
-                            StreamState.ABORTED,
-                        ]
-                        and (time.perf_counter() - start_time) < 30
-                    ):
-                        time.sleep(0.4)
-                        block = Block.get(block.client, _id=block.id)
+                block = finished.get(block.id, block)
                 for tag in block.tags:
                     if (
                         tag.kind == TagKindExtensions.QUEST
@@ -0,0 +1,178 @@
+"""Inverted index over the tags of a chat history file.
+
+The chat history filters are evaluated several times per player turn, and long-running chat games accumulate
+thousands of blocks. Rather than walk every block (and every tag on every block) on each evaluation, the filters
+ask this index for the positions of the blocks that carry a given tag, and only look at those.
+
+The index is kept per file and updated incrementally: blocks appended since the last lookup are indexed on demand.
+If the file has been rewritten underneath us (blocks deleted, history cleared) the index is rebuilt from scratch.
+
+NOTE: Tags that are added to a block AFTER it has been indexed are not picked up. The game only does that for
+bookkeeping tags (token counts, moderation exclusion) which are checked on the block itself, not via the index.
+Blocks folded into a history summary (see utils.history_compaction) are dropped from the index altogether.
+"""
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+from steamship import Block, File, Tag
+
+from utils.tags import QuestTag, TagKindExtensions
+
+# The number of chat history files whose index is kept in memory at once.
+_MAX_INDEXED_FILES = 32
+
+_INDEXES: "OrderedDict[Union[str, int], ChatHistoryIndex]" = OrderedDict()
+
+# Held while an index is updated or read together with its memoized results, so that generations running on
+# several threads (see QuestAgent) can share the chat history.
+INDEX_LOCK = threading.RLock()
+
+
+def _plain(value: Optional[str]) -> Optional[str]:
+    """Return the plain string for a (possibly str-Enum) tag kind or name so that it hashes consistently."""
+    return getattr(value, "value", value)
+
+
+def tag_key(kind: Optional[str], name: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """The hashable (kind, name) key of a tag, the same whether kind and name are plain strings or str-Enums."""
+    return _plain(kind), _plain(name)
+
+
+def _block_key(block: Block) -> Union[str, int]:
+    return block.id if block.id else id(block)
+
+
+def _quest_id_of(tag: Tag) -> Optional[str]:
+    if (
+        tag.kind == TagKindExtensions.QUEST
+        and tag.name == QuestTag.QUEST_ID
+        and tag.value
+        and isinstance(tag.value.get("id"), str)
+    ):
+        return tag.value.get("id").lower()
+    return None
+
+
+class ChatHistoryIndex:
+    """Maps (tag kind, tag name) and quest id to the positions of the matching blocks in `file.blocks`."""
+
+    def __init__(self):
+        self._block_keys: List[Union[str, int]] = []
+        self._by_tag: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+        self._by_quest_id: Dict[str, List[int]] = defaultdict(list)
+        self.memoized_results: Dict[Hashable, Tuple[int, List[Any]]] = {}
+        """Filter results cached against this index: filter signature -> (blocks seen, results).
+
+        Cleared whenever the index is rebuilt, since positions are no longer valid then."""
+        self._compacted_until: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._block_keys)
+
+    def update(self, chat_history_file: File) -> "ChatHistoryIndex":
+        """Index any blocks appended to the file since the last update."""
+        blocks = chat_history_file.blocks or []
+        if not self._is_prefix_of(blocks):
+            self._reset()
+        for position in range(len(self._block_keys), len(blocks)):
+            self._add(position, blocks[position])
+        return self
+
+    def positions_for_tag(self, kind: str, name: str) -> List[int]:
+        return self._by_tag.get(tag_key(kind, name), [])
+
+    def positions_for_tags(self, tag_types: List[Tuple[str, str]]) -> List[int]:
+        """Positions of blocks carrying any of the (kind, name) pairs, in file order."""
+        positions = set()
+        for kind, name in tag_types:
+            positions.update(self.positions_for_tag(kind, name))
+        return sorted(positions)
+
+    def positions_for_quest(self, quest_id: str) -> List[int]:
+        return self._by_quest_id.get(quest_id.lower(), [])
+
+    def drop_compacted(
+        self,
+        chat_history_file: File,
+        quest_id: str,
+        until: int,
+        is_compacted: Callable[[Block], bool],
+    ):
+        """Drop the blocks of the quest before position `until` that have been compacted from the index.
+
+        Only the blocks since the previous call are checked, and only the positions from the first dropped one on
+        are rewritten, so the cost follows the size of the compacted range rather than the length of the history.
+        """
+        quest_id = quest_id.lower()
+        since = self._compacted_until.get(quest_id, 0)
+        until = min(until, len(self._block_keys))
+        if until <= since:
+            return
+        self._compacted_until[quest_id] = until
+        quest_positions = self.positions_for_quest(quest_id)
+        dropped = {
+            position
+            for position in quest_positions[
+                bisect_left(quest_positions, since) : bisect_left(quest_positions, until)
+            ]
+            if is_compacted(chat_history_file.blocks[position])
+        }
+        if not dropped:
+            return
+        first = min(dropped)
+        for positions in [*self._by_tag.values(), *self._by_quest_id.values()]:
+            start = bisect_left(positions, first)
+            positions[start:] = [position for position in positions[start:] if position not in dropped]
+        for key, (seen, results) in self.memoized_results.items():
+            start = bisect_left(results, first, key=lambda result: result[0])
+            self.memoized_results[key] = (
+                seen,
+                results[:start] + [result for result in results[start:] if result[0] not in dropped],
+            )
+
+    def _is_prefix_of(self, blocks: List[Block]) -> bool:
+        indexed = len(self._block_keys)
+        if indexed == 0:
+            return True
+        if len(blocks) < indexed:
+            return False
+        # Blocks are only ever appended; a deletion shifts everything after it, which shows up at the boundary.
+        return _block_key(blocks[indexed - 1]) == self._block_keys[indexed - 1]
+
+    def _reset(self):
+        self._block_keys = []
+        self._by_tag = defaultdict(list)
+        self._by_quest_id = defaultdict(list)
+        self.memoized_results = {}
+        self._compacted_until = {}
+
+    def _add(self, position: int, block: Block):
+        self._block_keys.append(_block_key(block))
+        seen_tags = set()
+        seen_quest_ids = set()
+        for tag in block.tags or []:
+            key = tag_key(tag.kind, tag.name)
+            if key not in seen_tags:
+                seen_tags.add(key)
+                self._by_tag[key].append(position)
+            quest_id = _quest_id_of(tag)
+            if quest_id is not None and quest_id not in seen_quest_ids:
+                seen_quest_ids.add(quest_id)
+                self._by_quest_id[quest_id].append(position)
+
+
+def get_chat_history_index(chat_history_file: File) -> ChatHistoryIndex:
+    """Return the (up to date) index for the provided chat history file."""
+    key = chat_history_file.id if chat_history_file.id else id(chat_history_file)
+    with INDEX_LOCK:
+        index = _INDEXES.get(key)
+        if index is None:
+            index = ChatHistoryIndex()
+            _INDEXES[key] = index
+            if len(_INDEXES) > _MAX_INDEXED_FILES:
+                _INDEXES.popitem(last=False)
+        else:
+            _INDEXES.move_to_end(key)
+        return index.update(chat_history_file)
@@ -0,0 +1,71 @@
+"""A short-lived cache for the results of classification generations.
+
+Classifications (is this a solution attempt, how likely is it to succeed, is this an image request) produce a word or
+two, but each one costs a full prompt upload and a model round-trip. They are repeated with identical inputs when a
+player resubmits, or when `await_ask` replays a turn after an interruption. The result is cached under a hash of
+everything that determines it: the model and its parameters, the prompt and generation options, and the text of the
+chat history blocks selected as context.
+
+USAGE:
+
+    key = classification_key(model, params, prompt, options, context_blocks)
+    text = get_cached_classification(key)
+    if text is None:
+        text = ...
+        cache_classification(key, text)
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from steamship import Block
+
+CLASSIFICATION_TTL_S = 30 * 60
+_MAX_CACHED_CLASSIFICATIONS = 1024
+
+_CLASSIFICATIONS: "OrderedDict[str, tuple]" = OrderedDict()
+_CLASSIFICATIONS_LOCK = threading.Lock()
+
+
+def classification_key(
+    model: str,
+    params: Optional[Dict[str, Any]],
+    prompt: str,
+    options: Dict[str, Any],
+    context_blocks: List[Block],
+) -> str:
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps(
+            [model, params or {}, prompt, options], sort_keys=True, default=str
+        ).encode("utf-8")
+    )
+    # Only what the model sees counts: the same text in a re-created block is still a hit.
+    for block in context_blocks:
+        digest.update(b"\0")
+        digest.update((block.text or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_cached_classification(key: str) -> Optional[str]:
+    now = time.monotonic()
+    with _CLASSIFICATIONS_LOCK:
+        cached = _CLASSIFICATIONS.get(key)
+        if cached is None:
+            return None
+        if now - cached[0] >= CLASSIFICATION_TTL_S:
+            del _CLASSIFICATIONS[key]
+            return None
+        _CLASSIFICATIONS.move_to_end(key)
+        return cached[1]
+
+
+def cache_classification(key: str, text: str):
+    with _CLASSIFICATIONS_LOCK:
+        _CLASSIFICATIONS[key] = (time.monotonic(), text)
+        _CLASSIFICATIONS.move_to_end(key)
+        while len(_CLASSIFICATIONS) > _MAX_CACHED_CLASSIFICATIONS:
+            _CLASSIFICATIONS.popitem(last=False)
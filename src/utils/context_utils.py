@@ -18,21 +18,33 @@ layered on top to boot.
 That reduces the need of the game code to perform verbose plumbing operations.
 """
 import logging
-from typing import List, Optional, Union
+from contextlib import contextmanager
+from typing import List, Optional, Type, Union
 
-from steamship import Block, PluginInstance, Tag
+from steamship import Block, PluginInstance, SteamshipError, Tag
 from steamship.agents.llms.openai import ChatOpenAI
 from steamship.agents.logging import AgentLogging
 from steamship.agents.schema import ChatHistory, ChatLLM, FinishAction
 from steamship.agents.schema.agent import AgentContext
-from steamship.utils.kv_store import KeyValueStore
 
 from generators.cascading_plugin import CascadingPlugin
+from generators.model_registry import (
+    BACKUP_STORY_MODELS,
+    BACKUP_STORY_PLUGIN_HANDLE,
+    REASONING_MODELS,
+    STORY_MODELS,
+    ModelProvider,
+    ModelSpec,
+)
 from schema.game_state import GameState
-from schema.image_theme import DEFAULT_THEME, PREMADE_THEMES, CustomStableDiffusionTheme, FluxTheme, GetImgTheme, ImageTheme
+from schema.image_theme import DEFAULT_THEME, ImageTheme
 from schema.server_settings import ServerSettings
+from utils.chat_history_index import get_chat_history_index
+from utils.field_kv_store import FieldKeyValueStore
 from utils.tags import QuestIdTag,QuestTag,StoryContextTag,InstructionsTag
 from utils.moderation_utils import mark_block_as_excluded
+from utils.plugin_pool import use_pooled_plugin
+from utils.theme_registry import theme_registry
 from utils.tags import QuestTag,TagKindExtensions
 from utils.tags import CharacterTag
 from utils.tags import QuestIdTag
@@ -48,12 +60,22 @@ _BACKGROUND_MUSIC_GENERATOR_KEY = "background-music-generator"
 _NARRATION_GENERATOR_KEY = "narration-generator"
 _SERVER_SETTINGS_KEY = "server-settings"
 _GAME_STATE_KEY = "user-settings"
+_GAME_STATE_SAVES_DEFERRED_KEY = "game-state-saves-deferred"
+_GAME_STATE_DIRTY_KEY = "game-state-dirty"
+_DOCUMENT_STORES_KEY = "document-stores"
 _TOGETHERAI_API_KEY = "togetherai-api-key"
 _FALAI_API_KEY = "falai_api_key"
 _GETIMG_AI_API_KEY = "getimg_ai_api_key"
 _DEEPINFRA_API_KEY = "deepinfra_api_key"
 _OPENAI_API_KEY = "openai_api_key"
 
+# The context metadata key holding the API key for each model provider.
+_PROVIDER_API_KEYS = {
+    ModelProvider.OPENAI: _OPENAI_API_KEY,
+    ModelProvider.TOGETHER: _TOGETHERAI_API_KEY,
+    ModelProvider.DEEPINFRA: _DEEPINFRA_API_KEY,
+}
+
 def with_openai_key(api_key: str, context: AgentContext) -> AgentContext:
     context.metadata[_OPENAI_API_KEY] = api_key
     return context
@@ -96,6 +118,42 @@ def with_game_state(
     return context
 
 
+def _model_api_key(spec: ModelSpec, context: AgentContext) -> Optional[str]:
+    metadata_key = _PROVIDER_API_KEYS.get(spec.provider)
+    return context.metadata.get(metadata_key) if metadata_key else None
+
+
+def _use_model(spec: ModelSpec, config: dict, context: AgentContext) -> PluginInstance:
+    if spec.api_key_field and (api_key := _model_api_key(spec, context)):
+        config[spec.api_key_field] = api_key
+    return use_pooled_plugin(context.client,
+                             spec.plugin_handle,
+                             config=config,
+                             version=spec.plugin_version)
+
+
+def get_story_model_name(context: AgentContext) -> str:
+    """The name of the model that generates the story."""
+    server_settings = get_server_settings(context)
+    return server_settings._select_model(
+        STORY_MODELS.keys(),
+        default=server_settings.default_story_model,
+        preferred=get_game_state(context).preferences.narration_model,
+    )
+
+
+def get_reasoning_model_name(context: AgentContext) -> str:
+    """The name of the model that answers reasoning (classification) prompts.
+
+    Always the operator's `default_reasoning_model`: the player's model preferences are for the narration.
+    """
+    server_settings = get_server_settings(context)
+    return server_settings._select_model(
+        REASONING_MODELS.keys(),
+        default=server_settings.default_reasoning_model,
+    )
+
+
 def get_story_text_generator(
         context: AgentContext,
         default: Optional[PluginInstance] = None) -> Optional[PluginInstance]:
@@ -104,72 +162,18 @@ def get_story_text_generator(
     if not generator:
         # Lazily create
         server_settings: ServerSettings = get_server_settings(context)
-        game_state = get_game_state(context)
-        preferences = game_state.preferences
-
-        open_ai_models = ["gpt-3.5-turbo", "gpt-4-1106-preview", "gpt-4","gpt-3.5-turbo-0613","gpt-4o-mini"]
-        replicate_models = ["dolly_v2", "llama_v2"]
-        together_ai_models = [
-            "NousResearch/Nous-Hermes-2-Yi-34B",
-            "NousResearch/Nous-Hermes-2-Mixtral-8x7B-DPO",            
-            "mistralai/Mixtral-8x7B-Instruct-v0.1",
-            "Gryphe/MythoMax-L2-13b",
-            "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo"
-        ]
-        deepinfra_models = ["Sao10K/L3-70B-Euryale-v2.1",
-                            "Sao10K/L3.1-70B-Euryale-v2.2",
-                            "lizpreciatior/lzlv_70b_fp16_hf",
-                            "cognitivecomputations/dolphin-2.9.1-llama-3-70b",
-                            "Austism/chronos-hermes-13b-v2",
-                            "mistralai/Mistral-Nemo-Instruct-2407"]
-
-        model_name = server_settings._select_model(
-            open_ai_models + replicate_models + together_ai_models + deepinfra_models,
-            default=server_settings.default_story_model,
-            preferred=preferences.narration_model,
-        )
-        config = {
-            "model": model_name,
-            "max_tokens": server_settings.default_story_max_tokens,
-            "temperature": server_settings.default_story_temperature,            
-            "top_p": server_settings.top_p,
-            "frequency_penalty": server_settings.frequency_penalty,
-            "presence_penalty": server_settings.presence_penalty
-        }
-        if model_name not in open_ai_models: 
-            config["min_p"] = server_settings.min_p
-            config["repetition_penalty"] = server_settings.repetition_penalty
-            
-        plugin_handle = None
-        version = None        
-        
-        if model_name in open_ai_models:
-            plugin_handle = "gpt-4"
-            version = "0.1.4"
-            if context.metadata[_OPENAI_API_KEY]:
-                config["openai_api_key"] = context.metadata[_OPENAI_API_KEY]
-        elif model_name in replicate_models:
-            plugin_handle = "replicate-llm"
-        elif model_name in together_ai_models:
-            plugin_handle = "together-ai-generator"
-            version = "1.0.2"
-            config["api_key"] = context.metadata[_TOGETHERAI_API_KEY]
-        elif model_name in deepinfra_models:
-            plugin_handle = "deepinfra-generator"
-            version = "1.0.0"
-            config["api_key"] = context.metadata[_DEEPINFRA_API_KEY]
-        
-        generator = context.client.use_plugin(plugin_handle,
-                                              config=config,
-                                              version=version)
+        model_name = get_story_model_name(context)
+        spec = STORY_MODELS[model_name]
+        generator = _use_model(spec, spec.story_config(server_settings), context)
 
         if server_settings.allow_backup_story_models:
-            providers = [lambda: generator]
-            for backup_model_name in open_ai_models:
+            providers = [lambda primary=generator: primary]
+            for backup_model_name in BACKUP_STORY_MODELS:
                 if backup_model_name == model_name:
                     continue
-                provider = lambda: context.client.use_plugin(
-                    "gpt-3.5-turbo",
+                provider = lambda backup_model_name=backup_model_name: use_pooled_plugin(
+                    context.client,
+                    BACKUP_STORY_PLUGIN_HANDLE,
                     config={
                         "model": backup_model_name,
                         "max_tokens": server_settings.default_story_max_tokens,
@@ -190,65 +194,11 @@ def get_reasoning_generator(
     if not generator:
         # Lazily create
         server_settings: ServerSettings = get_server_settings(context)
-        game_state = get_game_state(context)
-        preferences = game_state.preferences
-    
-        open_ai_models = ["gpt-3.5-turbo", "gpt-4-1106-preview", "gpt-4","gpt-3.5-turbo-0613","gpt-4o-mini"]
-        replicate_models = ["dolly_v2", "llama_v2"]
-        together_ai_models = [
-            "NousResearch/Nous-Hermes-2-Yi-34B",
-            "NousResearch/Nous-Hermes-2-Mixtral-8x7B-DPO",
-            "NousResearch/Nous-Hermes-2-Mixtral-8x7B-SFT",
-            "mistralai/Mixtral-8x7B-Instruct-v0.1",
-            "teknium/OpenHermes-2p5-Mistral-7B",
-            "cognitivecomputations/dolphin-2.5-mixtral-8x7b",
-            "Gryphe/MythoMax-L2-13b",
-            "teknium/OpenHermes-2-Mistral-7B",
-            "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo"
-        ]
-        deepinfra_models = ["Sao10K/L3-70B-Euryale-v2.1",
-                            "Sao10K/L3.1-70B-Euryale-v2.2",
-                            "lizpreciatior/lzlv_70b_fp16_hf",
-                            "mistralai/Mixtral-8x7B-Instruct-v0.1",
-                            "Austism/chronos-hermes-13b-v2",
-                           "mistralai/Mistral-Nemo-Instruct-2407"]
-    
-        model_name = server_settings._select_model(
-            open_ai_models + replicate_models + together_ai_models + deepinfra_models,
-            default=server_settings.default_reasoning_model,
-            preferred=preferences.narration_model,
-        )
-        config = {
-            "model": server_settings.default_reasoning_model,
-            "max_tokens": 512,
-            "temperature": server_settings.reasoning_temperature
-        }
-        plugin_handle = None
-        version = None        
-    
-        if model_name in open_ai_models:
-            plugin_handle = "gpt-4"
-            version = "0.1.4"
-            if context.metadata[_OPENAI_API_KEY]:
-                config["openai_api_key"] = context.metadata[_OPENAI_API_KEY]
-        elif model_name in replicate_models:
-            plugin_handle = "replicate-llm"
-        elif model_name in together_ai_models:
-            plugin_handle = "together-ai-generator"
-            version = "1.0.2"
-            config[
-                "api_key"] = context.metadata[_TOGETHERAI_API_KEY]     
-        elif model_name in deepinfra_models:
-            plugin_handle = "deepinfra-generator"
-            version = "1.0.0"
-            config[
-                "api_key"] = context.metadata[_DEEPINFRA_API_KEY]
+        model_name = get_reasoning_model_name(context)
+        spec = REASONING_MODELS[model_name]
         #logging.warning("reasoning model: " + model_name)
-        #logging.warning("plugin_handle: " + plugin_handle)
-        generator = context.client.use_plugin(plugin_handle,
-                                              config=config,
-                                              version=version)
-    
+        #logging.warning("plugin_handle: " + spec.plugin_handle)
+        generator = _use_model(spec, spec.reasoning_config(server_settings), context)
     
         context.metadata[_REASONING_GENERATOR_KEY] = generator
     
@@ -270,7 +220,7 @@ def get_background_music_generator(
             default=server_settings.default_narration_model,
             preferred=preferences.background_music_model,
         )
-        generator = context.client.use_plugin(plugin_handle)
+        generator = use_pooled_plugin(context.client, plugin_handle)
         context.metadata[_BACKGROUND_MUSIC_GENERATOR_KEY] = generator
 
     return generator
@@ -298,12 +248,20 @@ def get_audio_narration_generator(
             if server_settings.narration_multilingual:
                 config["model_id"] = "eleven_multilingual_v2"
 
-        generator = context.client.use_plugin(plugin_handle, config=config)
+        generator = use_pooled_plugin(context.client, plugin_handle, config=config)
         context.metadata[_NARRATION_GENERATOR_KEY] = generator
 
     return generator
 
 
+def _document_store(key: str, context: AgentContext) -> FieldKeyValueStore:
+    """The store for a persisted document. It is kept on the context so saves are diffed against the last load."""
+    stores = context.metadata.setdefault(_DOCUMENT_STORES_KEY, {})
+    if key not in stores:
+        stores[key] = FieldKeyValueStore(context.client, key)
+    return stores[key]
+
+
 def get_server_settings(
     context: AgentContext, ) -> "ServerSettings":  # noqa: F821
     logging.debug(
@@ -322,8 +280,7 @@ def get_server_settings(
         return context.metadata.get(_SERVER_SETTINGS_KEY)
 
     # Get it from the KV Store
-    kv = KeyValueStore(context.client, _SERVER_SETTINGS_KEY)
-    value = kv.get(_SERVER_SETTINGS_KEY)
+    value = _document_store(_SERVER_SETTINGS_KEY, context).load()
 
     if value:
         logging.debug(f"Parsing Server Settings from stored value: {value}")
@@ -351,8 +308,7 @@ def get_game_state(
         return context.metadata.get(_GAME_STATE_KEY)
 
     # Get it from the KV Store
-    kv = KeyValueStore(context.client, _GAME_STATE_KEY)
-    value = kv.get(_GAME_STATE_KEY)
+    value = _document_store(_GAME_STATE_KEY, context).load()
 
     if value:
         logging.debug(f"Parsing game state from stored value: \n{value}")
@@ -381,18 +337,66 @@ def save_server_settings(server_settings, context: AgentContext):
         f"Saving server_settings from workspace {context.client.config.workspace_handle} generation_task_id={server_settings.generation_task_id}.",
     )
 
-    # Save it to the KV Store
-    value = server_settings.dict()
-    kv = KeyValueStore(context.client, _SERVER_SETTINGS_KEY)
-    kv.set(_SERVER_SETTINGS_KEY, value)
+    # Save the changed fields to the KV Store
+    _document_store(_SERVER_SETTINGS_KEY, context).save(server_settings.dict())
 
     # Also save it to the context
     context.metadata[_SERVER_SETTINGS_KEY] = server_settings
 
 
 def save_game_state(game_state, context: AgentContext):
-    """Save GameState to the KeyValue store."""
+    """Save GameState to the KeyValue store.
+
+    Inside `deferred_game_state_saves` this only marks the state dirty; the write happens once, on flush.
+    """
+
+    # Always save it to the context
+    context.metadata[_GAME_STATE_KEY] = game_state
+
+    if context.metadata.get(_GAME_STATE_SAVES_DEFERRED_KEY):
+        context.metadata[_GAME_STATE_DIRTY_KEY] = True
+        return
+
+    _write_game_state(game_state, context)
+
+
+def flush_game_state(context: AgentContext):
+    """Write any deferred GameState changes to the KeyValue store.
+
+    Call this before handing control to something that reads the game state from the KeyValue store rather than
+    from this context (e.g. before raising FinishActionException or RunNextAgentException).
+    """
+    if not context.metadata.get(_GAME_STATE_DIRTY_KEY):
+        return
+    game_state = context.metadata.get(_GAME_STATE_KEY)
+    if game_state is not None:
+        _write_game_state(game_state, context)
+
+
+@contextmanager
+def deferred_game_state_saves(context: AgentContext):
+    """Coalesce every save_game_state call within the block into a single KeyValue write at the end of it.
+
+    USAGE:
+
+        with deferred_game_state_saves(context):
+            ... # any number of save_game_state(game_state, context) calls
+
+    Nested uses are folded into the outermost one.
+    """
+    if context.metadata.get(_GAME_STATE_SAVES_DEFERRED_KEY):
+        yield context
+        return
+
+    context.metadata[_GAME_STATE_SAVES_DEFERRED_KEY] = True
+    try:
+        yield context
+    finally:
+        context.metadata[_GAME_STATE_SAVES_DEFERRED_KEY] = False
+        flush_game_state(context)
+
 
+def _write_game_state(game_state, context: AgentContext):
     logging.debug(
         f"Saving Game State from workspace {context.client.config.workspace_handle}.",
         extra={
@@ -402,13 +406,9 @@ def save_game_state(game_state, context: AgentContext):
         },
     )
 
-    # Save it to the KV Store
-    value = game_state.dict()
-    kv = KeyValueStore(context.client, _GAME_STATE_KEY)
-    kv.set(_GAME_STATE_KEY, value)
-
-    # Also save it to the context
-    context.metadata[_GAME_STATE_KEY] = game_state
+    # Save the changed fields to the KV Store
+    _document_store(_GAME_STATE_KEY, context).save(game_state.dict())
+    context.metadata[_GAME_STATE_DIRTY_KEY] = False
 
 
 def get_current_quest(
@@ -636,6 +636,8 @@ def await_ask(
     )
 
     save_game_state(game_state, context)
+    # The answer arrives in a later request, which must see the await_ask_key.
+    flush_game_state(context)
 
     if prompt_prologue:
         output.insert(0, Block(text=prompt_prologue))
@@ -689,27 +691,24 @@ class RunNextAgentException(Exception):  # noqa: N818
 
 
 
-def get_theme(name: str, context: AgentContext) -> ImageTheme:
+def get_theme(
+    name: str, context: AgentContext, theme_type: Optional[Type[ImageTheme]] = None
+) -> ImageTheme:
+    """The theme called `name`, or in chat mode the one for `image_theme_by_model`, converted to `theme_type`."""
     server_settings = get_server_settings(context)
     get_by_model = (server_settings.image_theme_by_model if server_settings.image_theme_by_model 
                     and server_settings.chat_mode else "")
 
-    potential_themes = (server_settings.image_themes or []) + PREMADE_THEMES
-    
+    registry = theme_registry(server_settings.image_themes)
     if not get_by_model:
-        for theme in potential_themes:
-            if name == theme.name:
-                return theme
+        theme = registry.by_name(name)
     else:
-        for theme in potential_themes:
-            if isinstance(theme, CustomStableDiffusionTheme) and theme.model == get_by_model:
-                return theme
-            elif isinstance(theme, GetImgTheme) and theme.model == get_by_model:   
-                return theme
-            elif isinstance(theme, FluxTheme) and theme.model == get_by_model:
-                return theme
+        theme = registry.by_model(get_by_model)
+    theme = theme or DEFAULT_THEME
 
-    return DEFAULT_THEME
+    if theme_type:
+        return registry.typed(theme, theme_type)
+    return theme
 
 def print_log(message: str):
     if is_in_replit():
@@ -743,6 +742,31 @@ def append_chat_intro_messages(context: AgentContext):
 
         )
 
+def _onboarding_tags() -> List[Tag]:
+    return [
+        Tag(
+            kind=TagKindExtensions.INSTRUCTIONS,
+            name=InstructionsTag.ONBOARDING,
+        ),
+        Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.NAME),
+        Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.BACKGROUND),
+        Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.MOTIVATION),
+        Tag(
+            kind=TagKindExtensions.CHARACTER, name=CharacterTag.DESCRIPTION
+        ),
+        Tag(
+            kind=TagKindExtensions.STORY_CONTEXT,
+            name=StoryContextTag.BACKGROUND,
+        ),
+        Tag(
+            kind=TagKindExtensions.STORY_CONTEXT, name=StoryContextTag.TONE
+        ),
+        Tag(
+            kind=TagKindExtensions.STORY_CONTEXT, name=StoryContextTag.VOICE
+        ),
+    ]
+
+
 def append_onboarding_message(context: AgentContext):
     game_state = get_game_state(context)
     if game_state and game_state.onboarding_message:
@@ -757,31 +781,47 @@ def append_onboarding_message(context: AgentContext):
         #print_log(onboarding_message)
         context.chat_history.append_system_message(
             text=onboarding_message.rstrip(),
-            tags=[
-                Tag(
-                    kind=TagKindExtensions.INSTRUCTIONS,
-                    name=InstructionsTag.ONBOARDING,
-                ),
-                Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.NAME),
-                Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.BACKGROUND),
-                Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.MOTIVATION),
-                Tag(
-                    kind=TagKindExtensions.CHARACTER, name=CharacterTag.DESCRIPTION
-                ),
-                Tag(
-                    kind=TagKindExtensions.STORY_CONTEXT,
-                    name=StoryContextTag.BACKGROUND,
-                ),
-                Tag(
-                    kind=TagKindExtensions.STORY_CONTEXT, name=StoryContextTag.TONE
-                ),
-                Tag(
-                    kind=TagKindExtensions.STORY_CONTEXT, name=StoryContextTag.VOICE
-                ),
-            ],
+            tags=_onboarding_tags(),
         )
 
+
+def get_onboarding_context_block(context: AgentContext) -> Optional[Block]:
+    """The current version of the onboarding context slot, if it has been filled."""
+    chat_history_file = context.chat_history.file
+    positions = get_chat_history_index(chat_history_file).positions_for_tag(
+        TagKindExtensions.INSTRUCTIONS, InstructionsTag.ONBOARDING_CONTEXT
+    )
+    return chat_history_file.blocks[positions[-1]] if positions else None
+
+
+def _onboarding_context_version(block: Optional[Block]) -> int:
+    for tag in (block.tags or []) if block else []:
+        if tag.kind == TagKindExtensions.INSTRUCTIONS and tag.name == InstructionsTag.ONBOARDING_CONTEXT:
+            return (tag.value or {}).get("version", 0)
+    return 0
+
+
+def _delete_superseded_block(context: AgentContext, block: Block):
+    try:
+        block.delete()
+    except SteamshipError as e:
+        # Left in place it would still be picked up by prompts, so at least keep it out of those.
+        logging.warning(f"Unable to delete superseded block {block.id}. {e}")
+        mark_block_as_excluded(block, "superseded")
+        return
+    blocks = context.chat_history.file.blocks
+    for position, candidate in enumerate(blocks):
+        if candidate is block:
+            del blocks[position]
+            break
+
+
 def update_onboarding_message_background(context: AgentContext,background=""):
+    """Upsert the onboarding context slot: the onboarding message, with `background` as the player's background.
+
+    The slot is a single onboarding block in the chat history. Nothing is written if it already holds this text;
+    otherwise the new version is appended and the previous one is deleted, so the history holds one copy.
+    """
     game_state = get_game_state(context)
     temp_game_state = GameState()    
     
@@ -793,31 +833,22 @@ def update_onboarding_message_background(context: AgentContext,background=""):
             player_personality=game_state.player.personality,
             player_background=background,
             tags=game_state.tags,
-            player_seed=game_state.player.seed_message)   
+            player_seed=game_state.player.seed_message).rstrip()
 
-        context.chat_history.append_system_message(
-            text=onboarding_message.rstrip(),
-            tags=[
+        current = get_onboarding_context_block(context)
+        if current is not None and current.text == onboarding_message:
+            return current
+
+        block = context.chat_history.append_system_message(
+            text=onboarding_message,
+            tags=_onboarding_tags() + [
                 Tag(
                     kind=TagKindExtensions.INSTRUCTIONS,
-                    name=InstructionsTag.ONBOARDING,
-                ),
-                Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.NAME),
-                Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.BACKGROUND),
-                Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.MOTIVATION),
-                Tag(
-                    kind=TagKindExtensions.CHARACTER, name=CharacterTag.DESCRIPTION
-                ),
-                Tag(
-                    kind=TagKindExtensions.STORY_CONTEXT,
-                    name=StoryContextTag.BACKGROUND,
-                ),
-                Tag(
-                    kind=TagKindExtensions.STORY_CONTEXT, name=StoryContextTag.TONE
-                ),
-                Tag(
-                    kind=TagKindExtensions.STORY_CONTEXT, name=StoryContextTag.VOICE
+                    name=InstructionsTag.ONBOARDING_CONTEXT,
+                    value={"version": _onboarding_context_version(current) + 1},
                 ),
             ],
         )
-        #save_game_state(game_state, context)
\ No newline at end of file
+        if current is not None:
+            _delete_superseded_block(context, current)
+        return block
@@ -0,0 +1,199 @@
+"""A key-value store for large documents (GameState, ServerSettings) that persists each top-level field separately.
+
+The stock `KeyValueStore` keeps a whole document in a single tag, so changing one field (e.g. `await_ask_key`)
+re-uploads everything, including the full quest history. This store keeps one tag per top-level field on the same
+store file and remembers what it last loaded or saved, so a save only replaces the tags of the fields that changed.
+
+Loads are still a single file query: the tags of a file come back with it, so there is nothing to gain by fetching
+fields one at a time.
+
+A save adds a new tag for each changed field, and deletes the tags they supersede only after all of them are stored.
+The first save, and one that removes fields, re-create the store file with every field in one call, and delete the old
+file only after that. Every write carries a revision number, so a reader that catches two tags for a field or two
+store files in between picks the newest deterministically.
+
+Documents saved by the stock `KeyValueStore` (a single tag named after the store) are read transparently and
+migrated to the per-field layout on the next save.
+"""
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from pydantic.json import pydantic_encoder
+from steamship import Block, File, Steamship, SteamshipError, Tag
+from steamship.utils.kv_store import KV_STORE_MARKER
+
+_FIELD_TAG_PREFIX = "field:"
+
+
+def _fingerprint(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=pydantic_encoder)
+
+
+def _revision(tag: Tag) -> int:
+    return (tag.value or {}).get("revision", 0)
+
+
+class FieldKeyValueStore:
+    """Stores a dict document as one tag per top-level key, writing only the keys that changed."""
+
+    client: Steamship
+    store_identifier: str
+    document_key: str
+
+    def __init__(self, client: Steamship, document_key: str):
+        self.client = client
+        self.document_key = document_key
+        # Same file as `KeyValueStore(client, document_key)`, so documents it saved are still found.
+        self.store_identifier = f"kv-store-{document_key}"
+        self._file: Optional[File] = None
+        # Store files superseded by `_file` that haven't been deleted yet.
+        self._stale_files: List[File] = []
+        self._field_tags: Dict[str, Tag] = {}
+        self._persisted: Dict[str, str] = {}
+        self._revision = 0
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Return the stored document, or None if nothing has been saved yet."""
+        self._refresh()
+        if self._file is None:
+            return None
+        self._index_field_tags()
+
+        legacy_value = None
+        for tag in self._file.tags:
+            if tag.kind == self.store_identifier and tag.name == self.document_key:
+                legacy_value = tag.value
+
+        if not self._field_tags:
+            return legacy_value
+
+        document = {
+            field: (tag.value or {}).get("value")
+            for field, tag in self._field_tags.items()
+        }
+
+        self._persisted = {
+            field: _fingerprint(value) for field, value in document.items()
+        }
+        return document
+
+    def changed_fields(self, document: Dict[str, Any]) -> List[str]:
+        """The top-level fields of `document` that differ from what was last loaded or saved."""
+        return [
+            field
+            for field, value in document.items()
+            if self._persisted.get(field) != _fingerprint(value)
+        ]
+
+    def save(self, document: Dict[str, Any]) -> List[str]:
+        """Persist the fields of `document` that changed. Returns the names of the fields written."""
+        changed = self.changed_fields(document)
+        removed = [field for field in self._persisted if field not in document]
+        if not changed and not removed:
+            return []
+
+        if self._file is None:
+            self._refresh()
+
+        if self._file is None or not self._field_tags or removed:
+            self._rewrite(document)
+        else:
+            try:
+                self._revision += 1
+                new_tags = {
+                    field: Tag.create(
+                        self.client,
+                        file_id=self._file.id,
+                        kind=self.store_identifier,
+                        name=f"{_FIELD_TAG_PREFIX}{field}",
+                        value={"value": document[field], "revision": self._revision},
+                    )
+                    for field in changed
+                }
+            except SteamshipError as e:
+                # Most likely another invocation re-created the store file underneath us.
+                logging.warning(
+                    f"Unable to update fields of {self.document_key}; rewriting it. {e}"
+                )
+                self._refresh()
+                self._rewrite(document)
+            else:
+                # Only once every new value is stored; until then readers see the old tags, and after that the newer
+                # revision wins.
+                for field, tag in new_tags.items():
+                    self._delete_field_tag(field)
+                    self._field_tags[field] = tag
+
+        self._persisted = {
+            field: _fingerprint(value) for field, value in document.items()
+        }
+        return changed
+
+    def _refresh(self):
+        files = File.query(
+            self.client, f'filetag and kind "{self.store_identifier}"'
+        ).files
+        # A rewrite interrupted before deleting the old file leaves two; the one with the newest revision wins.
+        files = sorted(files, key=lambda file: (self._file_revision(file), file.id or ""))
+        self._file = files[-1] if files else None
+        self._stale_files = files[:-1]
+        self._index_field_tags()
+
+    def _index_field_tags(self):
+        self._field_tags = {}
+        self._revision = self._file_revision(self._file) if self._file else 0
+        for tag in self._file.tags if self._file else []:
+            if tag.kind == self.store_identifier and tag.name.startswith(
+                _FIELD_TAG_PREFIX
+            ):
+                field = tag.name[len(_FIELD_TAG_PREFIX) :]
+                current = self._field_tags.get(field)
+                if current is None or _revision(tag) >= _revision(current):
+                    self._field_tags[field] = tag
+                self._revision = max(self._revision, _revision(tag))
+
+    def _file_revision(self, file: File) -> int:
+        for tag in file.tags or []:
+            if tag.kind == self.store_identifier and tag.name == KV_STORE_MARKER:
+                return _revision(tag)
+        return 0
+
+    def _rewrite(self, document: Dict[str, Any]):
+        old_files = self._stale_files + ([self._file] if self._file else [])
+        self._revision += 1
+        revision = {"revision": self._revision}
+        self._file = File.create(
+            self.client,
+            blocks=[Block(text="")],
+            tags=[Tag(kind=self.store_identifier, name=KV_STORE_MARKER, value=revision)]
+            + [
+                Tag(
+                    kind=self.store_identifier,
+                    name=f"{_FIELD_TAG_PREFIX}{field}",
+                    value={"value": value, **revision},
+                )
+                for field, value in document.items()
+            ],
+        )
+        self._stale_files = []
+        self._field_tags = {
+            tag.name[len(_FIELD_TAG_PREFIX) :]: tag
+            for tag in self._file.tags or []
+            if tag.name and tag.name.startswith(_FIELD_TAG_PREFIX)
+        }
+        # Delete the old files only once the new one exists, so readers never find the store empty.
+        for old_file in old_files:
+            try:
+                old_file.delete()
+            except SteamshipError as e:
+                logging.warning(f"Unable to delete a superseded store file of {self.document_key}. {e}")
+
+    def _delete_field_tag(self, field: str):
+        tag = self._field_tags.pop(field, None)
+        if tag is None:
+            return
+        try:
+            tag.delete()
+        except SteamshipError as e:
+            logging.warning(f"Unable to delete stale field {field} of {self.document_key}. {e}")
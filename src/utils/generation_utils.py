@@ -12,15 +12,18 @@ doesn't need to know.
 """
 import json
 import logging
-import time
-from typing import List, Optional, Tuple
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple, TypeVar
 
-from steamship import Block, Tag
+from steamship import Block, File, PluginInstance, Steamship, SteamshipError, Tag
 from steamship.agents.schema import AgentContext
-from steamship.agents.schema.message_selectors import tokens
 from steamship.data import TagKind
-from steamship.data.block import StreamState
 from steamship.data.tags.tag_constants import ChatTag, RoleTag, TagValueKey
+from steamship.data.tags.tag_utils import get_tag
 
 from schema.characters import HumanCharacter
 from schema.quest import QuestDescription
@@ -31,12 +34,21 @@ from utils.ChatHistoryFilter import (
     TagFilter,
     TrimmingStoryContextFilter,
     UnionFilter,
+    compile_filter,
+)
+from utils.chat_history_index import get_chat_history_index
+from utils.classification_cache import (
+    cache_classification,
+    classification_key,
+    get_cached_classification,
 )
 from utils.context_utils import (
     emit,
     get_game_state,
     get_reasoning_generator,
+    get_reasoning_model_name,
     get_server_settings,
+    get_story_model_name,
     get_story_text_generator,
     update_onboarding_message_background,
 )
@@ -51,8 +63,83 @@ from utils.tags import (
     TagKindExtensions,
 )
 from utils.moderation_utils import is_block_excluded
+from utils.stream_waiter import await_stream, refresh_file_with
+from utils.token_budget import budget_policy_for
+from utils.tokenizer_service import count_tokens
 from steamship.cli.utils import is_in_replit
 from tools.vector_search_response_tool import VectorSearchResponseTool
+
+T = TypeVar("T")
+
+# Independent generations (e.g. a classification and an estimate needed for the same turn) can run side by side on
+# this pool. Its size bounds how many generation calls are in flight at once.
+GENERATION_CONCURRENCY = 4
+_GENERATION_EXECUTOR = ThreadPoolExecutor(
+    max_workers=GENERATION_CONCURRENCY, thread_name_prefix="generation"
+)
+
+
+# The character and story context every quest generation is conditioned on.
+_CHARACTER_CONTEXT_TAGS = [
+    (TagKindExtensions.CHARACTER, CharacterTag.NAME),
+    (TagKindExtensions.CHARACTER, CharacterTag.MOTIVATION),
+    (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
+    (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
+    (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
+    (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
+]
+
+# Context filters are compiled once, at import; the quest ones are bound per call with `for_quest`.
+QUEST_CONTENT_FILTER = compile_filter(UnionFilter([
+    TagFilter(tag_types=_CHARACTER_CONTEXT_TAGS + [
+        (TagKindExtensions.STORY_CONTEXT, StoryContextTag.VOICE),
+        (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
+    ]),
+    QuestNameFilter(quest_name=None),
+    LastInventoryFilter(),
+]))
+
+QUEST_CONTEXT_FILTER = compile_filter(UnionFilter([
+    TagFilter(tag_types=_CHARACTER_CONTEXT_TAGS + [
+        (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
+    ]),
+    QuestNameFilter(quest_name=None),
+    LastInventoryFilter(),
+]))
+
+QUEST_ITEM_FILTER = compile_filter(UnionFilter([
+    QuestNameFilter(quest_name=None),
+    LastInventoryFilter(),
+]))
+
+MERCHANT_INVENTORY_FILTER = compile_filter(UnionFilter([
+    TagFilter(_CHARACTER_CONTEXT_TAGS + [
+        (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
+        (TagKindExtensions.MERCHANT, MerchantTag.INVENTORY_GENERATION_PROMPT),
+    ]),
+    LastInventoryFilter(),
+]))
+
+QUEST_ARC_FILTER = compile_filter(TagFilter([
+    (TagKindExtensions.CHARACTER, CharacterTag.NAME),
+    (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
+    (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
+    (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
+    (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
+    (TagKindExtensions.QUEST_ARC, QuestArcTag.PROMPT),
+]))
+
+STORY_INTRO_FILTER = compile_filter(TagFilter([
+    (TagKindExtensions.CHARACTER, CharacterTag.NAME),
+    (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
+    (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
+    (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
+    (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
+    (TagKindExtensions.STORY_CONTEXT, StoryContextTag.VOICE),
+    (TagKindExtensions.CHARACTER, CharacterTag.INTRODUCTION_PROMPT),
+]))
+
+
 def print_log(message: str):
     if is_in_replit():
         print("[LOG] "+message)
@@ -94,20 +181,6 @@ def send_story_generation(prompt: str, quest_name: str,
                           context: AgentContext, additional_context: Optional[str] = None) -> Optional[Block]:
     """Generates and sends a background image to the player."""
     #user_block = send_user_message(context,quest_name)
-    filter=UnionFilter([
-        TagFilter(tag_types=[
-            (TagKindExtensions.CHARACTER, CharacterTag.NAME),
-            (TagKindExtensions.CHARACTER, CharacterTag.MOTIVATION),
-            (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
-            (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
-            (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
-            (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
-            (TagKindExtensions.STORY_CONTEXT, StoryContextTag.VOICE),
-            (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
-        ]),
-        QuestNameFilter(quest_name=quest_name),
-        LastInventoryFilter(),
-    ])
     block = do_token_trimmed_generation(
         context,
         prompt,
@@ -120,20 +193,7 @@ def send_story_generation(prompt: str, quest_name: str,
             Tag(kind=TagKindExtensions.QUEST, name=QuestTag.QUEST_CONTENT),
             QuestIdTag(quest_name),
         ],
-        filter=UnionFilter([
-            TagFilter(tag_types=[
-                (TagKindExtensions.CHARACTER, CharacterTag.NAME),
-                (TagKindExtensions.CHARACTER, CharacterTag.MOTIVATION),
-                (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
-                (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
-                (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
-                (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
-                (TagKindExtensions.STORY_CONTEXT, StoryContextTag.VOICE),
-                (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
-            ]),
-            QuestNameFilter(quest_name=quest_name),
-            LastInventoryFilter(),
-        ]),
+        filter=QUEST_CONTENT_FILTER.for_quest(quest_name),
         generation_for="Quest Content",
         stop_tokens=["</s>", "<|im_end|>","\n\nUSER:","\n##"],
     )
@@ -141,58 +201,47 @@ def send_story_generation(prompt: str, quest_name: str,
     return block
 
 
-def generate_likelihood_estimation(prompt: str, quest_name: str,
-                                   context: AgentContext) -> Optional[Block]:
-    """Generates a likelihood calculation of success for an event."""
-    #print("prompt :"+prompt)
-    prompt_block = Block(text=prompt)
-    block = do_token_trimmed_generation(
-        context,
-        prompt,
+def _likelihood_estimation_args(prompt: str, quest_name: str) -> dict:
+    return dict(
+        prompt=prompt,
         prompt_tags=[
             Tag(kind=TagKindExtensions.QUEST,
                 name=QuestTag.LIKELIHOOD_EVALUATION),
             QuestIdTag(quest_name),
         ],
         output_tags=[],
-        filter=UnionFilter([
-            TagFilter(tag_types=[
-                (TagKindExtensions.CHARACTER, CharacterTag.NAME),
-                (TagKindExtensions.CHARACTER, CharacterTag.MOTIVATION),
-                (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
-                (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
-                (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
-                (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
-                (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
-            ]),
-            QuestNameFilter(quest_name=quest_name),
-            LastInventoryFilter(),
-        ]),
+        filter=QUEST_CONTEXT_FILTER.for_quest(quest_name),
         generation_for="Dice Roll",
         stop_tokens=["\n", "</s>", "<|im_end|>"],
+    )
+
+
+def generate_likelihood_estimation(prompt: str, quest_name: str,
+                                   context: AgentContext) -> Optional[Block]:
+    """Generates a likelihood calculation of success for an event."""
+    #print("prompt :"+prompt)
+    block = do_token_trimmed_generation(
+        context,
+        **_likelihood_estimation_args(prompt, quest_name),
         new_file=True,
         streaming=False,
     )
     return block
 
 
+def prepare_likelihood_estimation(prompt: str, quest_name: str,
+                                  context: AgentContext) -> "ScratchGeneration":
+    """The likelihood estimation as a scratch generation, to run on another thread. See ScratchGeneration."""
+    return prepare_token_trimmed_generation(
+        context, **_likelihood_estimation_args(prompt, quest_name)
+    )
+
+
 def generate_is_solution_attempt(prompt: str, quest_name: str,
                                  context: AgentContext) -> Optional[Block]:
     """Decides whether input is an attempt to solve the problem."""
     #print("prompt :"+prompt)
-    filter=UnionFilter([
-        TagFilter(tag_types=[
-            (TagKindExtensions.CHARACTER, CharacterTag.NAME),
-            (TagKindExtensions.CHARACTER, CharacterTag.MOTIVATION),
-            (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
-            (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
-            (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
-            (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
-            (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
-        ]),
-        QuestNameFilter(quest_name=quest_name),
-        LastInventoryFilter(),
-    ])
+    filter = QUEST_CONTEXT_FILTER.for_quest(quest_name)
     block = do_token_trimmed_generation(
         context,
         prompt,
@@ -211,75 +260,54 @@ def generate_is_solution_attempt(prompt: str, quest_name: str,
     #log_filtered_blocks(context, filter, "Quest Content Generation")
     return block
 
-def generate_is_image_request(prompt: str, quest_name: str,
-         context: AgentContext) -> Optional[Block]:
-    """Decides whether input is an attempt to request image."""
-    #print_log("prompt :"+prompt)
-    filter=UnionFilter([
-    TagFilter(tag_types=[
-    (TagKindExtensions.CHARACTER, CharacterTag.NAME),
-    (TagKindExtensions.CHARACTER, CharacterTag.MOTIVATION),
-    (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
-    (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
-    (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
-    (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
-    (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
-    ]),
-    QuestNameFilter(quest_name=quest_name),
-    LastInventoryFilter(),
-    ])
-    block = do_token_trimmed_generation(
-    context,
-    prompt,
-    prompt_tags=[
-    Tag(kind=TagKindExtensions.QUEST,
-    name=QuestTag.IS_IMAGE_REQUEST),
-    QuestIdTag(quest_name),
-    ],
-    output_tags=[],
-    filter=filter,
-    generation_for="Is a image request",
-    stop_tokens=["</s>", "<|im_end|>","</result>"],
-    new_file=True,
-    streaming=False,
-    )
-    #log_filtered_blocks(context, filter, "Quest Content Generation")
-    return block
+# The image plan puts its yes/no answer first; generation stops as soon as the answer is no.
+_IMAGE_NOT_REQUESTED_STOPS = ['"ImageRequested": false', '"ImageRequested":false']
+_IMAGE_REQUESTED = re.compile(r'"ImageRequested"\s*:\s*true', re.IGNORECASE)
+_IMAGE_KEYWORDS = re.compile(r'"ImageDescriptionKeywords"\s*:\s*\[(.*?)(?:\]|$)', re.DOTALL)
 
-def generate_image_description(prompt: str, quest_name: str,
-     context: AgentContext) -> Optional[Block]:
-    """Generate image description for image"""
-    #print("prompt :"+prompt)
-    filter=UnionFilter([
-    TagFilter(tag_types=[
-    (TagKindExtensions.CHARACTER, CharacterTag.NAME),
-    (TagKindExtensions.CHARACTER, CharacterTag.MOTIVATION),
-    (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
-    (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
-    (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
-    (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
-    (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
-    ]),
-    QuestNameFilter(quest_name=quest_name),
-    LastInventoryFilter(),
-    ])
+
+def parse_image_plan(text: str) -> Tuple[bool, List[str]]:
+    """Parses an image plan into whether an image was requested and its description keywords.
+
+    Tolerates output cut short, by a stop sequence or the token limit: no "ImageRequested": true means no request,
+    and the keywords that were written before the cut are kept.
+    """
+    if not _IMAGE_REQUESTED.search(text):
+        return False, []
+    try:
+        plan = json.loads(text[text.index("{"):text.rindex("}") + 1])
+        keywords = plan.get("ImageDescriptionKeywords", [])
+        return True, [str(keyword) for keyword in keywords]
+    except (ValueError, AttributeError):
+        match = _IMAGE_KEYWORDS.search(text)
+        if not match:
+            return True, []
+        return True, [
+            json.loads(f'"{keyword}"')
+            for keyword in re.findall(r'"((?:[^"\\]|\\.)*)"', match.group(1))
+        ]
+
+
+def generate_image_plan(prompt: str, quest_name: str,
+                        context: AgentContext) -> Tuple[bool, List[str]]:
+    """Decides whether an image was requested and, if so, describes it, returning (requested, keywords)."""
     block = do_token_trimmed_generation(
-    context,
-    prompt,
-    prompt_tags=[
-    Tag(kind=TagKindExtensions.QUEST,
-    name=QuestTag.IMAGE_DESCRIPTION_PROMPT),
-    QuestIdTag(quest_name),
-    ],
-    output_tags=[],
-    filter=filter,
-    generation_for="Image description",
-    stop_tokens=["</s>", "<|im_end|>","\n\n<","\n<"],
-    new_file=True,
-    streaming=False,
+        context,
+        prompt,
+        prompt_tags=[
+            Tag(kind=TagKindExtensions.QUEST,
+                name=QuestTag.IS_IMAGE_REQUEST),
+            QuestIdTag(quest_name),
+        ],
+        output_tags=[],
+        filter=QUEST_CONTEXT_FILTER.for_quest(quest_name),
+        generation_for="Image plan",
+        stop_tokens=["</s>", "<|im_end|>"] + _IMAGE_NOT_REQUESTED_STOPS,
+        new_file=True,
+        streaming=False,
     )
-    #log_filtered_blocks(context, filter, "Quest Content Generation")
-    return block
+    return parse_image_plan(block.text)
+
 
 def generate_quest_summary(quest_name: str,
                            context: AgentContext,
@@ -332,9 +360,7 @@ def generate_quest_item(quest_name: str, player: HumanCharacter,
                 name=QuestTag.ITEM_GENERATION_CONTENT),
             QuestIdTag(quest_name),
         ],
-        filter=UnionFilter(
-            [QuestNameFilter(quest_name=quest_name),
-             LastInventoryFilter()]),
+        filter=QUEST_ITEM_FILTER.for_quest(quest_name),
         generation_for="Quest Item",
         streaming=False,
     )
@@ -363,22 +389,7 @@ def generate_merchant_inventory(
         output_tags=[
             Tag(kind=TagKindExtensions.MERCHANT, name=MerchantTag.INVENTORY)
         ],
-        filter=UnionFilter([
-            TagFilter([
-                (TagKindExtensions.CHARACTER, CharacterTag.NAME),
-                (TagKindExtensions.CHARACTER, CharacterTag.MOTIVATION),
-                (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
-                (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
-                (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
-                (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
-                (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
-                (
-                    TagKindExtensions.MERCHANT,
-                    MerchantTag.INVENTORY_GENERATION_PROMPT,
-                ),
-            ]),
-            LastInventoryFilter(),
-        ]),
+        filter=MERCHANT_INVENTORY_FILTER,
         generation_for="Merchant Inventory",
         streaming=False,
     )
@@ -397,19 +408,90 @@ def generate_merchant_inventory(
     return result
 
 
+# A quest arc takes at most this many generations: the first asks for the whole arc, later ones only for the quests
+# still missing.
+QUEST_ARC_MAX_GENERATIONS = 3
+
+
+def _parse_quest_goal_list(text: str) -> List[QuestDescription]:
+    """Parses the `QUEST GOAL: <goal> QUEST LOCATION: <location>` list format."""
+    result = []
+    items = text.split("QUEST GOAL:")
+    for item in items:
+        if len(item.strip()) > 0 and "QUEST LOCATION" in item:
+            parts = item.split("QUEST LOCATION:")
+            if len(parts) == 2:
+                goal = parts[0].strip()
+                location = parts[1].strip().rstrip(".")
+                if "\n" in location:
+                    location = location[:location.index("\n")]
+                result.append(QuestDescription(goal=goal, location=location))
+    return result
+
+
+def parse_quest_arc(text: str) -> List[QuestDescription]:
+    """Parses the quests of a JSON list of `{"goal": ..., "location": ...}` objects.
+
+    Every complete object is kept, even if the list itself was cut short or is surrounded by other text. Falls back to
+    the `QUEST GOAL:` list format for models that ignore the request for JSON.
+    """
+    decoder = json.JSONDecoder()
+    result = []
+    position = text.find("{")
+    while position != -1:
+        try:
+            value, end = decoder.raw_decode(text, position)
+        except ValueError:
+            position = text.find("{", position + 1)
+            continue
+        if isinstance(value, dict) and value.get("goal") and value.get("location"):
+            result.append(
+                QuestDescription(
+                    goal=str(value["goal"]).strip(),
+                    location=str(value["location"]).strip().rstrip("."),
+                )
+            )
+        position = text.find("{", end)
+    return result or _parse_quest_goal_list(text)
+
+
+def _quest_arc_prompt(player: HumanCharacter, adventure_goal: str, quests_per_arc: int,
+                      so_far: List[QuestDescription]) -> str:
+    missing = quests_per_arc - len(so_far)
+    if so_far:
+        listed = "\n".join(
+            json.dumps({"goal": quest.goal, "location": quest.location}) for quest in so_far
+        )
+        request = (
+            f"{player.name} will go on {quests_per_arc} quests of increasing difficulty to achieve their overall goal "
+            f"of {adventure_goal}. The first {len(so_far)} are:\n{listed}\n"
+            f"Please list the remaining {missing} quests, which come after these and must not repeat them."
+        )
+    else:
+        request = (
+            f"Please list {quests_per_arc} quests of increasing difficulty that {player.name} will go in to achieve "
+            f"their overall goal of {adventure_goal}."
+        )
+    return (
+        f"{request} They should fit the setting of the story.\n"
+        f"Return only a JSON list of {missing} objects, each with a \"goal\" and a \"location\" (the location's "
+        f"name), like:\n"
+        f'[{{"goal": "<goal>", "location": "<location name>"}}]\n'
+        f"No other text."
+    )
+
+
 def generate_quest_arc(player: HumanCharacter,
                        context: AgentContext) -> List[QuestDescription]:
     server_settings = get_server_settings(context)
-    prompt = (
-        f"Please list {server_settings.quests_per_arc} quests of increasing difficulty that {player.name} will go in to achieve their overall "
-        f"goal of {server_settings.adventure_goal}. They should fit the setting of the story.\n"
-        f"Return only the `QUEST GOAL: <goal> QUEST LOCATION: <location name>` list with {server_settings.quests_per_arc} quests. No other text."
-    )
+    quests_per_arc = server_settings.quests_per_arc
     result: List[QuestDescription] = []
-    while len(result) != server_settings.quests_per_arc:
+    for _ in range(QUEST_ARC_MAX_GENERATIONS):
+        if len(result) >= quests_per_arc:
+            break
         block = do_generation(
             context,
-            prompt,
+            _quest_arc_prompt(player, server_settings.adventure_goal, quests_per_arc, result),
             prompt_tags=[
                 Tag(
                     kind=TagKindExtensions.QUEST_ARC,
@@ -419,29 +501,25 @@ def generate_quest_arc(player: HumanCharacter,
             output_tags=[
                 Tag(kind=TagKindExtensions.QUEST_ARC, name=QuestArcTag.RESULT)
             ],
-            filter=TagFilter([
-                (TagKindExtensions.CHARACTER, CharacterTag.NAME),
-                (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
-                (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
-                (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
-                (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
-                (TagKindExtensions.QUEST_ARC, QuestArcTag.PROMPT),
-            ]),
+            filter=QUEST_ARC_FILTER,
             generation_for="Quest Arc",
             streaming=False,
         )
-        result = []
-        items = block.text.split("QUEST GOAL:")
-        for item in items:
-            if len(item.strip()) > 0 and "QUEST LOCATION" in item:
-                parts = item.split("QUEST LOCATION:")
-                if len(parts) == 2:
-                    goal = parts[0].strip()
-                    location = parts[1].strip().rstrip(".")
-                    if "\n" in location:
-                        location = location[:location.index("\n")]
-                    result.append(
-                        QuestDescription(goal=goal, location=location))
+        goals = {quest.goal.lower() for quest in result}
+        for quest in parse_quest_arc(block.text):
+            if len(result) < quests_per_arc and quest.goal.lower() not in goals:
+                result.append(quest)
+                goals.add(quest.goal.lower())
+
+    if not result:
+        raise SteamshipError(
+            message=f"Unable to generate a quest arc in {QUEST_ARC_MAX_GENERATIONS} attempts."
+        )
+    if len(result) < quests_per_arc:
+        logging.warning(
+            f"Generated {len(result)} of {quests_per_arc} quests in {QUEST_ARC_MAX_GENERATIONS} attempts; "
+            f"continuing with a shorter quest arc."
+        )
     return result
 
 
@@ -461,21 +539,72 @@ def generate_story_intro(player: HumanCharacter, context: AgentContext) -> str:
             Tag(kind=TagKindExtensions.CHARACTER,
                 name=CharacterTag.INTRODUCTION)
         ],
-        filter=TagFilter([
-            (TagKindExtensions.CHARACTER, CharacterTag.NAME),
-            (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
-            (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
-            (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
-            (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
-            (TagKindExtensions.STORY_CONTEXT, StoryContextTag.VOICE),
-            (TagKindExtensions.CHARACTER, CharacterTag.INTRODUCTION_PROMPT),
-        ]),
+        filter=STORY_INTRO_FILTER,
         generation_for="Character Introduction",
         streaming=False,
     )
     return block.text
 
 
+# Generations answered by the reasoning model rather than the story model.
+_REASONING_GENERATIONS = ["image plan"]
+
+
+def _uses_reasoning_generator(generation_for: str) -> bool:
+    return generation_for.lower() in _REASONING_GENERATIONS
+
+
+# Short classifications whose results are cached (see classification_cache). Their output is a word or two and
+# doesn't go into the chat history.
+_CACHED_GENERATIONS = ["is a solution attempt", "dice roll", "image plan"]
+
+
+def _classification_cache_key(
+    context: AgentContext,
+    generator,
+    generation_for: str,
+    prompt: str,
+    options: dict,
+    block_indices: List[int],
+    prompt_block: Optional[Block],
+) -> str:
+    model_name = _model_name_for(context, generation_for)
+    selected = set(block_indices)
+    if prompt_block:
+        # A new prompt block is appended on every call; the prompt itself is part of the key.
+        selected.discard(prompt_block.index_in_file)
+    context_blocks = [
+        block
+        for block in context.chat_history.file.blocks
+        if block.index_in_file in selected
+    ]
+    return classification_key(
+        model_name, getattr(generator, "config", None), prompt, options, context_blocks
+    )
+
+
+def _model_name_for(context: AgentContext, generation_for: str) -> str:
+    if _uses_reasoning_generator(generation_for):
+        return get_reasoning_model_name(context)
+    return get_story_model_name(context)
+
+
+def _generator_for(context: AgentContext, generation_for: str):
+    if _uses_reasoning_generator(generation_for):
+        return get_reasoning_generator(context)
+    return get_story_text_generator(context)
+
+
+def submit_generation(fn: Callable[..., T], *args, **kwargs) -> "Future[T]":
+    """Runs `fn(*args, **kwargs)`, typically one of the generate_* functions, on the generation pool.
+
+    Generators are created lazily and cached on the context, so resolve any the call needs (e.g. with
+    `get_reasoning_generator`) before submitting, rather than from several threads at once. Don't wait on the
+    returned future from inside another pooled generation: the pool is bounded.
+    """
+    return _GENERATION_EXECUTOR.submit(fn, *args, **kwargs)
+
+
 def do_token_trimmed_generation(
     context: AgentContext,
     prompt: str,
@@ -488,23 +617,13 @@ def do_token_trimmed_generation(
     new_file: bool = False,
     streaming: bool = True,
 ) -> Block:
-    game_state = get_game_state(context=context)
-    server_settings = get_server_settings(context)
-    avail_tokens = server_settings.context_size - server_settings.default_story_max_tokens
-    avail_tokens -= tokens(Block(text=prompt))
-
     block = do_generation(
         context,
         prompt,
         additional_context,
         prompt_tags=prompt_tags,
         output_tags=output_tags,
-        filter=TrimmingStoryContextFilter(
-            base_filter=filter,
-            current_quest_id=game_state.current_quest,
-            game_state=game_state,
-            max_tokens=avail_tokens,
-        ),
+        filter=_trimming_filter(context, prompt, filter, generation_for),
         generation_for=generation_for,
         stop_tokens=stop_tokens,
         new_file=new_file,
@@ -513,6 +632,45 @@ def do_token_trimmed_generation(
     return block
 
 
+def prepare_token_trimmed_generation(
+    context: AgentContext,
+    prompt: str,
+    prompt_tags: List[Tag],
+    output_tags: List[Tag],
+    filter: ChatHistoryFilter,
+    generation_for: str,
+    stop_tokens: Optional[List[str]] = None,
+) -> "ScratchGeneration":
+    """Like do_token_trimmed_generation, but prepared as a scratch generation. See prepare_scratch_generation."""
+    return prepare_scratch_generation(
+        context,
+        prompt,
+        prompt_tags=prompt_tags,
+        output_tags=output_tags,
+        filter=_trimming_filter(context, prompt, filter, generation_for),
+        generation_for=generation_for,
+        stop_tokens=stop_tokens,
+    )
+
+
+def _trimming_filter(
+    context: AgentContext, prompt: str, filter: ChatHistoryFilter, generation_for: str
+) -> TrimmingStoryContextFilter:
+    game_state = get_game_state(context=context)
+    server_settings = get_server_settings(context)
+    model_name = _model_name_for(context, generation_for)
+    avail_tokens = server_settings.context_size - server_settings.default_story_max_tokens
+    avail_tokens -= count_tokens(prompt, model_name)
+    return TrimmingStoryContextFilter(
+        base_filter=filter,
+        current_quest_id=game_state.current_quest,
+        game_state=game_state,
+        max_tokens=avail_tokens,
+        model_name=model_name,
+        budget_policy=budget_policy_for(generation_for),
+    )
+
+
 def do_generation(
     context: AgentContext,
     prompt: str,
@@ -527,26 +685,9 @@ def do_generation(
 ) -> Block:
     """Generates the inventory for a merchant"""
 
-    generator = None
-    generation_for_reasoning = [
-        "is a image request",
-        "image description"
-    ]
-    if generation_for.lower() in generation_for_reasoning:
-        generator = get_reasoning_generator(context)
-    else:
-        generator = get_story_text_generator(context)
+    generator = _generator_for(context, generation_for)
 
-    output_tags.extend([
-        Tag(
-            kind=TagKind.CHAT,
-            name=ChatTag.ROLE,
-            value={TagValueKey.STRING_VALUE: RoleTag.ASSISTANT},
-        ),
-        Tag(kind=TagKind.CHAT, name=ChatTag.MESSAGE),
-        # See agent_service.py::chat_history_append_func for the duplication prevention this tag results in
-        Tag(kind=TagKind.CHAT, name="streamed-to-chat-history"),
-    ])
+    _add_output_message_tags(output_tags)
 
 
     
@@ -578,9 +719,19 @@ def do_generation(
         if prompt_block and prompt_block.index_in_file not in block_indices:
             block_indices.append(prompt_block.index_in_file)
 
-    options = {}
-    if stop_tokens:
-        options["stop"] = stop_tokens
+    options = _generation_options(stop_tokens)
+
+    cache_key = None
+    if new_file and not streaming and generation_for.lower() in _CACHED_GENERATIONS:
+        cache_key = _classification_cache_key(
+            context, generator, generation_for, prompt, options, block_indices, prompt_block
+        )
+        cached_text = get_cached_classification(cache_key)
+        if cached_text is not None:
+            # Tagged like a generated block, so emitting it doesn't append it to the chat history either.
+            block = Block(text=cached_text, tags=output_tags)
+            emit(output=block, context=context)
+            return block
 
     output_file_id = None if new_file else context.chat_history.file.id
 
@@ -602,27 +753,159 @@ def do_generation(
         options=options,
     )
     task.wait()
+    block = _output_block(task, cache_key)
+    emit(output=block, context=context)  # todo: should emit be optional ?
+    return block
+
+
+def _add_output_message_tags(output_tags: List[Tag]):
+    output_tags.extend([
+        Tag(
+            kind=TagKind.CHAT,
+            name=ChatTag.ROLE,
+            value={TagValueKey.STRING_VALUE: RoleTag.ASSISTANT},
+        ),
+        Tag(kind=TagKind.CHAT, name=ChatTag.MESSAGE),
+        # See agent_service.py::chat_history_append_func for the duplication prevention this tag results in
+        Tag(kind=TagKind.CHAT, name="streamed-to-chat-history"),
+    ])
+
+
+def _generation_options(stop_tokens: Optional[List[str]]) -> dict:
+    options = {}
+    if stop_tokens:
+        options["stop"] = stop_tokens
+    return options
+
+
+def _output_block(task, cache_key: Optional[str]) -> Block:
     blocks = task.output.blocks
     block = blocks[0]
     # only re-fetch block if it is not ephemeral...
     if block.client and block.id:
         block = Block.get(block.client, _id=block.id)
-    emit(output=block, context=context)  # todo: should emit be optional ?
+    if cache_key and block.text:
+        cache_classification(cache_key, block.text)
     return block
 
 
+@dataclass
+class ScratchGeneration:
+    """A generation that leaves no trace, with its inputs already copied out of the chat history.
+
+    The selected chat history and the prompt go into a scratch file instead of the chat history, and the output
+    isn't emitted. Use it for generations whose result may be dropped. `run` needs nothing from the AgentContext,
+    so it can run on another thread after the request that prepared it has moved on.
+    """
+
+    client: Steamship
+    generator: PluginInstance
+    blocks: List[Block]
+    output_tags: List[Tag]
+    options: dict
+    cache_key: Optional[str] = None
+    cached_text: Optional[str] = None
+
+    def run(self) -> Block:
+        if self.cached_text is not None:
+            return Block(text=self.cached_text, tags=self.output_tags)
+        input_file = File.create(self.client, blocks=self.blocks)
+        try:
+            task = self.generator.generate(
+                tags=self.output_tags,
+                append_output_to_file=False,
+                input_file_id=input_file.id,
+                output_file_id=None,
+                streaming=False,
+                input_file_block_index_list=list(range(len(self.blocks))),
+                options=self.options,
+            )
+            task.wait()
+        finally:
+            _delete_scratch_file(input_file)
+        return _output_block(task, self.cache_key)
+
+
+def prepare_scratch_generation(
+    context: AgentContext,
+    prompt: str,
+    prompt_tags: List[Tag],
+    output_tags: List[Tag],
+    filter: ChatHistoryFilter,
+    generation_for: str,  # For debugging output
+    stop_tokens: Optional[List[str]] = None,
+) -> ScratchGeneration:
+    """Select the chat history for the prompt and copy everything the generation needs. See ScratchGeneration."""
+    generator = _generator_for(context, generation_for)
+    output_tags = list(output_tags)
+    _add_output_message_tags(output_tags)
+
+    block_indices = filter.filter_chat_history(
+        chat_history_file=context.chat_history.file, filter_for=generation_for)
+    if not get_server_settings(context).chat_mode:
+        block_indices = sorted(block_indices)
+    options = _generation_options(stop_tokens)
+
+    cache_key = None
+    cached_text = None
+    if generation_for.lower() in _CACHED_GENERATIONS:
+        cache_key = _classification_cache_key(
+            context, generator, generation_for, prompt, options, block_indices, None
+        )
+        cached_text = get_cached_classification(cache_key)
+
+    return ScratchGeneration(
+        client=context.client,
+        generator=generator,
+        blocks=_scratch_blocks(context, block_indices, prompt, prompt_tags),
+        output_tags=output_tags,
+        options=options,
+        cache_key=cache_key,
+        cached_text=cached_text,
+    )
+
+
+def _role_tags(role: Optional[str]) -> List[Tag]:
+    if not role:
+        return []
+    return [
+        Tag(kind=TagKind.CHAT, name=ChatTag.ROLE, value={TagValueKey.STRING_VALUE: role}),
+        Tag(kind=TagKind.CHAT, name=ChatTag.MESSAGE),
+    ]
+
+
+def _scratch_blocks(
+    context: AgentContext, block_indices: List[int], prompt: str, prompt_tags: List[Tag]
+) -> List[Block]:
+    """Copies of the selected chat history blocks, in order, followed by the prompt as a system message."""
+    by_index = {block.index_in_file: block for block in context.chat_history.file.blocks}
+    blocks = [
+        Block(text=by_index[index].text, tags=_role_tags(by_index[index].chat_role))
+        for index in block_indices
+        if index in by_index
+    ]
+    blocks.append(Block(text=prompt, tags=prompt_tags + _role_tags(RoleTag.SYSTEM)))
+    return blocks
+
+
+def _delete_scratch_file(file: File):
+    try:
+        file.delete()
+    except SteamshipError as e:
+        logging.warning(f"Unable to delete scratch file {file.id}. {e}")
+
+
 def await_streamed_block(block: Block, context: AgentContext) -> Block:
-    while block.stream_state not in [
-            StreamState.COMPLETE, StreamState.ABORTED
-    ]:
-        time.sleep(0.4)
-        block = Block.get(block.client, _id=block.id)
-    
-    context.chat_history.file.refresh()
+    block = await_stream(block)
+    refresh_file_with(context.chat_history.file, [block])
+    if get_tag(
+        tags=block.tags or [], kind=TagKindExtensions.QUEST, name=QuestTag.QUEST_CONTENT
+    ) and not get_server_settings(context).chat_mode:
+        prefetch_action_choices(context, block)
     return block
 
 
-def generate_action_choices(context: AgentContext) -> Block:
+def _action_choices_args(context: AgentContext) -> dict:
     game_state = get_game_state(context)
     quest_name = game_state.current_quest
 
@@ -640,9 +923,8 @@ Example:
 
 JSON:"""
     #print(prompt)
-    block = do_token_trimmed_generation(
-        context,
-        prompt,
+    return dict(
+        prompt=prompt,
         prompt_tags=[
             # intentionally don't add this to the quest. it lives as sorta "out-of-quest" generation
             # that still requires quest data.
@@ -653,23 +935,101 @@ JSON:"""
             # provide a way to filter this out, in case this ends up in a saved file somewhere (not currently)
             Tag(kind=TagKindExtensions.QUEST, name=QuestTag.ACTION_CHOICES),
         ],
-        filter=UnionFilter([
-            TagFilter(tag_types=[
-                (TagKindExtensions.CHARACTER, CharacterTag.NAME),
-                (TagKindExtensions.CHARACTER, CharacterTag.MOTIVATION),
-                (TagKindExtensions.CHARACTER, CharacterTag.DESCRIPTION),
-                (TagKindExtensions.CHARACTER, CharacterTag.BACKGROUND),
-                (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
-                (TagKindExtensions.STORY_CONTEXT, StoryContextTag.BACKGROUND),
-                (TagKindExtensions.QUEST, QuestTag.QUEST_SUMMARY),
-            ]),
-            QuestNameFilter(quest_name=quest_name),
-            LastInventoryFilter(),
-        ]),
+        filter=QUEST_CONTEXT_FILTER.for_quest(quest_name),
         generation_for="Action Choices",
         stop_tokens=["\n\n","</s>", "<|im_end|>"],
+    )
+
+
+def generate_action_choices(context: AgentContext) -> Block:
+    """Action choices for the player's next move."""
+    block = do_token_trimmed_generation(
+        context,
+        **_action_choices_args(context),
         new_file=True,  # don't put this in the chat history. it is help content.
         streaming=False,
     )
     print_log("Action choices: " + block.text)
     return block
+
+
+# Action choices for the story so far, by the id of its last quest content block. They are generated in the background
+# as soon as a quest content block finishes, so they are usually ready by the time the player asks for them.
+_ACTION_CHOICES_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="action-choices")
+_ACTION_CHOICES: "OrderedDict[str, Future]" = OrderedDict()
+_ACTION_CHOICES_LOCK = threading.Lock()
+_MAX_PREFETCHED_ACTION_CHOICES = 64
+# Chat history file id -> the id of the quest content block most recently prefetched for.
+_LATEST_PREFETCHES: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _last_quest_content_block_id(context: AgentContext) -> Optional[str]:
+    chat_history_file = context.chat_history.file
+    positions = get_chat_history_index(chat_history_file).positions_for_tag(
+        TagKindExtensions.QUEST, QuestTag.QUEST_CONTENT
+    )
+    if not positions:
+        return None
+    return chat_history_file.blocks[positions[-1]].id
+
+
+def _remember(entries: OrderedDict, key: str, value):
+    with _ACTION_CHOICES_LOCK:
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > _MAX_PREFETCHED_ACTION_CHOICES:
+            entries.popitem(last=False)
+
+
+def _remember_action_choices(block_id: str, future: "Future[Optional[Block]]"):
+    _remember(_ACTION_CHOICES, block_id, future)
+
+
+def _generate_action_choices_for(
+    generation: ScratchGeneration, file_id: str, block_id: str
+) -> Optional[Block]:
+    with _ACTION_CHOICES_LOCK:
+        if _LATEST_PREFETCHES.get(file_id) != block_id:
+            # The story moved on before this got to run.
+            return None
+    block = generation.run()
+    print_log("Action choices: " + block.text)
+    return block
+
+
+def prefetch_action_choices(context: AgentContext, content_block: Block):
+    """Start generating action choices for the story as of `content_block`, a finished quest content block."""
+    if not content_block.id:
+        return
+    with _ACTION_CHOICES_LOCK:
+        if content_block.id in _ACTION_CHOICES:
+            return
+    # Choices are help content and may never be asked for: generate them without writing to the chat history or
+    # emitting anything to the player. The inputs are copied here; the worker never sees the context.
+    generation = prepare_token_trimmed_generation(context, **_action_choices_args(context))
+    file_id = context.chat_history.file.id
+    _remember(_LATEST_PREFETCHES, file_id, content_block.id)
+    future = _ACTION_CHOICES_EXECUTOR.submit(
+        _generate_action_choices_for, generation, file_id, content_block.id
+    )
+    _remember_action_choices(content_block.id, future)
+
+
+def get_action_choices(context: AgentContext) -> Block:
+    """Action choices for the story so far: prefetched, joined while in flight, or generated now."""
+    block_id = _last_quest_content_block_id(context)
+    with _ACTION_CHOICES_LOCK:
+        future = _ACTION_CHOICES.get(block_id) if block_id else None
+    if future is not None:
+        try:
+            if (block := future.result()) is not None:
+                return block
+        except Exception as e:
+            logging.warning(f"Prefetched action choices failed; generating them again. {e}")
+
+    block = generate_action_choices(context)
+    if block_id:
+        done: "Future[Optional[Block]]" = Future()
+        done.set_result(block)
+        _remember_action_choices(block_id, done)
+    return block
@@ -0,0 +1,264 @@
+"""Rolling, hierarchical compaction of a quest's chat history.
+
+In chat mode the whole conversation is a single quest, so its history grows for as long as the player keeps
+chatting, and building each prompt means filtering and counting all of it. Compaction keeps that bounded:
+
+* Once there are enough older messages (beyond the most recent `KEEP_RECENT_MESSAGES`), the oldest
+  `MESSAGES_PER_SUMMARY` are folded into a level 1 summary block.
+* Once a level has `2 * SUMMARIES_PER_SUMMARY` summaries, the oldest `SUMMARIES_PER_SUMMARY` are folded into one
+  summary of the next level, up to `MAX_LEVEL`.
+
+Folded blocks are marked excluded, so prompt assembly skips them; the summaries carry the quest id and a
+HistorySummaryTag recording the range of messages they cover, so prompts place them where those messages were.
+
+Compaction runs on a background thread after a turn, off the critical path. It is safe to interrupt: the summary is
+written before its sources are excluded, and sources already covered by a summary are excluded, not re-summarized,
+on the next run.
+
+Deciding whether to compact only looks at the messages since the last compaction ended, and the compacted messages
+are dropped from the chat history index, so neither the check nor prompt assembly walks the compacted history.
+"""
+import logging
+import threading
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from steamship import Block, File, PluginInstance, Steamship, Tag
+from steamship.data import TagKind
+from steamship.data.tags.tag_constants import ChatTag, RoleTag, TagValueKey
+
+from utils.chat_history_index import INDEX_LOCK, ChatHistoryIndex, get_chat_history_index
+from utils.moderation_utils import is_block_excluded, mark_block_as_excluded
+from utils.tags import HistorySummaryTag, QuestIdTag, QuestTag, TagKindExtensions
+
+# The newest messages are always kept verbatim.
+KEEP_RECENT_MESSAGES = 24
+
+# Messages folded into each level 1 summary.
+MESSAGES_PER_SUMMARY = 12
+
+# Summaries folded into each summary of the next level.
+SUMMARIES_PER_SUMMARY = 4
+
+# Summaries of the top level are never folded further.
+MAX_LEVEL = 3
+
+_COMPACTED_REASON = "compacted"
+
+_SUMMARY_PROMPT = """Summarize the following part of a story conversation in a few sentences, in the third person and past tense. Keep names, places, items, promises and anything the characters may refer back to. Return only the summary.
+
+{transcript}
+
+SUMMARY:"""
+
+# A single worker: compactions of the same file must not run concurrently.
+_COMPACTION_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-compaction")
+_SCHEDULED_FILES = set()
+_SCHEDULED_LOCK = threading.Lock()
+
+# Chat history file id -> the position after the last message folded into a level 1 summary by this process.
+_COMPACTED_UNTIL: Dict[str, int] = {}
+
+
+def story_position(block: Block) -> int:
+    """Where the block belongs in the story: its own position, or the position of the last message it summarizes."""
+    if summary_tag := HistorySummaryTag.get(block.tags):
+        return summary_tag.value.get("last", block.index_in_file)
+    return block.index_in_file
+
+
+def _level(block: Block) -> int:
+    if summary_tag := HistorySummaryTag.get(block.tags):
+        return summary_tag.value.get("level", 1)
+    return 0
+
+
+def _is_compactable_message(block: Block, quest_name: str) -> bool:
+    if not block.text or block.chat_role not in [RoleTag.USER, RoleTag.ASSISTANT]:
+        return False
+    if not any(QuestIdTag.matches(tag, quest_name) for tag in block.tags or []):
+        return False
+    # Character blocks (e.g. the seed message) set up the conversation; keep them as they are.
+    return not any(tag.kind == TagKindExtensions.CHARACTER for tag in block.tags or [])
+
+
+def _transcript(blocks: List[Block]) -> str:
+    lines = []
+    for block in blocks:
+        if _level(block) > 0:
+            lines.append(f"(Earlier) {block.text.strip()}")
+        else:
+            lines.append(f"{block.chat_role.upper()}: {block.text.strip()}")
+    return "\n".join(lines)
+
+
+def _covered_by(block: Block, summaries: List[Block]) -> bool:
+    position = story_position(block)
+    for summary in summaries:
+        value = HistorySummaryTag.get(summary.tags).value
+        if value.get("first", -1) <= position <= value.get("last", -1):
+            return True
+    return False
+
+
+def compact_history(
+    client: Steamship,
+    chat_history_file: File,
+    quest_name: str,
+    summarize: Callable[[str], str],
+) -> List[Block]:
+    """Fold old messages and summaries of the quest into summaries. Returns the summary blocks created."""
+    by_level: Dict[int, List[Block]] = {}
+    for block in chat_history_file.blocks or []:
+        if HistorySummaryTag.get(block.tags):
+            if any(QuestIdTag.matches(tag, quest_name) for tag in block.tags or []):
+                by_level.setdefault(_level(block), []).append(block)
+        elif _is_compactable_message(block, quest_name):
+            by_level.setdefault(0, []).append(block)
+
+    created = []
+    for level in range(0, MAX_LEVEL):
+        live = []
+        for block in by_level.get(level, []):
+            if _covered_by(block, by_level.get(level + 1, [])):
+                # Left over from an interrupted compaction: the summary exists, the source wasn't excluded yet.
+                if not is_block_excluded(block):
+                    mark_block_as_excluded(block, _COMPACTED_REASON)
+            elif not is_block_excluded(block):
+                live.append(block)
+
+        if level == 0:
+            fold_size = MESSAGES_PER_SUMMARY
+            foldable = live[: max(0, len(live) - KEEP_RECENT_MESSAGES)]
+        else:
+            fold_size = SUMMARIES_PER_SUMMARY
+            foldable = live[: max(0, len(live) - SUMMARIES_PER_SUMMARY)]
+
+        while len(foldable) >= fold_size:
+            sources, foldable = foldable[:fold_size], foldable[fold_size:]
+            summary = _fold(client, chat_history_file, quest_name, level + 1, sources, summarize)
+            by_level.setdefault(level + 1, []).append(summary)
+            created.append(summary)
+    return created
+
+
+def _fold(
+    client: Steamship,
+    chat_history_file: File,
+    quest_name: str,
+    level: int,
+    sources: List[Block],
+    summarize: Callable[[str], str],
+) -> Block:
+    first = min(
+        HistorySummaryTag.get(block.tags).value["first"] if _level(block) else block.index_in_file
+        for block in sources
+    )
+    last = max(story_position(block) for block in sources)
+    text = summarize(_SUMMARY_PROMPT.format(transcript=_transcript(sources))).strip()
+    summary = Block.create(
+        client,
+        file_id=chat_history_file.id,
+        text=text,
+        tags=[
+            Tag(
+                kind=TagKind.CHAT,
+                name=ChatTag.ROLE,
+                value={TagValueKey.STRING_VALUE: RoleTag.SYSTEM},
+            ),
+            QuestIdTag(quest_name),
+            HistorySummaryTag(level, first, last),
+        ],
+    )
+    for block in sources:
+        mark_block_as_excluded(block, _COMPACTED_REASON)
+    return summary
+
+
+def _summarize_with(generator: PluginInstance) -> Callable[[str], str]:
+    def summarize(prompt: str) -> str:
+        task = generator.generate(text=prompt, append_output_to_file=False)
+        task.wait()
+        return task.output.blocks[0].text
+
+    return summarize
+
+
+def _compacted_until(summary: Block) -> Optional[int]:
+    """The position after the messages the summary covers, if it is a level 1 summary."""
+    if _level(summary) != 1:
+        return None
+    return HistorySummaryTag.get(summary.tags).value.get("last", -1) + 1
+
+
+def _run_compaction(client: Steamship, file_id: str, quest_name: str, generator: PluginInstance):
+    try:
+        chat_history_file = File.get(client, _id=file_id)
+        created = compact_history(client, chat_history_file, quest_name, _summarize_with(generator))
+        ends = [end for end in map(_compacted_until, created) if end is not None]
+        if ends:
+            with _SCHEDULED_LOCK:
+                _COMPACTED_UNTIL[file_id] = max(_COMPACTED_UNTIL.get(file_id, 0), *ends)
+    except Exception as e:
+        # Compaction is an optimization: the uncompacted history is still valid.
+        logging.warning(f"Unable to compact chat history {file_id}: {e}")
+    finally:
+        with _SCHEDULED_LOCK:
+            _SCHEDULED_FILES.discard(file_id)
+
+
+def _last_compaction_end(
+    index: ChatHistoryIndex, chat_history_file: File, quest_name: str
+) -> int:
+    """The position after the last message of the quest that has been compacted, or 0."""
+    with _SCHEDULED_LOCK:
+        recorded = _COMPACTED_UNTIL.get(chat_history_file.id, 0)
+    # Summaries are appended newest last, and higher levels only ever follow a new level 1 summary.
+    positions = index.positions_for_tag(TagKindExtensions.QUEST, QuestTag.HISTORY_SUMMARY)
+    for position in reversed(positions):
+        summary = chat_history_file.blocks[position]
+        if not any(QuestIdTag.matches(tag, quest_name) for tag in summary.tags or []):
+            continue
+        end = _compacted_until(summary)
+        if end is not None:
+            return max(recorded, end)
+    return recorded
+
+
+def schedule_history_compaction(
+    client: Steamship,
+    chat_history_file: File,
+    quest_name: str,
+    generator: PluginInstance,
+):
+    """Compact the quest's history in the background, unless a compaction of this file is already pending.
+
+    Cheap to call after every turn: only the messages since the last compaction are looked at, and nothing is
+    scheduled until enough of them have accumulated.
+    """
+    with INDEX_LOCK:
+        index = get_chat_history_index(chat_history_file)
+        start = _last_compaction_end(index, chat_history_file, quest_name)
+        index.drop_compacted(
+            chat_history_file,
+            quest_name,
+            start,
+            lambda block: _is_compactable_message(block, quest_name),
+        )
+        positions = index.positions_for_quest(quest_name)
+        uncompacted = sum(
+            1
+            for position in positions[bisect_left(positions, start) :]
+            if _is_compactable_message(chat_history_file.blocks[position], quest_name)
+            and not is_block_excluded(chat_history_file.blocks[position])
+        )
+    if uncompacted < KEEP_RECENT_MESSAGES + MESSAGES_PER_SUMMARY:
+        return
+    with _SCHEDULED_LOCK:
+        if chat_history_file.id in _SCHEDULED_FILES:
+            return
+        _SCHEDULED_FILES.add(chat_history_file.id)
+    _COMPACTION_EXECUTOR.submit(
+        _run_compaction, client, chat_history_file.id, quest_name, generator
+    )
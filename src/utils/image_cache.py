@@ -0,0 +1,71 @@
+"""A content-addressed cache for generated images.
+
+Editor previews, avatars, camp images and item images are often requested again with exactly the same prompt and
+theme. With a fixed seed the provider would render the same picture, so the result is cached under a hash of
+everything that determines it: the provider, the final prompt and every generation option (model, theme parameters,
+LoRAs, negative prompt, size and seed). Only the public URL of the image block is kept; a hit copies it into a new
+block instead of calling the provider.
+
+An unseeded request renders a different image every time, so it is only cached in the deterministic seed mode,
+where `image_seed` fixes the seed from the theme or, failing that, from the prompt.
+
+USAGE:
+
+    options["seed"] = image_seed(prompt, theme.seed)
+    key = image_key(provider, prompt, options)
+    cached = get_cached_image(key)
+    if cached is None:
+        ...
+        cache_image(key, block.raw_data_url, block.mime_type)
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+IMAGE_CACHE_TTL_S = 24 * 60 * 60
+_MAX_CACHED_IMAGES = 512
+
+_IMAGES: "OrderedDict[str, tuple]" = OrderedDict()
+_IMAGES_LOCK = threading.Lock()
+
+
+def image_seed(prompt: str, theme_seed: Optional[int] = None) -> int:
+    """The theme's seed if it sets one, otherwise one derived from the prompt."""
+    if theme_seed is not None and theme_seed >= 0:
+        return theme_seed
+    return int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:4], "big") >> 1
+
+
+def image_key(provider: str, prompt: str, options: Dict[str, Any]) -> str:
+    return hashlib.sha256(
+        json.dumps([provider, prompt, options], sort_keys=True, default=str).encode(
+            "utf-8"
+        )
+    ).hexdigest()
+
+
+def get_cached_image(key: str) -> Optional[Tuple[str, Optional[str]]]:
+    """The (url, mime type) of a cached image, if any."""
+    now = time.monotonic()
+    with _IMAGES_LOCK:
+        cached = _IMAGES.get(key)
+        if cached is None:
+            return None
+        if now - cached[0] >= IMAGE_CACHE_TTL_S:
+            del _IMAGES[key]
+            return None
+        _IMAGES.move_to_end(key)
+        return cached[1]
+
+
+def cache_image(key: str, url: Optional[str], mime_type: Optional[str]):
+    if not url:
+        return
+    with _IMAGES_LOCK:
+        _IMAGES[key] = (time.monotonic(), (url, mime_type))
+        _IMAGES.move_to_end(key)
+        while len(_IMAGES) > _MAX_CACHED_IMAGES:
+            _IMAGES.popitem(last=False)
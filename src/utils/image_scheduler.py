@@ -0,0 +1,291 @@
+"""Process-wide scheduling of image generation jobs.
+
+Chat images, scene backgrounds, merchant inventories and editor previews all call the image providers directly, and
+a burst of them can trip a provider's rate limit. Every provider call goes through `schedule_image_job` instead,
+which, per provider:
+ - limits the number of jobs running at once (a job runs from submission until its task completes),
+ - spaces submissions with a token bucket, and
+ - starts waiting jobs in order of priority, so an interactive chat image doesn't queue behind an inventory refresh.
+
+Jobs the caller doesn't wait on take their turn in the same queue, and are then submitted and waited on by a thread of
+their own, one per running job.
+
+A job identical to one still in flight (same provider, prompt, options, tags and output file) isn't submitted again:
+it shares the running job's task.
+
+USAGE:
+
+    task = schedule_image_job(
+        provider=plugin_handle,
+        priority=ImagePriority.ITEM,
+        key=image_job_key(plugin_handle, prompt, options, file_id, tags),
+        submit=lambda: plugin.generate(...),
+    )
+"""
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Callable, Dict, List, Optional, Union
+
+from steamship import Tag, Task
+
+
+class ImagePriority(IntEnum):
+    """Lower values start first."""
+
+    CHAT = 0
+    SCENE = 1
+    ITEM = 2
+    PREVIEW = 3
+
+
+# Set on a context to run all of its image jobs at another priority, e.g. editor previews of in-game images.
+IMAGE_PRIORITY_KEY = "image-priority"
+
+
+@dataclass
+class ProviderLimits:
+    max_concurrent: int
+    rate_per_s: float
+    burst: int
+
+
+_DEFAULT_LIMITS = ProviderLimits(max_concurrent=2, rate_per_s=1, burst=2)
+
+# Keyed by plugin handle.
+PROVIDER_LIMITS: Dict[str, ProviderLimits] = {
+    "fal-ai-image-generator": ProviderLimits(max_concurrent=4, rate_per_s=2, burst=4),
+    "fal-sd-lora-image-generator": ProviderLimits(
+        max_concurrent=4, rate_per_s=2, burst=4
+    ),
+    "getimg-ai-image-generator": ProviderLimits(
+        max_concurrent=3, rate_per_s=1, burst=3
+    ),
+    "dall-e": ProviderLimits(max_concurrent=2, rate_per_s=0.2, burst=2),
+}
+
+_SEQUENCE = itertools.count()
+
+
+class _ProviderQueue:
+    def __init__(self, limits: ProviderLimits):
+        self.limits = limits
+        self.active = 0
+        self.tokens = float(limits.burst)
+        self.refilled_at = time.monotonic()
+        # (priority, sequence) of every waiting job, whether a caller waits on it or it runs in the background.
+        self.waiting = []
+        # Jobs nobody waits on, by sequence: started on a thread of their own when they reach the head of the line.
+        self.background: Dict[int, Callable[[], None]] = {}
+        self.retry_pending = False
+        self.condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.limits.burst,
+            self.tokens + (now - self.refilled_at) * self.limits.rate_per_s,
+        )
+        self.refilled_at = now
+
+    def _take_slot(self):
+        heapq.heappop(self.waiting)
+        self.tokens -= 1
+        self.active += 1
+        # The next job in line may be able to start too.
+        self.condition.notify_all()
+
+    def _dispatch(self):
+        """Start background jobs at the head of the line while there is room. Called with the condition held."""
+        while (
+            self.waiting
+            and self.waiting[0][1] in self.background
+            and self.active < self.limits.max_concurrent
+        ):
+            self._refill()
+            if self.tokens < 1:
+                if not self.retry_pending:
+                    self.retry_pending = True
+                    delay = (1 - self.tokens) / self.limits.rate_per_s
+                    timer = threading.Timer(delay, self._retry)
+                    timer.daemon = True
+                    timer.start()
+                return
+            run = self.background.pop(self.waiting[0][1])
+            self._take_slot()
+            threading.Thread(target=run, name="image-job", daemon=True).start()
+
+    def _retry(self):
+        with self.condition:
+            self.retry_pending = False
+            self._dispatch()
+
+    def acquire(self, priority: ImagePriority):
+        with self.condition:
+            entry = (int(priority), next(_SEQUENCE))
+            heapq.heappush(self.waiting, entry)
+            self._dispatch()
+            while True:
+                timeout = None
+                if (
+                    self.waiting[0] == entry
+                    and self.active < self.limits.max_concurrent
+                ):
+                    self._refill()
+                    if self.tokens >= 1:
+                        break
+                    timeout = (1 - self.tokens) / self.limits.rate_per_s
+                self.condition.wait(timeout)
+            self._take_slot()
+            self._dispatch()
+
+    def start_in_background(self, priority: ImagePriority, run: Callable[[], None]):
+        """Queue `run` to start, on its own thread, once it is first in line and there is room for it."""
+        with self.condition:
+            sequence = next(_SEQUENCE)
+            self.background[sequence] = run
+            heapq.heappush(self.waiting, (int(priority), sequence))
+            self._dispatch()
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+            self._dispatch()
+
+
+_QUEUES: Dict[str, _ProviderQueue] = {}
+_IN_FLIGHT: Dict[str, "Future[Task]"] = {}
+_LOCK = threading.Lock()
+
+
+def _provider_queue(provider: str) -> _ProviderQueue:
+    with _LOCK:
+        if provider not in _QUEUES:
+            _QUEUES[provider] = _ProviderQueue(
+                PROVIDER_LIMITS.get(provider, _DEFAULT_LIMITS)
+            )
+        return _QUEUES[provider]
+
+
+def image_job_key(
+    provider: str,
+    prompt: str,
+    options: dict,
+    output_file_id: Optional[str],
+    tags: Optional[List[Tag]],
+) -> str:
+    return hashlib.sha256(
+        json.dumps(
+            [
+                provider,
+                prompt,
+                options,
+                output_file_id,
+                [tag.dict(by_alias=True) for tag in tags or []],
+            ],
+            sort_keys=True,
+            default=str,
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+class ScheduledTask:
+    """The task of an image job scheduled with `wait=False`, which may still be queued for its provider.
+
+    `wait` blocks until the job has been submitted and its task has completed. Any other attribute is the task's,
+    and blocks until the job has been submitted.
+    """
+
+    def __init__(self, job: "Future[Task]"):
+        self._job = job
+
+    @property
+    def task_id(self) -> Optional[str]:
+        if self._job.done() and self._job.exception() is None:
+            return self._job.result().task_id
+        return None
+
+    def wait(self, *args, **kwargs) -> Task:
+        task = self._job.result()
+        task.wait(*args, **kwargs)
+        return task
+
+    def __getattr__(self, name: str):
+        return getattr(self._job.result(), name)
+
+
+def schedule_image_job(
+    provider: str,
+    priority: ImagePriority,
+    key: str,
+    submit: Callable[[], Task],
+    wait: bool = True,
+    on_complete: Optional[Callable[[Task], None]] = None,
+) -> Union[Task, ScheduledTask]:
+    """Submit an image job once `provider` has room for it, returning its completed task.
+
+    With `wait=False`, returns a `ScheduledTask` at once. The job waits its turn in the provider's queue, then is
+    submitted and waited on by a thread of its own, which also runs `on_complete` and logs any failure; callers
+    needn't watch it. `on_complete` is called with the task once it has completed, unless the job was coalesced into
+    one in flight.
+    """
+    with _LOCK:
+        running = _IN_FLIGHT.get(key)
+        if running is None:
+            job = _IN_FLIGHT[key] = Future()
+    if running is not None:
+        if not wait:
+            return ScheduledTask(running)
+        task = running.result()
+        task.wait(retry_delay_s=0.1)
+        return task
+
+    queue = _provider_queue(provider)
+
+    def start() -> Task:
+        try:
+            task = submit()
+        except Exception as e:
+            job.set_exception(e)
+            raise
+        job.set_result(task)
+        return task
+
+    def finish():
+        queue.release()
+        with _LOCK:
+            _IN_FLIGHT.pop(key, None)
+
+    if not wait:
+
+        def run():
+            try:
+                task = start()
+                task.wait(retry_delay_s=0.5)
+                if on_complete:
+                    on_complete(task)
+            except Exception as e:
+                logging.warning(f"Background image job for {provider} failed: {e}")
+            finally:
+                finish()
+
+        queue.start_in_background(priority, run)
+        return ScheduledTask(job)
+
+    queue.acquire(priority)
+    try:
+        task = start()
+        task.wait(retry_delay_s=0.1)
+    finally:
+        finish()
+    if on_complete:
+        on_complete(task)
+    return task
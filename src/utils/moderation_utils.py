@@ -7,13 +7,13 @@ _ADMIN_TAG_KIND: Final[str] = "admin"
 _EXCLUDED_TAG_NAME: Final[str] = "excluded"
 
 
-def mark_block_as_excluded(block: Block):
+def mark_block_as_excluded(block: Block, reason: str = "flagged"):
     if not block:
         return
     block._one_time_set_tag(
         tag_kind=_ADMIN_TAG_KIND,
         tag_name=_EXCLUDED_TAG_NAME,
-        string_value="flagged",
+        string_value=reason,
     )
 
 
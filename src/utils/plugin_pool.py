@@ -0,0 +1,84 @@
+"""Process-wide pool of plugin instances.
+
+`client.use_plugin(...)` resolves (and possibly creates) the plugin instance with a round-trip to the engine every
+time it is called. The generators ask for the same handful of instances on every request, so this module keeps the
+resolved instances around, keyed by workspace, plugin handle, version and config, and hands them back until they
+expire. Settings and API keys reach the plugins through their config, so changing them resolves a new instance
+rather than reusing one created with the old values.
+
+USAGE:
+
+    generator = use_pooled_plugin(context.client, "gpt-4", config=config, version="0.1.4")
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from steamship import PluginInstance, Steamship
+
+# How long a resolved instance is reused before it is resolved again.
+PLUGIN_INSTANCE_TTL_S = 15 * 60
+
+# Upper bound on the number of instances kept, to bound memory if configs churn (e.g. per-theme image sizes).
+_MAX_POOLED_INSTANCES = 128
+
+_PoolKey = Tuple[str, str, Optional[str], Optional[str], str]
+
+_POOL: Dict[_PoolKey, Tuple[float, PluginInstance]] = {}
+_POOL_LOCK = threading.Lock()
+
+
+def _config_hash(config: Optional[Dict[str, Any]]) -> str:
+    return hashlib.sha256(
+        json.dumps(config or {}, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _pool_key(
+    client: Steamship,
+    plugin_handle: str,
+    version: Optional[str],
+    instance_handle: Optional[str],
+    config: Optional[Dict[str, Any]],
+) -> _PoolKey:
+    workspace = client.config.workspace_id or client.config.workspace_handle or ""
+    return workspace, plugin_handle, version, instance_handle, _config_hash(config)
+
+
+def use_pooled_plugin(
+    client: Steamship,
+    plugin_handle: str,
+    config: Optional[Dict[str, Any]] = None,
+    version: Optional[str] = None,
+    instance_handle: Optional[str] = None,
+) -> PluginInstance:
+    """Drop-in replacement for `client.use_plugin` that reuses instances resolved within the last TTL."""
+    key = _pool_key(client, plugin_handle, version, instance_handle, config)
+    now = time.monotonic()
+
+    with _POOL_LOCK:
+        entry = _POOL.get(key)
+        if entry is not None and now - entry[0] < PLUGIN_INSTANCE_TTL_S:
+            # The instance is shared; give this caller a copy bound to its own client.
+            return entry[1].copy(update={"client": client})
+
+    kwargs = {"config": config, "version": version}
+    if instance_handle is not None:
+        kwargs["instance_handle"] = instance_handle
+    instance = client.use_plugin(plugin_handle, **kwargs)
+
+    with _POOL_LOCK:
+        _evict_expired(now)
+        if len(_POOL) >= _MAX_POOLED_INSTANCES:
+            oldest = min(_POOL, key=lambda k: _POOL[k][0])
+            del _POOL[oldest]
+        _POOL[key] = (now, instance)
+    return instance
+
+
+def _evict_expired(now: float):
+    expired = [k for k, (created, _) in _POOL.items() if now - created >= PLUGIN_INSTANCE_TTL_S]
+    for k in expired:
+        del _POOL[k]
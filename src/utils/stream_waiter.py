@@ -0,0 +1,107 @@
+"""Waiting for streamed blocks to finish, and catching a local chat history file up with them.
+
+Streams usually finish within a few hundred milliseconds of the generation task, so polling at a fixed 0.4s wastes
+most of that interval. The waiter polls with exponential backoff, starting at a few milliseconds, and checks every
+pending block of a wait with a single block query.
+
+After a stream finishes, the chat history file only needs the blocks appended since it was loaded, which the caller
+usually already has in hand: `refresh_file_with` merges them in and only reloads the whole file if some other block
+may have been appended in between.
+
+USAGE:
+
+    block = await_stream(block)
+    refresh_file_with(context.chat_history.file, [block])
+"""
+import logging
+import time
+from typing import Dict, List, Optional
+
+from steamship import Block, File, Steamship, SteamshipError
+from steamship.data.block import StreamState
+
+INITIAL_POLL_INTERVAL_S = 0.005
+MAX_POLL_INTERVAL_S = 0.4
+_BACKOFF_FACTOR = 2
+
+_FINISHED_STATES = [StreamState.COMPLETE, StreamState.ABORTED]
+
+# Cleared if the engine rejects the batched status query, after which blocks are fetched one at a time.
+_batched_query_supported = True
+
+
+def is_stream_finished(block: Block) -> bool:
+    return block.stream_state in _FINISHED_STATES
+
+
+def _fetch_blocks(client: Steamship, block_ids: List[str]) -> Dict[str, Block]:
+    global _batched_query_supported
+    if len(block_ids) > 1 and _batched_query_supported:
+        ids = " or ".join(f'block_id "{block_id}"' for block_id in block_ids)
+        try:
+            found = {
+                block.id: block
+                for block in Block.query(client, f"blocktag and ({ids})").blocks
+            }
+            if all(block_id in found for block_id in block_ids):
+                return found
+        except SteamshipError as e:
+            logging.warning(f"Batched block status query failed; polling blocks one by one. {e}")
+            _batched_query_supported = False
+    return {block_id: Block.get(client, _id=block_id) for block_id in block_ids}
+
+
+def await_streams(blocks: List[Block], timeout_s: Optional[float] = None) -> List[Block]:
+    """Wait until every block has finished streaming (or the timeout passes).
+
+    Returns the latest version of each block, in the order given. Blocks that were already finished are returned as
+    they are.
+    """
+    latest: Dict[str, Block] = {block.id: block for block in blocks}
+    pending = [block.id for block in blocks if not is_stream_finished(block)]
+    if not pending:
+        return blocks
+
+    client = blocks[0].client
+    start = time.perf_counter()
+    interval = INITIAL_POLL_INTERVAL_S
+    while pending:
+        if timeout_s is not None:
+            remaining = timeout_s - (time.perf_counter() - start)
+            if remaining <= 0:
+                break
+            interval = min(interval, remaining)
+        time.sleep(interval)
+        latest.update(_fetch_blocks(client, pending))
+        pending = [block_id for block_id in pending if not is_stream_finished(latest[block_id])]
+        interval = min(interval * _BACKOFF_FACTOR, MAX_POLL_INTERVAL_S)
+    return [latest[block.id] for block in blocks]
+
+
+def await_stream(block: Block, timeout_s: Optional[float] = None) -> Block:
+    return await_streams([block], timeout_s=timeout_s)[0]
+
+
+def refresh_file_with(file: File, new_blocks: List[Block]) -> File:
+    """Bring `file.blocks` up to date with `new_blocks`, fetched since the file was loaded.
+
+    Blocks the file already has are replaced by their new versions and blocks right after its last one are appended.
+    If a block would leave a gap (something else was appended in between), the whole file is reloaded instead.
+    """
+    if file.blocks is None:
+        file.blocks = []
+    positions = {block.index_in_file: i for i, block in enumerate(file.blocks)}
+    last_index = file.blocks[-1].index_in_file if file.blocks else -1
+    for block in sorted(new_blocks, key=lambda b: b.index_in_file or 0):
+        if block.file_id != file.id or block.index_in_file is None:
+            continue
+        block.client = file.client
+        if block.index_in_file in positions:
+            file.blocks[positions[block.index_in_file]] = block
+        elif block.index_in_file == last_index + 1:
+            positions[block.index_in_file] = len(file.blocks)
+            file.blocks.append(block)
+            last_index = block.index_in_file
+        else:
+            return file.refresh()
+    return file
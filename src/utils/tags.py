@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import Optional
 
 from steamship import Tag
 
@@ -102,6 +103,7 @@ class QuestTag(str, Enum):
     CHAT_QUEST = "chat-quest"
     IMAGE_DESCRIPTION_PROMPT = "image_description_prompt"
     IS_IMAGE_REQUEST = "is_image_request"
+    HISTORY_SUMMARY = "history_summary"
 
 
 class ItemTag(str, Enum):
@@ -134,6 +136,27 @@ class QuestIdTag(Tag):
         )
 
 
+class HistorySummaryTag(Tag):
+    """Marks a block summarizing older quest messages (level 1) or older summaries (levels 2 and up).
+
+    `first` and `last` are the positions in the chat history file of the first and last message it covers.
+    """
+
+    @staticmethod
+    def get(tags) -> Optional[Tag]:
+        for tag in tags or []:
+            if tag.kind == TagKindExtensions.QUEST and tag.name == QuestTag.HISTORY_SUMMARY:
+                return tag
+        return None
+
+    def __init__(self, level: int, first: int, last: int):
+        super().__init__(
+            kind=TagKindExtensions.QUEST,
+            name=QuestTag.HISTORY_SUMMARY,
+            value={"level": level, "first": first, "last": last},
+        )
+
+
 class QuestArcTag(str, Enum):
     PROMPT = "prompt"
     RESULT = "result"
@@ -142,3 +165,5 @@ class QuestArcTag(str, Enum):
 class InstructionsTag(str, Enum):
     ONBOARDING = "onboarding"
     QUEST = "quest"
+    # The onboarding message with the latest retrieved background; its value holds the slot's version.
+    ONBOARDING_CONTEXT = "onboarding_context"
@@ -0,0 +1,38 @@
+"""Completion handlers for engine tasks the caller doesn't wait on.
+
+Scene music streams into the chat history on its own, so the player's turn needn't wait for it to render. A task
+requested without waiting can be handed to `watch_task`, which waits on it in the background, then runs the completion
+handler (for any follow-up state updates), or logs the failure. Images don't need watching: utils.image_scheduler
+waits on the jobs it starts in the background.
+
+USAGE:
+
+    task = music_gen.request_scene_music_generation(description, context, wait=False)
+    watch_task(task, "scene music")
+"""
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from steamship import Task
+
+_WATCHER_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="task-watcher")
+
+
+def _wait_and_handle(task: Task, label: str, on_complete: Optional[Callable[[Task], None]]):
+    try:
+        task.wait(retry_delay_s=0.5)
+        if on_complete:
+            on_complete(task)
+    except Exception as e:
+        logging.warning(f"Background {label} task {task.task_id} failed: {e}")
+
+
+def watch_task(
+    task: Optional[Task], label: str, on_complete: Optional[Callable[[Task], None]] = None
+) -> Optional[Future]:
+    """Wait for `task` in the background, calling `on_complete(task)` once it has succeeded."""
+    if task is None:
+        return None
+    return _WATCHER_EXECUTOR.submit(_wait_and_handle, task, label, on_complete)
+
@@ -0,0 +1,89 @@
+"""An index of the image themes available to a game.
+
+Every image looks its theme up by name (or, in chat mode, by model) among the workspace's custom themes and the
+premade ones, and then each generator converts it to the theme class it works with. The index is built once per set
+of themes in the ServerSettings and reused until the themes change. It is keyed by a hash of the themes' contents,
+since the ServerSettings, and with them the theme objects, are parsed anew for every request. Conversions to a
+generator's theme class are kept on the index as well.
+
+USAGE:
+
+    registry = theme_registry(server_settings.image_themes)
+    theme = registry.by_name(name) or DEFAULT_THEME
+    flux_theme = registry.typed(theme, FluxTheme)
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Type, TypeVar
+
+from schema.image_theme import (
+    PREMADE_THEMES,
+    CustomStableDiffusionTheme,
+    FluxTheme,
+    GetImgTheme,
+    ImageTheme,
+)
+
+T = TypeVar("T", bound=ImageTheme)
+
+# Themes that can be looked up by their model.
+_MODEL_THEME_TYPES = (CustomStableDiffusionTheme, GetImgTheme, FluxTheme)
+
+_MAX_REGISTRIES = 32
+
+_REGISTRIES: "OrderedDict[str, ThemeRegistry]" = OrderedDict()
+_REGISTRIES_LOCK = threading.Lock()
+
+
+class ThemeRegistry:
+    def __init__(self, themes: List[ImageTheme]):
+        self._by_name: Dict[str, ImageTheme] = {}
+        self._by_model: Dict[str, ImageTheme] = {}
+        # The first theme with a name or model wins, so custom themes shadow premade ones.
+        for theme in themes:
+            self._by_name.setdefault(theme.name, theme)
+            if isinstance(theme, _MODEL_THEME_TYPES):
+                self._by_model.setdefault(theme.model, theme)
+        self._typed: Dict[Tuple[int, type], Tuple[ImageTheme, ImageTheme]] = {}
+        self._typed_lock = threading.Lock()
+
+    def by_name(self, name: str) -> Optional[ImageTheme]:
+        return self._by_name.get(name)
+
+    def by_model(self, model: str) -> Optional[ImageTheme]:
+        return self._by_model.get(model)
+
+    def typed(self, theme: ImageTheme, theme_type: Type[T]) -> T:
+        """`theme` as a `theme_type`, converting it only the first time."""
+        if type(theme) is theme_type:
+            return theme
+        key = (id(theme), theme_type)
+        with self._typed_lock:
+            if key not in self._typed:
+                # Keep `theme` alive alongside its conversion, so its id isn't reused.
+                self._typed[key] = (theme, theme_type.parse_obj(theme.dict()))
+            return self._typed[key][1]
+
+
+def _themes_key(themes: List[ImageTheme]) -> str:
+    # The type is part of a theme's content: it decides which conversions and lookups by model apply.
+    content = [(type(theme).__name__, theme.dict()) for theme in themes]
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def theme_registry(custom_themes: Optional[List[ImageTheme]]) -> ThemeRegistry:
+    """The registry of `custom_themes` followed by the premade themes."""
+    key = _themes_key(custom_themes or [])
+    with _REGISTRIES_LOCK:
+        registry = _REGISTRIES.get(key)
+        if registry is None:
+            registry = ThemeRegistry((custom_themes or []) + PREMADE_THEMES)
+            _REGISTRIES[key] = registry
+            while len(_REGISTRIES) > _MAX_REGISTRIES:
+                _REGISTRIES.popitem(last=False)
+        _REGISTRIES.move_to_end(key)
+        return registry
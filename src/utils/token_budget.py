@@ -0,0 +1,179 @@
+"""Chooses which chat history blocks go into a prompt when they don't all fit in the context window.
+
+Each candidate block belongs to a category (quest messages, quest summaries, ...). A block is worth its category's
+weight, decayed by how far it is from the most recent block of its category, and costs its token count. Blocks are
+then chosen by value per token until the budget is used up, instead of taking the newest blocks until one doesn't
+fit: a long block no longer pushes out several shorter, more recent ones. The newest quest message and the latest
+summary of each kind are always kept (if they fit at all), so a long latest narration isn't outbid by short old ones.
+
+How much each category is worth, and how quickly its value decays, is set per `generation_for` in `BUDGET_POLICIES`.
+
+USAGE:
+
+    selected = allocate_budget(candidates, budget=max_tokens, policy=budget_policy_for("Dice Roll"))
+"""
+from enum import Enum
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+from steamship import Block
+
+
+class BudgetCategory(str, Enum):
+    QUEST_MESSAGE = "quest_message"
+    QUEST_SUMMARY = "quest_summary"
+    HISTORY_SUMMARY = "history_summary"
+    """Summaries of older messages of the current quest; see utils.history_compaction."""
+
+
+class CategoryPolicy(BaseModel):
+    weight: float = 1.0
+    """The value of the most recent block of the category."""
+
+    half_life: Optional[float] = None
+    """After this many newer blocks of the same category, a block is worth half as much. None means no decay."""
+
+    per_token: bool = False
+    """Whether the weight is per token rather than per block, so that longer blocks are worth more."""
+
+
+class BudgetPolicy(BaseModel):
+    categories: Dict[BudgetCategory, CategoryPolicy] = Field(default_factory=dict)
+
+    def value(self, category: BudgetCategory, age: int, cost: int) -> float:
+        """The value of a block of `category` costing `cost` tokens, with `age` newer blocks of the same category."""
+        category_policy = self.categories.get(category)
+        if category_policy is None:
+            return 0.0
+        value = category_policy.weight
+        if category_policy.per_token:
+            value *= cost
+        if category_policy.half_life:
+            value *= 0.5 ** (age / category_policy.half_life)
+        return value
+
+
+class BudgetCandidate:
+    block: Block
+    category: BudgetCategory
+    cost: int
+    """Tokens the block takes up in the prompt, including the role overhead."""
+
+    value: float
+
+    def __init__(self, block: Block, category: BudgetCategory, cost: int):
+        self.block = block
+        self.category = category
+        self.cost = cost
+        self.value = 0.0
+
+
+DEFAULT_BUDGET_POLICY = BudgetPolicy(
+    categories={
+        BudgetCategory.QUEST_MESSAGE: CategoryPolicy(weight=1.0, half_life=12),
+        BudgetCategory.QUEST_SUMMARY: CategoryPolicy(weight=0.6, half_life=8),
+        BudgetCategory.HISTORY_SUMMARY: CategoryPolicy(weight=0.8, half_life=6),
+    }
+)
+
+# Policies by `generation_for`. Generations not listed use DEFAULT_BUDGET_POLICY. Every policy gives quest summaries
+# some weight: they are the only record of earlier quests the story has.
+BUDGET_POLICIES: Dict[str, BudgetPolicy] = {
+    # Summarizes the whole quest: the start matters as much as the end.
+    "Quest Summary": BudgetPolicy(
+        categories={
+            BudgetCategory.QUEST_MESSAGE: CategoryPolicy(weight=1.0, per_token=True),
+            BudgetCategory.QUEST_SUMMARY: CategoryPolicy(weight=0.5, per_token=True),
+            BudgetCategory.HISTORY_SUMMARY: CategoryPolicy(weight=1.0, per_token=True),
+        }
+    ),
+    # Short judgements about the player's last input: mostly the latest exchange matters.
+    "Dice Roll": BudgetPolicy(
+        categories={
+            BudgetCategory.QUEST_MESSAGE: CategoryPolicy(weight=1.0, half_life=4),
+            BudgetCategory.QUEST_SUMMARY: CategoryPolicy(weight=0.2, half_life=4),
+            BudgetCategory.HISTORY_SUMMARY: CategoryPolicy(weight=0.3, half_life=3),
+        }
+    ),
+    "Is a solution attempt": BudgetPolicy(
+        categories={
+            BudgetCategory.QUEST_MESSAGE: CategoryPolicy(weight=1.0, half_life=4),
+            BudgetCategory.QUEST_SUMMARY: CategoryPolicy(weight=0.2, half_life=4),
+            BudgetCategory.HISTORY_SUMMARY: CategoryPolicy(weight=0.3, half_life=3),
+        }
+    ),
+    "Image plan": BudgetPolicy(
+        categories={
+            BudgetCategory.QUEST_MESSAGE: CategoryPolicy(weight=1.0, half_life=3),
+            BudgetCategory.QUEST_SUMMARY: CategoryPolicy(weight=0.2, half_life=2),
+        }
+    ),
+    "Action Choices": BudgetPolicy(
+        categories={
+            BudgetCategory.QUEST_MESSAGE: CategoryPolicy(weight=1.0, half_life=6),
+            BudgetCategory.QUEST_SUMMARY: CategoryPolicy(weight=0.3, half_life=4),
+            BudgetCategory.HISTORY_SUMMARY: CategoryPolicy(weight=0.4, half_life=3),
+        }
+    ),
+}
+
+# In order of precedence, when the budget can't hold the newest block of each.
+_RESERVED_CATEGORIES = [
+    BudgetCategory.QUEST_MESSAGE,
+    BudgetCategory.HISTORY_SUMMARY,
+    BudgetCategory.QUEST_SUMMARY,
+]
+
+
+def budget_policy_for(generation_for: Optional[str]) -> BudgetPolicy:
+    return BUDGET_POLICIES.get(generation_for, DEFAULT_BUDGET_POLICY)
+
+
+def score_candidates(candidates: List[BudgetCandidate], policy: BudgetPolicy):
+    """Set the value of each candidate. Candidates must be in file order."""
+    ages: Dict[BudgetCategory, int] = {}
+    for candidate in reversed(candidates):
+        age = ages.get(candidate.category, 0)
+        candidate.value = policy.value(candidate.category, age, candidate.cost)
+        ages[candidate.category] = age + 1
+
+
+def allocate_budget(
+    candidates: List[BudgetCandidate], budget: int, policy: BudgetPolicy
+) -> List[BudgetCandidate]:
+    """The most valuable candidates whose costs add up to at most `budget`, in their original order."""
+    if budget <= 0:
+        return []
+    score_candidates(candidates, policy)
+    eligible = [
+        candidate
+        for candidate in candidates
+        if candidate.value > 0 and candidate.cost <= budget
+    ]
+    if sum(candidate.cost for candidate in eligible) <= budget:
+        return eligible
+
+    # The newest quest message and the latest summaries are what the next generation follows on from: they are
+    # reserved first, however long, and the rest of the budget goes by value per token.
+    remaining = budget
+    chosen = set()
+    for category in _RESERVED_CATEGORIES:
+        newest = next(
+            (i for i in range(len(eligible) - 1, -1, -1) if eligible[i].category == category),
+            None,
+        )
+        if newest is not None and eligible[newest].cost <= remaining:
+            chosen.add(newest)
+            remaining -= eligible[newest].cost
+
+    # A candidate that no longer fits is skipped, and smaller ones may still fill the rest. Ties go to the newer block.
+    by_density = sorted(
+        range(len(eligible)),
+        key=lambda i: (eligible[i].value / max(1, eligible[i].cost), i),
+        reverse=True,
+    )
+    for i in by_density:
+        if i not in chosen and eligible[i].cost <= remaining:
+            chosen.add(i)
+            remaining -= eligible[i].cost
+    return [candidate for i, candidate in enumerate(eligible) if i in chosen]
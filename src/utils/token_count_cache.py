@@ -0,0 +1,100 @@
+"""Token counts for chat history blocks, without a network call on the prompt-building path.
+
+Counts are computed locally by the tokenizer service (which caches them by model and text hash), so a block is never
+counted twice. Blocks that don't yet carry a TOKEN_COUNT tag for the model are tagged locally right away; the tags
+are written back to the engine on a background thread, off the critical path, so later requests (and other processes)
+can read them.
+
+TOKEN_COUNT tags record the model they were counted for in their string value. Tags counted for another model (or
+written before counts were model-aware) are ignored.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from steamship import Block, Tag
+from steamship.data.tags.tag_constants import TagValueKey
+
+from utils.tags import TagKindExtensions
+from utils.tokenizer_service import get_tokenizer
+
+PendingTokenCount = Tuple[Block, Optional[str]]
+
+# A single worker keeps the write-back ordered and bounds the load it puts on the engine.
+_WRITE_BACK_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-count-tags")
+
+
+def _token_count_tag(block: Block, model_name: Optional[str]) -> Optional[Tag]:
+    for tag in block.tags or []:
+        if (
+            tag.kind == TagKindExtensions.TOKEN_COUNT
+            and tag.value
+            and tag.value.get(TagValueKey.STRING_VALUE) == (model_name or None)
+        ):
+            return tag
+    return None
+
+
+def precount_blocks(blocks: List[Block], model_name: Optional[str] = None):
+    """Count all the blocks that aren't tagged yet in a single batch, warming the tokenizer cache."""
+    untagged = [
+        block.text
+        for block in blocks
+        if block.text and _token_count_tag(block, model_name) is None
+    ]
+    if untagged:
+        get_tokenizer(model_name).count_batch(untagged)
+
+
+def block_token_count(
+    block: Block, pending_tags: List[PendingTokenCount], model_name: Optional[str] = None
+) -> int:
+    """Return the token count of the block, from its TOKEN_COUNT tag if present or counted locally otherwise.
+
+    Blocks counted locally get a local TOKEN_COUNT tag and are added to `pending_tags`; pass that list to
+    `store_token_counts` once the prompt is built.
+    """
+    if not block.text:
+        return 0
+    if (tag := _token_count_tag(block, model_name)) and (
+        value := tag.value.get(TagValueKey.NUMBER_VALUE)
+    ):
+        return value
+
+    block_tokens = get_tokenizer(model_name).count(block.text)
+    if block.tags is None:
+        block.tags = []
+    block.tags.append(
+        Tag(
+            kind=TagKindExtensions.TOKEN_COUNT,
+            value={
+                TagValueKey.NUMBER_VALUE: block_tokens,
+                TagValueKey.STRING_VALUE: model_name or None,
+            },
+        )
+    )
+    if block.client and block.id:
+        pending_tags.append((block, model_name))
+    return block_tokens
+
+
+def _write_token_count_tags(pending_tags: List[PendingTokenCount]):
+    for block, model_name in pending_tags:
+        tag = _token_count_tag(block, model_name)
+        try:
+            Tag.create(
+                block.client,
+                file_id=block.file_id,
+                block_id=block.id,
+                kind=TagKindExtensions.TOKEN_COUNT,
+                value=tag.value,
+            )
+        except Exception as e:
+            # Only a cache: the count will simply be recomputed next time.
+            logging.warning(f"Unable to store token count for block {block.id}: {e}")
+
+
+def store_token_counts(pending_tags: List[PendingTokenCount]):
+    """Persist the TOKEN_COUNT tags collected by `block_token_count` in the background."""
+    if pending_tags:
+        _WRITE_BACK_EXECUTOR.submit(_write_token_count_tags, list(pending_tags))
@@ -0,0 +1,110 @@
+"""Local, model-aware token counting.
+
+Steamship's `tokens(block)` counts every text with GPT-3's `p50k_base` encoding, whichever model will read it. This
+module picks a tokenizer for the model the story is generated with, counts many texts at once, and remembers counts
+in an LRU keyed by (model, text hash) so a text is never encoded twice.
+
+Only tiktoken encodings are available locally. Models that use them (OpenAI, Llama 3, Mistral Nemo) are counted with
+`cl100k_base`. Models with 32k SentencePiece vocabularies (Llama 2, Mistral/Mixtral, Yi) produce more tokens for the
+same text, so their `cl100k_base` counts are scaled up by a conservative factor rather than risk overflowing the
+context window.
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import tiktoken
+
+# The encoding used when the model is unknown; matches steamship's `tokens(block)`.
+DEFAULT_ENCODING = "p50k_base"
+
+# The number of (model, text) counts remembered.
+_MAX_CACHED_COUNTS = 50_000
+
+_COUNTS: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+_COUNTS_LOCK = threading.Lock()
+
+_TOKENIZERS: Dict[str, "ModelTokenizer"] = {}
+
+# Lowercase fragments of model names whose tokenizers are close to cl100k_base.
+_CL100K_MODEL_MARKERS = ["gpt-", "llama-3", "l3-", "l3.1-", "nemo"]
+
+# Extra tokens a 32k SentencePiece vocabulary produces relative to cl100k_base, rounded up.
+_SENTENCEPIECE_RATIO = 1.2
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ModelTokenizer:
+    """Counts tokens as seen by one model."""
+
+    model_name: str
+    encoding_name: str
+    ratio: float
+
+    def __init__(self, model_name: str, encoding_name: str, ratio: float = 1.0):
+        self.model_name = model_name
+        self.encoding_name = encoding_name
+        self.ratio = ratio
+        self._encoding = None
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return self._encoding
+
+    def count(self, text: Optional[str]) -> int:
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts: List[Optional[str]]) -> List[int]:
+        """Count the tokens of each text, encoding all uncached texts in one batch."""
+        keys = [(self.model_name, _text_hash(text)) if text else None for text in texts]
+        counts: List[Optional[int]] = [0 if key is None else None for key in keys]
+
+        with _COUNTS_LOCK:
+            for i, key in enumerate(keys):
+                if key is not None and key in _COUNTS:
+                    _COUNTS.move_to_end(key)
+                    counts[i] = _COUNTS[key]
+
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            # Texts repeated within the batch are only encoded once.
+            unique_texts = list({texts[i]: None for i in missing})
+            encoded = self.encoding.encode_ordinary_batch(unique_texts)
+            by_text = {
+                text: math.ceil(len(tokens) * self.ratio)
+                for text, tokens in zip(unique_texts, encoded, strict=True)
+            }
+            with _COUNTS_LOCK:
+                for i in missing:
+                    counts[i] = by_text[texts[i]]
+                    _COUNTS[keys[i]] = counts[i]
+                while len(_COUNTS) > _MAX_CACHED_COUNTS:
+                    _COUNTS.popitem(last=False)
+
+        return counts
+
+
+def get_tokenizer(model_name: Optional[str]) -> ModelTokenizer:
+    """Return the tokenizer for the named model (or the default one if no model is given)."""
+    key = model_name or ""
+    tokenizer = _TOKENIZERS.get(key)
+    if tokenizer is None:
+        if not model_name:
+            tokenizer = ModelTokenizer("", DEFAULT_ENCODING)
+        elif any(marker in model_name.lower() for marker in _CL100K_MODEL_MARKERS):
+            tokenizer = ModelTokenizer(model_name, "cl100k_base")
+        else:
+            tokenizer = ModelTokenizer(model_name, "cl100k_base", _SENTENCEPIECE_RATIO)
+        _TOKENIZERS[key] = tokenizer
+    return tokenizer
+
+
+def count_tokens(text: Optional[str], model_name: Optional[str] = None) -> int:
+    return get_tokenizer(model_name).count(text)
@@ -0,0 +1,103 @@
+import threading
+import uuid
+from types import SimpleNamespace
+
+from steamship import Block, File
+from steamship.agents.schema import AgentContext
+
+import agents.quest_agent as quest_agent
+import utils.context_utils as context_utils
+from agents.quest_agent import QuestAgent
+from schema.characters import HumanCharacter
+from schema.game_state import GameState
+from schema.quest import Quest
+from schema.server_settings import ServerSettings
+
+
+class FakeClient:
+    class config:  # noqa: N801
+        workspace_handle = "test-workspace"
+
+
+class FakeChatHistory:
+    def __init__(self):
+        self.file = File(id=str(uuid.uuid4()), blocks=[])
+
+    def append_system_message(self, text, tags):
+        block = Block(id=str(uuid.uuid4()), text=text, tags=tags)
+        self.file.blocks.append(block)
+        return block
+
+
+def _setup(monkeypatch, is_attempt: str, speculative: bool = True):
+    context = AgentContext()
+    context.client = FakeClient()
+    context.chat_history = FakeChatHistory()
+    context.metadata[context_utils._SERVER_SETTINGS_KEY] = ServerSettings(
+        speculative_quest_evaluation=speculative
+    )
+    context.metadata[context_utils._STORY_GENERATOR_KEY] = object()
+    game_state = GameState(player=HumanCharacter(name="Ada"))
+    quest = Quest(name="q", user_problem_solutions=["climb the wall"])
+
+    caller = threading.current_thread()
+    both_started = threading.Barrier(2, timeout=5)
+    calls = []
+    emitted = []
+    context.emit_funcs = [lambda output, _metadata: emitted.extend(output)]
+
+    def is_solution_attempt(prompt, quest_name, context):
+        calls.append("attempt")
+        if speculative:
+            both_started.wait()
+        return Block(text=is_attempt)
+
+    def estimate():
+        calls.append("likelihood")
+        if speculative:
+            both_started.wait()
+        return Block(text="VERY LIKELY")
+
+    def likelihood_estimation(prompt, quest_name, context):
+        return estimate()
+
+    def prepare_likelihood_estimation(prompt, quest_name, context):
+        # Prepared on the caller's thread; the pool only gets the prepared run,
+        # never the context.
+        assert threading.current_thread() is caller
+        return SimpleNamespace(run=estimate)
+
+    monkeypatch.setattr(
+        quest_agent, "generate_is_solution_attempt", is_solution_attempt
+    )
+    monkeypatch.setattr(
+        quest_agent, "generate_likelihood_estimation", likelihood_estimation
+    )
+    monkeypatch.setattr(
+        quest_agent, "prepare_likelihood_estimation", prepare_likelihood_estimation
+    )
+    return QuestAgent.construct(), game_state, context, quest, calls, emitted
+
+
+def test_likelihood_is_estimated_alongside_attempt_check(monkeypatch):
+    agent, game_state, context, quest, calls, emitted = _setup(monkeypatch, "YES")
+    # The barrier only opens if both calls are in flight at once.
+    assert agent.evaluate_attempt(game_state, context, quest) in [True, False]
+    assert sorted(calls) == ["attempt", "likelihood"]
+    assert len(context.chat_history.file.blocks) == 1  # the dice roll
+    assert [block.text for block in emitted] == ["VERY LIKELY"]
+
+
+def test_non_attempt_discards_estimate(monkeypatch):
+    agent, game_state, context, quest, calls, emitted = _setup(monkeypatch, "NO")
+    assert agent.evaluate_attempt(game_state, context, quest) is None
+    assert context.chat_history.file.blocks == []
+    assert emitted == []
+
+
+def test_sequential_evaluation_skips_estimate_for_non_attempts(monkeypatch):
+    agent, game_state, context, quest, calls, emitted = _setup(
+        monkeypatch, "NO", speculative=False
+    )
+    assert agent.evaluate_attempt(game_state, context, quest) is None
+    assert calls == ["attempt"]
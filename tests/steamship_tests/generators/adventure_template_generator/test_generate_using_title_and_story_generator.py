@@ -5,7 +5,6 @@ from unittest.mock import patch
 import pytest
 from steamship import Steamship, Task
 from steamship.agents.schema import AgentContext
-from steamship.utils.kv_store import KeyValueStore
 from steamship_tests.utils.fake_agent_service import FakeAgentService
 
 from api import AdventureGameService
@@ -22,6 +21,7 @@ from utils.context_utils import (
     get_server_settings,
     save_server_settings,
 )
+from utils.field_kv_store import FieldKeyValueStore
 
 
 def inner_generate(
@@ -39,8 +39,7 @@ def no_cache_get_server_settings(
 ) -> "ServerSettings":  # noqa: F821
 
     # Get it from the KV Store
-    kv = KeyValueStore(context.client, _SERVER_SETTINGS_KEY)
-    value = kv.get(_SERVER_SETTINGS_KEY)
+    value = FieldKeyValueStore(context.client, _SERVER_SETTINGS_KEY).load()
 
     if value:
         logging.debug(f"Parsing Server Settings from stored value: {value}")
@@ -0,0 +1,50 @@
+import threading
+
+from steamship.agents.schema import AgentContext
+
+from generators.image_generator import ImageGenerator
+from schema.objects import Item
+
+
+class FakeTask:
+    def __init__(self, item: Item):
+        self.item = item
+
+    def wait(self):
+        pass
+
+
+class BarrierImageGenerator(ImageGenerator):
+    """Each request blocks until every item's request has started.
+
+    A sequential batch would time out.
+    """
+
+    def request_item_image_generation(self, item: Item, context: AgentContext):
+        BarrierImageGenerator.barrier.wait(5)
+        return FakeTask(item)
+
+    def request_profile_image_generation(self, context):
+        pass
+
+    def request_scene_image_generation(self, description, context, wait=True):
+        pass
+
+    def request_camp_image_generation(self, context):
+        pass
+
+    def request_adventure_image_generation(self, context):
+        pass
+
+    def request_character_image_generation(self, name, description, context):
+        pass
+
+
+def test_item_images_are_requested_together_and_kept_in_order():
+    items = [Item(name=f"item {i}") for i in range(5)]
+    BarrierImageGenerator.barrier = threading.Barrier(len(items))
+
+    tasks = BarrierImageGenerator().request_item_image_generations(
+        items, AgentContext()
+    )
+    assert [task.item for task in tasks] == items
@@ -0,0 +1,79 @@
+from steamship.agents.schema import AgentContext
+
+import utils.context_utils as context_utils
+from generators.model_registry import (
+    REASONING_MODELS,
+    STORY_MODELS,
+    ModelProvider,
+)
+from schema.game_state import GameState
+from schema.server_settings import ServerSettings
+from utils.context_utils import get_reasoning_model_name, get_story_model_name
+
+
+def test_providers_and_plugins():
+    gpt = STORY_MODELS["gpt-4o-mini"]
+    assert gpt.provider == ModelProvider.OPENAI
+    assert (gpt.plugin_handle, gpt.plugin_version) == ("gpt-4", "0.1.4")
+    assert gpt.api_key_field == "openai_api_key"
+
+    together = STORY_MODELS["Gryphe/MythoMax-L2-13b"]
+    assert (together.plugin_handle, together.plugin_version) == (
+        "together-ai-generator",
+        "1.0.2",
+    )
+
+    assert STORY_MODELS["llama_v2"].plugin_handle == "replicate-llm"
+    assert (
+        STORY_MODELS["Sao10K/L3-70B-Euryale-v2.1"].plugin_handle
+        == "deepinfra-generator"
+    )
+
+
+def test_story_and_reasoning_tables_differ():
+    assert "cognitivecomputations/dolphin-2.9.1-llama-3-70b" in STORY_MODELS
+    assert "cognitivecomputations/dolphin-2.9.1-llama-3-70b" not in REASONING_MODELS
+    assert "teknium/OpenHermes-2-Mistral-7B" in REASONING_MODELS
+    # Listed under both Together and DeepInfra for reasoning; Together serves it.
+    assert (
+        REASONING_MODELS["mistralai/Mixtral-8x7B-Instruct-v0.1"].provider
+        == ModelProvider.TOGETHER
+    )
+
+
+def test_story_config_sampling_params():
+    settings = ServerSettings()
+    openai_config = STORY_MODELS["gpt-4"].story_config(settings)
+    assert openai_config["model"] == "gpt-4"
+    assert "min_p" not in openai_config
+
+    deepinfra_config = STORY_MODELS["Sao10K/L3-70B-Euryale-v2.1"].story_config(settings)
+    assert deepinfra_config["min_p"] == settings.min_p
+    assert deepinfra_config["repetition_penalty"] == settings.repetition_penalty
+
+
+def test_reasoning_config_sends_the_resolved_model():
+    settings = ServerSettings(default_reasoning_model="gpt-4o-mini")
+    config = REASONING_MODELS["teknium/OpenHermes-2-Mistral-7B"].reasoning_config(
+        settings
+    )
+    assert config["model"] == "teknium/OpenHermes-2-Mistral-7B"
+
+
+class FakeClient:
+    class config:  # noqa: N801
+        workspace_handle = "test-workspace"
+
+
+def test_narration_preference_does_not_pick_the_reasoning_model():
+    context = AgentContext()
+    context.client = FakeClient()
+    context.metadata[context_utils._SERVER_SETTINGS_KEY] = ServerSettings(
+        default_story_model="gpt-4", default_reasoning_model="gpt-4o-mini"
+    )
+    game_state = GameState()
+    game_state.preferences.narration_model = "gpt-3.5-turbo"
+    context.metadata[context_utils._GAME_STATE_KEY] = game_state
+
+    assert get_story_model_name(context) == "gpt-3.5-turbo"
+    assert get_reasoning_model_name(context) == "gpt-4o-mini"
@@ -0,0 +1,152 @@
+import threading
+import uuid
+from types import SimpleNamespace
+
+from steamship import Block, File, Tag
+from steamship.agents.schema import AgentContext
+
+import utils.context_utils as context_utils
+from schema.characters import HumanCharacter
+from schema.game_state import GameState
+from schema.server_settings import ServerSettings
+from utils import generation_utils
+from utils.generation_utils import get_action_choices, prefetch_action_choices
+from utils.tags import QuestTag, TagKindExtensions
+
+
+class FakeClient:
+    class config:  # noqa: N801
+        workspace_handle = "test-workspace"
+
+
+class FakeChatHistory:
+    def __init__(self):
+        self.file = File(id=str(uuid.uuid4()), blocks=[])
+
+    def append_content(self) -> Block:
+        block = Block(
+            id=str(uuid.uuid4()),
+            text="The story goes on.",
+            index_in_file=len(self.file.blocks),
+            tags=[Tag(kind=TagKindExtensions.QUEST, name=QuestTag.QUEST_CONTENT)],
+        )
+        self.file.blocks.append(block)
+        return block
+
+
+def _block_worker() -> threading.Event:
+    """Keeps the prefetch worker busy until the returned event is set."""
+    release = threading.Event()
+    generation_utils._ACTION_CHOICES_EXECUTOR.submit(release.wait, 5)
+    return release
+
+
+def _setup(monkeypatch):
+    context = AgentContext()
+    context.chat_history = FakeChatHistory()
+    prepared_on = []
+    runs = []
+    generated = []
+
+    def prepare_token_trimmed_generation(context, **_kwargs):
+        prepared_on.append(threading.current_thread())
+        # Prepared for the story as it is now; the run must not look at the context.
+        label = context.chat_history.file.blocks[-1].id
+
+        def run():
+            runs.append(label)
+            return Block(text='{"choices": ["a", "b", "c"]}')
+
+        return SimpleNamespace(run=run)
+
+    def generate_action_choices(context):
+        generated.append(context)
+        return Block(text='{"choices": ["d", "e", "f"]}')
+
+    monkeypatch.setattr(generation_utils, "_action_choices_args", lambda _context: {})
+    monkeypatch.setattr(
+        generation_utils,
+        "prepare_token_trimmed_generation",
+        prepare_token_trimmed_generation,
+    )
+    monkeypatch.setattr(
+        generation_utils, "generate_action_choices", generate_action_choices
+    )
+    return context, prepared_on, runs, generated
+
+
+def test_prefetched_choices_are_joined(monkeypatch):
+    context, prepared_on, runs, generated = _setup(monkeypatch)
+    block = context.chat_history.append_content()
+    prefetch_action_choices(context, block)
+
+    assert get_action_choices(context).text == '{"choices": ["a", "b", "c"]}'
+    # The inputs were copied on the calling thread; only the run happened on the worker.
+    assert prepared_on == [threading.current_thread()]
+    assert runs == [block.id]
+    assert generated == []
+
+
+def test_stale_prefetch_is_not_run(monkeypatch):
+    context, prepared_on, runs, generated = _setup(monkeypatch)
+    release = _block_worker()
+    first = context.chat_history.append_content()
+    prefetch_action_choices(context, first)
+    second = context.chat_history.append_content()
+    prefetch_action_choices(context, second)
+    release.set()
+
+    assert get_action_choices(context).text == '{"choices": ["a", "b", "c"]}'
+    # The prefetch for the first block was skipped once the story had moved on.
+    assert runs == [second.id]
+    assert generated == []
+
+
+def test_prefetch_does_not_add_blocks_to_chat_history(monkeypatch):
+    context = AgentContext()
+    context.client = FakeClient()
+    context.chat_history = FakeChatHistory()
+    context.metadata[context_utils._SERVER_SETTINGS_KEY] = ServerSettings()
+    context.metadata[context_utils._GAME_STATE_KEY] = GameState(
+        player=HumanCharacter(name="Ada"), current_quest="quest-1"
+    )
+    block = context.chat_history.append_content()
+
+    class AllBlocksFilter:
+        def filter_chat_history(self, chat_history_file, filter_for=None):
+            return [block.index_in_file for block in chat_history_file.blocks]
+
+    generator = SimpleNamespace(
+        generate=lambda **kwargs: SimpleNamespace(
+            wait=lambda: None,
+            output=SimpleNamespace(
+                blocks=[Block(text='{"choices": []}', tags=kwargs["tags"])]
+            ),
+        )
+    )
+    clients = []
+
+    def create_file(client, blocks):
+        clients.append(client)
+        return File(id="scratch", blocks=blocks)
+
+    monkeypatch.setattr(
+        generation_utils, "_trimming_filter", lambda *_args: AllBlocksFilter()
+    )
+    monkeypatch.setattr(
+        generation_utils, "_generator_for", lambda _context, _for: generator
+    )
+    monkeypatch.setattr(File, "create", create_file)
+    monkeypatch.setattr(File, "delete", lambda _self: None)
+
+    release = _block_worker()
+    prefetch_action_choices(context, block)
+    # By the time the prefetch runs, the request that started it may be long gone.
+    client = context.client
+    context.client = None
+    context.metadata.clear()
+    release.set()
+
+    assert get_action_choices(context).text == '{"choices": []}'
+    assert clients == [client]
+    assert context.chat_history.file.blocks == [block]
@@ -0,0 +1,230 @@
+import uuid
+
+from steamship import Block, File, Tag
+
+from utils.chat_history_index import get_chat_history_index
+from utils.ChatHistoryFilter import (
+    ChatHistoryFilter,
+    LastInventoryFilter,
+    QuestNameFilter,
+    TagFilter,
+    UnionFilter,
+    compile_filter,
+)
+from utils.tags import (
+    CharacterTag,
+    QuestIdTag,
+    QuestTag,
+    StoryContextTag,
+    TagKindExtensions,
+)
+
+
+def _block(index: int, tags, block_id: str = None) -> Block:
+    return Block(
+        id=block_id or f"block-{index}",
+        text=f"text {index}",
+        index_in_file=index,
+        tags=tags,
+    )
+
+
+def _file() -> File:
+    return File(
+        id=str(uuid.uuid4()),
+        blocks=[
+            _block(
+                0,
+                [
+                    Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.NAME),
+                    Tag(
+                        kind=TagKindExtensions.STORY_CONTEXT, name=StoryContextTag.TONE
+                    ),
+                ],
+            ),
+            _block(1, [QuestIdTag("quest-1")]),
+            _block(
+                2, [Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.INVENTORY)]
+            ),
+            _block(3, [QuestIdTag("Quest-2")]),
+            _block(
+                4, [Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.INVENTORY)]
+            ),
+        ],
+    )
+
+
+def _indices(results):
+    return [(block.index_in_file, reason) for block, reason in results]
+
+
+def test_tag_filter_uses_index():
+    file = _file()
+    results = TagFilter(
+        tag_types=[
+            (TagKindExtensions.CHARACTER, CharacterTag.NAME),
+            (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
+        ]
+    ).filter_blocks(file)
+    assert _indices(results) == [
+        (0, "character name"),
+        (0, "story_context tone"),
+    ]
+
+
+def test_quest_and_inventory_filters():
+    file = _file()
+    assert _indices(QuestNameFilter("quest-2").filter_blocks(file)) == [
+        (3, "Quest ID match")
+    ]
+    assert _indices(LastInventoryFilter().filter_blocks(file)) == [
+        (4, "Last inventory")
+    ]
+
+
+def test_index_updates_on_append():
+    file = _file()
+    union = UnionFilter([QuestNameFilter("quest-1"), LastInventoryFilter()])
+    assert [b.index_in_file for b, _ in union.filter_blocks(file)] == [1, 4]
+
+    file.blocks.append(_block(5, [QuestIdTag("quest-1")]))
+    file.blocks.append(
+        _block(6, [Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.INVENTORY)])
+    )
+    assert [b.index_in_file for b, _ in union.filter_blocks(file)] == [1, 5, 6]
+    assert len(get_chat_history_index(file)) == 7
+
+
+def test_index_rebuilds_when_history_rewritten():
+    file = _file()
+    assert _indices(QuestNameFilter("quest-2").filter_blocks(file)) == [
+        (3, "Quest ID match")
+    ]
+
+    # Simulate a deleted block followed by a new one, as after `delete_messages` and a
+    # fresh append.
+    file.blocks = file.blocks[:3] + [
+        _block(3, [Tag(kind=QuestTag.QUEST_SUMMARY, name="x")], block_id="new-3")
+    ]
+    file.blocks.append(_block(4, [QuestIdTag("quest-2")], block_id="new-4"))
+    assert _indices(QuestNameFilter("quest-2").filter_blocks(file)) == [
+        (4, "Quest ID match")
+    ]
+
+
+def test_append_only_filter_without_overrides_falls_back_to_filter_blocks():
+    class InventoryFilter(ChatHistoryFilter):
+        def is_append_only(self) -> bool:
+            return True
+
+        def filter_blocks(self, chat_history_file):
+            return [
+                (block, "inventory")
+                for block in chat_history_file.blocks
+                if block.tags and block.tags[0].name == CharacterTag.INVENTORY
+            ]
+
+    file = _file()
+    union = UnionFilter([InventoryFilter(), QuestNameFilter("quest-1")])
+    assert _indices(union.filter_blocks(file)) == [
+        (1, "Quest ID match"),
+        (2, "inventory"),
+        (4, "inventory"),
+    ]
+
+
+def test_union_results_are_memoized_and_extended():
+    file = _file()
+    union = UnionFilter(
+        [
+            TagFilter(tag_types=[(TagKindExtensions.CHARACTER, CharacterTag.NAME)]),
+            QuestNameFilter("quest-1"),
+            LastInventoryFilter(),
+        ]
+    )
+    assert _indices(union.filter_blocks(file)) == [
+        (0, "character name"),
+        (1, "Quest ID match"),
+        (4, "Last inventory"),
+    ]
+
+    scanned_from = []
+    quest_filter = union.filters[1]
+    original = quest_filter.positions_since
+
+    def spy(chat_history_file, start):
+        scanned_from.append(start)
+        return original(chat_history_file, start)
+
+    quest_filter.positions_since = spy
+
+    # Nothing new: served from the memo.
+    union.filter_blocks(file)
+    assert scanned_from == []
+
+    file.blocks.append(_block(5, [QuestIdTag("quest-1")]))
+    assert _indices(union.filter_blocks(file)) == [
+        (0, "character name"),
+        (1, "Quest ID match"),
+        (4, "Last inventory"),
+        (5, "Quest ID match"),
+    ]
+    assert scanned_from == [5]
+
+    # Results resolve to the file's current block objects.
+    file.blocks = [block.copy() for block in file.blocks]
+    assert union.filter_blocks(file)[0][0] is file.blocks[0]
+
+
+def test_compiled_filter_matches_union():
+    file = _file()
+    file.blocks.append(
+        _block(
+            5,
+            [
+                QuestIdTag("quest-1"),
+                Tag(kind=TagKindExtensions.STORY_CONTEXT, name=StoryContextTag.TONE),
+                Tag(kind=TagKindExtensions.CHARACTER, name=CharacterTag.NAME),
+            ],
+        )
+    )
+
+    def tree(quest_name):
+        return UnionFilter(
+            [
+                TagFilter(
+                    tag_types=[
+                        (TagKindExtensions.CHARACTER, CharacterTag.NAME),
+                        (TagKindExtensions.STORY_CONTEXT, StoryContextTag.TONE),
+                    ]
+                ),
+                UnionFilter(
+                    [
+                        QuestNameFilter(quest_name),
+                        TagFilter(
+                            tag_types=[(TagKindExtensions.CHARACTER, CharacterTag.NAME)]
+                        ),
+                    ]
+                ),
+                LastInventoryFilter(),
+            ]
+        )
+
+    compiled = compile_filter(tree(None))
+    expected = _indices(tree("quest-1").filter_blocks(file))
+    assert expected[-1] == (
+        5,
+        "story_context tone && character name && Quest ID match && character name",
+    )
+    assert _indices(compiled.for_quest("QUEST-1").filter_blocks(file)) == expected
+    assert _indices(compiled.for_quest("quest-2").filter_blocks(file)) == _indices(
+        tree("quest-2").filter_blocks(file)
+    )
+    # Unbound quest filters select nothing.
+    assert (1, "Quest ID match") not in _indices(compiled.filter_blocks(file))
+
+    file.blocks.append(_block(6, [QuestIdTag("quest-1")]))
+    assert _indices(compiled.for_quest("quest-1").filter_blocks(file))[-1] == (
+        6,
+        "Quest ID match",
+    )
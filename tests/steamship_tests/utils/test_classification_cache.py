@@ -0,0 +1,53 @@
+from steamship import Block
+
+from utils import classification_cache
+from utils.classification_cache import (
+    cache_classification,
+    classification_key,
+    get_cached_classification,
+)
+
+
+def _key(
+    prompt="Is this an attempt?",
+    context_text="The gate is locked.",
+    params=None,
+    block_id="b1",
+):
+    return classification_key(
+        "some-model",
+        params or {"temperature": 0.4},
+        prompt,
+        {"stop": ["\n"]},
+        [Block(id=block_id, text=context_text)],
+    )
+
+
+def test_key_covers_prompt_params_and_context():
+    assert _key() == _key()
+    assert _key() != _key(prompt="How likely is this?")
+    assert _key() != _key(context_text="The gate is open.")
+    assert _key() != _key(params={"temperature": 0.9})
+    # Block ids don't reach the model, so they aren't part of the key.
+    assert _key() == _key(block_id="b2")
+
+
+def test_cached_results_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(classification_cache.time, "monotonic", lambda: now[0])
+    key = _key(prompt="expiring")
+    assert get_cached_classification(key) is None
+    cache_classification(key, "YES")
+    assert get_cached_classification(key) == "YES"
+
+    now[0] += classification_cache.CLASSIFICATION_TTL_S
+    assert get_cached_classification(key) is None
+
+
+def test_cache_is_size_bounded(monkeypatch):
+    monkeypatch.setattr(classification_cache, "_MAX_CACHED_CLASSIFICATIONS", 2)
+    keys = [_key(prompt=f"bounded {i}") for i in range(3)]
+    for key in keys:
+        cache_classification(key, "NO")
+    assert get_cached_classification(keys[0]) is None
+    assert get_cached_classification(keys[2]) == "NO"
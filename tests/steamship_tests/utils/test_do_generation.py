@@ -0,0 +1,150 @@
+import uuid
+from types import SimpleNamespace
+
+from steamship import Block, File, Tag
+from steamship.agents.schema import AgentContext
+from steamship.data.tags.tag_constants import RoleTag
+
+import utils.context_utils as context_utils
+from schema.game_state import GameState
+from schema.server_settings import ServerSettings
+from utils import generation_utils
+from utils.agent_service import build_context_appending_emit_func
+from utils.generation_utils import do_generation, prepare_scratch_generation
+
+
+class FakeClient:
+    class config:  # noqa: N801
+        workspace_handle = "test-workspace"
+
+
+class FakeChatHistory:
+    def __init__(self):
+        self.file = File(
+            id=str(uuid.uuid4()),
+            blocks=[
+                Block(id="story", text="The gate is locked.", index_in_file=0, tags=[]),
+            ],
+        )
+
+    def append_system_message(self, text, tags):
+        block = Block(
+            id=str(uuid.uuid4()),
+            text=text,
+            index_in_file=len(self.file.blocks),
+            tags=tags,
+        )
+        self.file.blocks.append(block)
+        return block
+
+    def append_assistant_message(self, text, tags, mime_type=None):
+        return self.append_system_message(text, tags)
+
+
+class FakeGenerator:
+    def __init__(self, text="LIKELY"):
+        self.text = text
+        self.requests = []
+
+    def generate(self, **kwargs):
+        self.requests.append(kwargs)
+        return SimpleNamespace(
+            wait=lambda: None,
+            output=SimpleNamespace(blocks=[Block(text=self.text, tags=kwargs["tags"])]),
+        )
+
+
+class AllBlocksFilter:
+    def filter_chat_history(self, chat_history_file, filter_for=None):
+        return [block.index_in_file for block in chat_history_file.blocks]
+
+
+class StoryFilter:
+    def filter_chat_history(self, chat_history_file, filter_for=None):
+        return [0]
+
+
+def _setup(monkeypatch):
+    context = AgentContext()
+    context.client = FakeClient()
+    context.chat_history = FakeChatHistory()
+    context.metadata[context_utils._SERVER_SETTINGS_KEY] = ServerSettings()
+    context.metadata[context_utils._GAME_STATE_KEY] = GameState()
+    emitted = []
+    context.emit_funcs = [
+        build_context_appending_emit_func(context),
+        lambda output, _metadata: emitted.extend(output),
+    ]
+    generator = FakeGenerator()
+    monkeypatch.setattr(
+        generation_utils, "_generator_for", lambda _context, _for: generator
+    )
+    return context, generator, emitted
+
+
+def test_scratch_generation_leaves_no_trace(monkeypatch):
+    context, generator, emitted = _setup(monkeypatch)
+    chat_history = context.chat_history
+    scratch_files = []
+    deleted = []
+
+    def create_file(_client, blocks):
+        scratch_files.append(File(id="scratch", blocks=blocks))
+        return scratch_files[-1]
+
+    monkeypatch.setattr(File, "create", create_file)
+    monkeypatch.setattr(File, "delete", lambda self: deleted.append(self.id))
+
+    generation = prepare_scratch_generation(
+        context,
+        "How likely is this?",
+        prompt_tags=[Tag(kind="quest", name="likelihood_evaluation")],
+        output_tags=[],
+        filter=AllBlocksFilter(),
+        generation_for="Dice Roll",
+    )
+    # Everything is copied up front: running it doesn't look at the context again.
+    context.chat_history = None
+    block = generation.run()
+    context.chat_history = chat_history
+
+    assert block.text == "LIKELY"
+    assert [block.id for block in context.chat_history.file.blocks] == ["story"]
+    assert emitted == []
+    # The history and the prompt went into the scratch file, which is gone again.
+    assert [block.text for block in scratch_files[0].blocks] == [
+        "The gate is locked.",
+        "How likely is this?",
+    ]
+    assert scratch_files[0].blocks[-1].chat_role == RoleTag.SYSTEM
+    assert generator.requests[0]["input_file_id"] == "scratch"
+    assert generator.requests[0]["output_file_id"] is None
+    assert deleted == ["scratch"]
+
+
+def test_cached_classification_is_not_appended_to_chat_history(monkeypatch):
+    context, generator, emitted = _setup(monkeypatch)
+
+    def likelihood():
+        return do_generation(
+            context,
+            "Is this cached?",
+            None,
+            prompt_tags=[],
+            output_tags=[],
+            filter=StoryFilter(),
+            generation_for="Dice Roll",
+            new_file=True,
+            streaming=False,
+        )
+
+    assert likelihood().text == "LIKELY"
+    blocks = list(context.chat_history.file.blocks)
+    # The prompt block is appended again, but the cached answer is only emitted, just
+    # like a generated one.
+    assert likelihood().text == "LIKELY"
+    assert len(generator.requests) == 1
+    assert [block.text for block in emitted] == ["LIKELY", "LIKELY"]
+    assert [block.text for block in context.chat_history.file.blocks] == [
+        block.text for block in blocks
+    ] + ["Is this cached?"]
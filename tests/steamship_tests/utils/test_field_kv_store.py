@@ -0,0 +1,133 @@
+from types import SimpleNamespace
+
+import pytest
+from steamship import File, Tag
+from steamship.utils.kv_store import KV_STORE_MARKER
+
+from schema.game_state import GameState
+from utils.field_kv_store import FieldKeyValueStore
+
+_STORE = "kv-store-user-settings"
+
+
+def _store_with(tags) -> FieldKeyValueStore:
+    store = FieldKeyValueStore(client=None, document_key="user-settings")
+    store._refresh = lambda: setattr(store, "_file", File(id="kv", tags=tags))
+    return store
+
+
+def test_changed_fields_against_loaded_document():
+    game_state = GameState()
+    document = game_state.dict()
+    store = _store_with(
+        [
+            Tag(kind=_STORE, name=f"field:{field}", value={"value": value})
+            for field, value in document.items()
+        ]
+    )
+    assert store.load() == document
+    assert store.changed_fields(document) == []
+
+    game_state.await_ask_key = "some-key"
+    assert store.changed_fields(game_state.dict()) == ["await_ask_key"]
+
+
+def test_legacy_document_is_loaded_and_fully_rewritten():
+    document = GameState(await_ask_key="legacy").dict()
+    store = _store_with([Tag(kind=_STORE, name="user-settings", value=document)])
+    assert store.load() == document
+    # Nothing has been stored per-field yet, so every field needs writing.
+    assert store.changed_fields(document) == list(document.keys())
+
+
+def test_empty_store():
+    store = FieldKeyValueStore(client=None, document_key="user-settings")
+    store._refresh = lambda: setattr(store, "_file", None)
+    assert store.load() is None
+
+
+def test_newest_field_tag_and_store_file_win(monkeypatch):
+    store = _store_with(
+        [
+            Tag(
+                kind=_STORE,
+                name="field:await_ask_key",
+                value={"value": "new", "revision": 3},
+            ),
+            Tag(
+                kind=_STORE,
+                name="field:await_ask_key",
+                value={"value": "old", "revision": 2},
+            ),
+        ]
+    )
+    assert store.load() == {"await_ask_key": "new"}
+
+    old = File(
+        id="b", tags=[Tag(kind=_STORE, name=KV_STORE_MARKER, value={"revision": 1})]
+    )
+    new = File(
+        id="a", tags=[Tag(kind=_STORE, name=KV_STORE_MARKER, value={"revision": 2})]
+    )
+    monkeypatch.setattr(
+        File, "query", lambda _client, _query: SimpleNamespace(files=[new, old])
+    )
+    store = FieldKeyValueStore(client=None, document_key="user-settings")
+    store._refresh()
+    assert store._file is new
+    assert store._stale_files == [old]
+
+
+def test_only_changed_fields_are_written(monkeypatch):
+    document = {"a": 1, "b": 2, "c": 3}
+    store = _store_with(
+        [
+            Tag(kind=_STORE, name=f"field:{field}", value={"value": value})
+            for field, value in document.items()
+        ]
+    )
+    store.load()
+    events = []
+
+    def create_tag(_client, **kwargs):
+        events.append(("create", kwargs["name"]))
+        return Tag(kind=kwargs["kind"], name=kwargs["name"], value=kwargs["value"])
+
+    monkeypatch.setattr(Tag, "create", create_tag)
+    monkeypatch.setattr(
+        Tag, "delete", lambda self: events.append(("delete", self.name))
+    )
+    monkeypatch.setattr(
+        File, "create", lambda *_args, **_kwargs: pytest.fail("document rewritten")
+    )
+
+    assert store.save({"a": 10, "b": 20, "c": 3}) == ["a", "b"]
+    # Every new value is stored before any superseded tag is deleted.
+    assert events == [
+        ("create", "field:a"),
+        ("create", "field:b"),
+        ("delete", "field:a"),
+        ("delete", "field:b"),
+    ]
+    assert store._field_tags["a"].value == {"value": 10, "revision": 1}
+
+
+def test_removed_fields_rewrite_the_document(monkeypatch):
+    store = _store_with(
+        [
+            Tag(kind=_STORE, name=f"field:{field}", value={"value": value})
+            for field, value in {"a": 1, "b": 2}.items()
+        ]
+    )
+    store.load()
+    created = []
+
+    def create_file(_client, **kwargs):
+        created.append(kwargs["tags"])
+        return File(id="new", tags=kwargs["tags"])
+
+    monkeypatch.setattr(File, "create", create_file)
+    monkeypatch.setattr(File, "delete", lambda _self: None)
+
+    assert store.save({"a": 1}) == []
+    assert len(created) == 1
@@ -0,0 +1,75 @@
+from typing import Dict, List
+
+from steamship.agents.schema import AgentContext
+
+import utils.context_utils as context_utils
+from schema.game_state import GameState
+from utils.context_utils import (
+    deferred_game_state_saves,
+    flush_game_state,
+    get_game_state,
+    save_game_state,
+)
+
+
+class RecordingKeyValueStore:
+    writes: List[Dict] = []
+
+    def __init__(self, client, document_key):
+        pass
+
+    def save(self, document: Dict):
+        RecordingKeyValueStore.writes.append(document)
+
+
+class FakeClient:
+    class config:  # noqa: N801
+        workspace_handle = "test-workspace"
+
+
+def _context(monkeypatch) -> AgentContext:
+    RecordingKeyValueStore.writes = []
+    monkeypatch.setattr(context_utils, "FieldKeyValueStore", RecordingKeyValueStore)
+    context = AgentContext()
+    context.client = FakeClient()
+    context.metadata[context_utils._GAME_STATE_KEY] = GameState()
+    return context
+
+
+def test_save_writes_immediately_by_default(monkeypatch):
+    context = _context(monkeypatch)
+    game_state = get_game_state(context)
+    save_game_state(game_state, context)
+    save_game_state(game_state, context)
+    assert len(RecordingKeyValueStore.writes) == 2
+
+
+def test_deferred_saves_are_coalesced(monkeypatch):
+    context = _context(monkeypatch)
+    with deferred_game_state_saves(context):
+        game_state = get_game_state(context)
+        game_state.await_ask_key = "first"
+        save_game_state(game_state, context)
+        game_state.await_ask_key = "second"
+        save_game_state(game_state, context)
+        with deferred_game_state_saves(context):
+            save_game_state(game_state, context)
+        assert RecordingKeyValueStore.writes == []
+
+    assert len(RecordingKeyValueStore.writes) == 1
+    assert RecordingKeyValueStore.writes[0]["await_ask_key"] == "second"
+
+
+def test_explicit_flush_and_clean_exit(monkeypatch):
+    context = _context(monkeypatch)
+    with deferred_game_state_saves(context):
+        # Nothing dirty, nothing written.
+        flush_game_state(context)
+        assert RecordingKeyValueStore.writes == []
+
+        save_game_state(get_game_state(context), context)
+        flush_game_state(context)
+        assert len(RecordingKeyValueStore.writes) == 1
+
+    # Already flushed; exiting the block does not write again.
+    assert len(RecordingKeyValueStore.writes) == 1
@@ -0,0 +1,15 @@
+import threading
+
+from utils.generation_utils import submit_generation
+
+
+def test_generations_run_concurrently():
+    both_started = threading.Barrier(2, timeout=5)
+
+    def generate(text):
+        both_started.wait()
+        return text
+
+    first = submit_generation(generate, "a")
+    second = submit_generation(generate, "b")
+    assert [first.result(), second.result()] == ["a", "b"]
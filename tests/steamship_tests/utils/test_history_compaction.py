@@ -0,0 +1,184 @@
+import uuid
+
+from steamship import Block, File, Tag
+from steamship.data.tags.tag_constants import ChatTag, RoleTag, TagKind, TagValueKey
+
+from utils import history_compaction
+from utils.chat_history_index import get_chat_history_index
+from utils.ChatHistoryFilter import QuestNameFilter
+from utils.history_compaction import (
+    compact_history,
+    schedule_history_compaction,
+    story_position,
+)
+from utils.moderation_utils import is_block_excluded
+from utils.tags import HistorySummaryTag, QuestIdTag, QuestTag
+
+
+def _message(index: int, role: RoleTag = RoleTag.USER) -> Block:
+    return Block(
+        id=f"block-{index}",
+        text=f"message {index}",
+        index_in_file=index,
+        tags=[
+            Tag(
+                kind=TagKind.CHAT,
+                name=ChatTag.ROLE,
+                value={TagValueKey.STRING_VALUE: role},
+            ),
+            QuestIdTag(QuestTag.CHAT_QUEST),
+        ],
+    )
+
+
+class FakeBlocks:
+    """Stands in for Block.create, appending the summaries to the file."""
+
+    def __init__(self, file: File):
+        self.file = file
+
+    def create(self, client, file_id, text=None, tags=None, **kwargs):
+        block = Block(
+            id=str(uuid.uuid4()),
+            file_id=file_id,
+            text=text,
+            index_in_file=len(self.file.blocks),
+            tags=tags,
+        )
+        self.file.blocks.append(block)
+        return block
+
+
+def _compact(file, monkeypatch, prompts):
+    monkeypatch.setattr(
+        history_compaction.Block, "create", staticmethod(FakeBlocks(file).create)
+    )
+
+    def summarize(prompt):
+        prompts.append(prompt)
+        return f"summary {len(prompts)}"
+
+    return compact_history(None, file, QuestTag.CHAT_QUEST, summarize)
+
+
+def test_old_messages_are_folded(monkeypatch):
+    count = (
+        history_compaction.KEEP_RECENT_MESSAGES
+        + history_compaction.MESSAGES_PER_SUMMARY
+        + 3
+    )
+    file = File(id="f", blocks=[_message(i) for i in range(count)])
+    prompts = []
+
+    created = _compact(file, monkeypatch, prompts)
+    assert len(created) == 1
+    summary_tag = HistorySummaryTag.get(created[0].tags).value
+    assert summary_tag == {"level": 1, "first": 0, "last": 11}
+    assert story_position(created[0]) == 11
+    assert "USER: message 0" in prompts[0]
+
+    excluded = [
+        block.index_in_file for block in file.blocks if is_block_excluded(block)
+    ]
+    assert excluded == list(range(12))
+
+    # Nothing more to fold until more messages arrive.
+    assert _compact(file, monkeypatch, prompts) == []
+
+
+def test_summaries_roll_up_a_level(monkeypatch):
+    per_summary = history_compaction.MESSAGES_PER_SUMMARY
+    per_level = history_compaction.SUMMARIES_PER_SUMMARY
+    count = history_compaction.KEEP_RECENT_MESSAGES + per_summary * per_level * 2
+    file = File(id="f", blocks=[_message(i) for i in range(count)])
+    prompts = []
+
+    created = _compact(file, monkeypatch, prompts)
+    levels = [HistorySummaryTag.get(block.tags).value["level"] for block in created]
+    assert levels == [1] * (per_level * 2) + [2]
+    assert HistorySummaryTag.get(created[-1].tags).value == {
+        "level": 2,
+        "first": 0,
+        "last": per_summary * per_level - 1,
+    }
+    assert all(is_block_excluded(block) for block in created[:per_level])
+    assert not any(is_block_excluded(block) for block in created[per_level:])
+
+
+def test_interrupted_compaction_is_repaired(monkeypatch):
+    count = (
+        history_compaction.KEEP_RECENT_MESSAGES
+        + history_compaction.MESSAGES_PER_SUMMARY
+    )
+    file = File(id="f", blocks=[_message(i) for i in range(count)])
+    # A summary was written, but its sources were never excluded.
+    file.blocks.append(
+        Block(
+            id="summary",
+            text="summary",
+            index_in_file=count,
+            tags=[QuestIdTag(QuestTag.CHAT_QUEST), HistorySummaryTag(1, 0, 11)],
+        )
+    )
+    prompts = []
+
+    assert _compact(file, monkeypatch, prompts) == []
+    assert prompts == []
+    excluded = [
+        block.index_in_file for block in file.blocks if is_block_excluded(block)
+    ]
+    assert excluded == list(range(12))
+
+
+class FakeExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+
+
+def test_scheduling_skips_the_compacted_history(monkeypatch):
+    count = (
+        history_compaction.KEEP_RECENT_MESSAGES
+        + 2 * history_compaction.MESSAGES_PER_SUMMARY
+    )
+    file = File(id=str(uuid.uuid4()), blocks=[_message(i) for i in range(count)])
+    file.blocks.append(
+        Block(
+            id="summary",
+            text="summary",
+            index_in_file=count,
+            tags=[QuestIdTag(QuestTag.CHAT_QUEST), HistorySummaryTag(1, 0, 11)],
+        )
+    )
+    quest_filter = QuestNameFilter(QuestTag.CHAT_QUEST)
+    assert len(quest_filter.filter_blocks(file)) == count + 1
+
+    executor = FakeExecutor()
+    monkeypatch.setattr(history_compaction, "_COMPACTION_EXECUTOR", executor)
+    monkeypatch.setattr(history_compaction, "_SCHEDULED_FILES", set())
+    checked = []
+    is_compactable_message = history_compaction._is_compactable_message
+
+    def record(block, quest_name):
+        checked.append(block.index_in_file)
+        return is_compactable_message(block, quest_name)
+
+    monkeypatch.setattr(history_compaction, "_is_compactable_message", record)
+
+    schedule_history_compaction(None, file, QuestTag.CHAT_QUEST, None)
+    # The summarized messages are gone from the index and from the memoized filter
+    # results.
+    index = get_chat_history_index(file)
+    assert index.positions_for_quest(QuestTag.CHAT_QUEST)[0] == 12
+    assert [
+        block.index_in_file for block, _ in quest_filter.filter_blocks(file)
+    ] == list(range(12, count + 1))
+    assert len(executor.submitted) == 1
+
+    # Later turns only look at the messages since the last compaction.
+    checked.clear()
+    schedule_history_compaction(None, file, QuestTag.CHAT_QUEST, None)
+    assert min(checked) == 12
+    assert len(executor.submitted) == 1
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+from steamship import TaskState
+from steamship.agents.schema import AgentContext
+
+from generators import image_generator
+from generators.image_generator import generate_image
+from schema.server_settings import ServerSettings
+from utils import image_cache
+from utils.image_cache import cache_image, get_cached_image, image_key, image_seed
+
+
+def test_seed_comes_from_theme_or_prompt():
+    assert image_seed("a red door", 42) == 42
+    assert image_seed("a red door", -1) == image_seed("a red door")
+    assert image_seed("a red door") != image_seed("a blue door")
+    assert 0 <= image_seed("a red door") < 2**31
+
+
+def test_cached_images_expire_and_are_bounded(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(image_cache.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(image_cache, "_MAX_CACHED_IMAGES", 2)
+    keys = [image_key("fal", f"prompt {i}", {"seed": 1}) for i in range(3)]
+    for key in keys:
+        cache_image(key, f"https://images/{key}", "image/png")
+    assert get_cached_image(keys[0]) is None
+    assert get_cached_image(keys[2]) == (f"https://images/{keys[2]}", "image/png")
+
+    now[0] += image_cache.IMAGE_CACHE_TTL_S
+    assert get_cached_image(keys[2]) is None
+
+
+class FakePlugin:
+    def __init__(self):
+        self.requests = []
+
+    def generate(self, text, options, **kwargs):
+        self.requests.append(options)
+        block = SimpleNamespace(
+            raw_data_url=f"https://images/{len(self.requests)}", mime_type="image/png"
+        )
+        return SimpleNamespace(
+            state=TaskState.succeeded,
+            output=SimpleNamespace(blocks=[block]),
+            wait=lambda retry_delay_s: None,
+        )
+
+
+def _generate(monkeypatch, deterministic_image_seeds):
+    monkeypatch.setattr(
+        image_generator,
+        "get_server_settings",
+        lambda context: ServerSettings(
+            deterministic_image_seeds=deterministic_image_seeds
+        ),
+    )
+    monkeypatch.setattr(
+        image_generator, "_cached_image_task", lambda context, cached, tags: cached
+    )
+    context = AgentContext()
+    context.chat_history = SimpleNamespace(file=SimpleNamespace(id="chat"))
+    plugin = FakePlugin()
+    options = {"model_name": "some-model", "image_size": "square"}
+    results = [
+        generate_image(context, plugin, "fal", "an old mill at dusk", options)
+        for _ in range(2)
+    ]
+    return plugin, results
+
+
+def test_seeded_repeat_request_is_served_from_cache(monkeypatch):
+    plugin, results = _generate(monkeypatch, True)
+    assert len(plugin.requests) == 1
+    assert plugin.requests[0]["seed"] == image_seed("an old mill at dusk")
+    assert results[1] == ("https://images/1", "image/png")
+
+
+def test_unseeded_requests_are_not_cached(monkeypatch):
+    plugin, _ = _generate(monkeypatch, False)
+    assert len(plugin.requests) == 2
+    assert "seed" not in plugin.requests[0]
@@ -0,0 +1,24 @@
+from utils.generation_utils import parse_image_plan
+
+
+def test_requested_plan_is_parsed():
+    text = (
+        '{\n"ImageRequested": true,\n'
+        '"ImageDescriptionKeywords": ["red hair", "Posture: sitting"]\n}\n```'
+    )
+    assert parse_image_plan(text) == (True, ["red hair", "Posture: sitting"])
+
+
+def test_output_stopped_at_false_is_no_request():
+    # Generation stops on the `"ImageRequested": false` stop sequence, leaving only the
+    # opening brace.
+    assert parse_image_plan("{\n") == (False, [])
+    assert parse_image_plan('{"ImageRequested": false}') == (False, [])
+
+
+def test_truncated_keywords_are_salvaged():
+    text = (
+        '{"ImageRequested": true, '
+        '"ImageDescriptionKeywords": ["red hair", "a \\"quoted\\" hat", "rainy str'
+    )
+    assert parse_image_plan(text) == (True, ["red hair", 'a "quoted" hat'])
@@ -0,0 +1,165 @@
+import threading
+import time
+
+from utils import image_scheduler
+from utils.image_scheduler import ImagePriority, ProviderLimits, schedule_image_job
+
+
+class FakeTask:
+    def __init__(self, name):
+        self.name = name
+        self.done = threading.Event()
+
+    def wait(self, retry_delay_s=1):
+        self.done.wait(5)
+
+
+def _limit(monkeypatch, provider, **limits):
+    monkeypatch.setitem(
+        image_scheduler.PROVIDER_LIMITS, provider, ProviderLimits(**limits)
+    )
+
+
+def test_duplicate_jobs_in_flight_are_coalesced(monkeypatch):
+    _limit(monkeypatch, "coalescing", max_concurrent=2, rate_per_s=100, burst=2)
+    submitted = []
+
+    def submit():
+        submitted.append(FakeTask("image"))
+        return submitted[-1]
+
+    first = schedule_image_job(
+        "coalescing", ImagePriority.ITEM, "same", submit, wait=False
+    )
+    second = schedule_image_job(
+        "coalescing", ImagePriority.ITEM, "same", submit, wait=False
+    )
+    assert second.done is first.done
+    assert len(submitted) == 1
+
+    first.done.set()
+    time.sleep(0.2)
+    schedule_image_job(
+        "coalescing", ImagePriority.ITEM, "same", submit, wait=False
+    ).done.set()
+    assert len(submitted) == 2
+
+
+def test_waiting_jobs_start_by_priority(monkeypatch):
+    _limit(monkeypatch, "prioritized", max_concurrent=1, rate_per_s=100, burst=1)
+    blocker = FakeTask("blocker")
+    scheduled = schedule_image_job(
+        "prioritized", ImagePriority.SCENE, "blocker", lambda: blocker, wait=False
+    )
+    # Jobs that don't wait are submitted in the background; let the blocker take the
+    # provider's only slot first.
+    assert scheduled.name == "blocker"
+
+    started = []
+
+    def request(name, priority):
+        def submit():
+            started.append(name)
+            task = FakeTask(name)
+            task.done.set()
+            return task
+
+        schedule_image_job("prioritized", priority, name, submit)
+
+    threads = [
+        threading.Thread(target=request, args=("preview", ImagePriority.PREVIEW)),
+        threading.Thread(target=request, args=("item", ImagePriority.ITEM)),
+        threading.Thread(target=request, args=("chat", ImagePriority.CHAT)),
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    assert started == []
+
+    blocker.done.set()
+    for thread in threads:
+        thread.join(5)
+    assert started == ["chat", "item", "preview"]
+
+
+def test_submissions_are_rate_limited(monkeypatch):
+    _limit(monkeypatch, "rate-limited", max_concurrent=10, rate_per_s=10, burst=1)
+    start = time.monotonic()
+    for i in range(3):
+        task = FakeTask(str(i))
+        task.done.set()
+        schedule_image_job(
+            "rate-limited", ImagePriority.ITEM, str(i), lambda task=task: task
+        )
+    assert time.monotonic() - start >= 0.15
+
+
+def test_jobs_that_dont_wait_queue_in_the_background(monkeypatch):
+    _limit(monkeypatch, "saturated", max_concurrent=1, rate_per_s=100, burst=1)
+    blocker = FakeTask("blocker")
+    assert (
+        schedule_image_job(
+            "saturated", ImagePriority.SCENE, "blocker", lambda: blocker, wait=False
+        ).name
+        == "blocker"
+    )
+
+    queued = FakeTask("queued")
+    start = time.monotonic()
+    scheduled = schedule_image_job(
+        "saturated", ImagePriority.CHAT, "queued", lambda: queued, wait=False
+    )
+    # The provider is busy, yet the caller gets a handle at once.
+    assert time.monotonic() - start < 0.1
+    assert scheduled.task_id is None
+
+    blocker.done.set()
+    queued.done.set()
+    assert scheduled.wait() is queued
+
+
+def test_jobs_that_dont_wait_start_by_priority(monkeypatch):
+    _limit(monkeypatch, "background", max_concurrent=1, rate_per_s=100, burst=1)
+    blocker = FakeTask("blocker")
+    assert (
+        schedule_image_job(
+            "background", ImagePriority.SCENE, "blocker", lambda: blocker, wait=False
+        ).name
+        == "blocker"
+    )
+
+    started = []
+    completed = []
+
+    def submit(name):
+        started.append(name)
+        task = FakeTask(name)
+        task.done.set()
+        return task
+
+    scheduled = [
+        schedule_image_job(
+            "background",
+            priority,
+            name,
+            lambda name=name: submit(name),
+            wait=False,
+            on_complete=completed.append,
+        )
+        for name, priority in [
+            ("preview", ImagePriority.PREVIEW),
+            ("item", ImagePriority.ITEM),
+            ("chat", ImagePriority.CHAT),
+        ]
+    ]
+    assert started == []
+
+    blocker.done.set()
+    for task in scheduled:
+        task.wait()
+    assert started == ["chat", "item", "preview"]
+    # Completion handlers run on the job's own thread, once its task is done.
+    deadline = time.monotonic() + 5
+    while len(completed) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(task.name for task in completed) == ["chat", "item", "preview"]
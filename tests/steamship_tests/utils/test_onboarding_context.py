@@ -0,0 +1,64 @@
+import uuid
+
+from steamship import Block, File
+from steamship.agents.schema import AgentContext
+
+import utils.context_utils as context_utils
+from schema.characters import HumanCharacter
+from schema.game_state import GameState
+from utils.context_utils import (
+    get_onboarding_context_block,
+    update_onboarding_message_background,
+)
+
+
+class FakeClient:
+    class config:  # noqa: N801
+        workspace_handle = "test-workspace"
+
+
+class FakeChatHistory:
+    def __init__(self):
+        self.file = File(id=str(uuid.uuid4()), blocks=[])
+
+    def append_system_message(self, text, tags):
+        block = Block(
+            id=str(uuid.uuid4()),
+            text=text,
+            index_in_file=len(self.file.blocks),
+            tags=tags,
+        )
+        self.file.blocks.append(block)
+        return block
+
+
+def _context() -> AgentContext:
+    context = AgentContext()
+    context.client = FakeClient()
+    context.chat_history = FakeChatHistory()
+    context.metadata[context_utils._GAME_STATE_KEY] = GameState(
+        player=HumanCharacter(name="Ada")
+    )
+    return context
+
+
+def test_onboarding_context_is_upserted(monkeypatch):
+    deleted = []
+    monkeypatch.setattr(Block, "delete", lambda self: deleted.append(self.id))
+    context = _context()
+    assert get_onboarding_context_block(context) is None
+
+    first = update_onboarding_message_background(context, "Likes sailing.")
+    assert get_onboarding_context_block(context) is first
+    assert "Likes sailing." in first.text
+
+    # Same background: nothing is appended.
+    assert update_onboarding_message_background(context, "Likes sailing.") is first
+    assert len(context.chat_history.file.blocks) == 1
+
+    second = update_onboarding_message_background(context, "Fears the sea.")
+    assert get_onboarding_context_block(context) is second
+    # The superseded version is deleted rather than left behind in the history.
+    assert deleted == [first.id]
+    assert context.chat_history.file.blocks == [second]
+    assert context_utils._onboarding_context_version(second) == 2
@@ -0,0 +1,65 @@
+from steamship import PluginInstance
+
+import utils.plugin_pool as plugin_pool
+from utils.plugin_pool import use_pooled_plugin
+
+
+class FakeConfig:
+    def __init__(self, workspace_id: str):
+        self.workspace_id = workspace_id
+        self.workspace_handle = workspace_id
+
+
+class FakeClient:
+    def __init__(self, workspace_id: str = "workspace-1"):
+        self.config = FakeConfig(workspace_id)
+        self.calls = 0
+
+    def use_plugin(self, plugin_handle, config=None, version=None, **kwargs):
+        self.calls += 1
+        return PluginInstance(
+            id=f"{plugin_handle}-{self.calls}",
+            plugin_handle=plugin_handle,
+            config=config,
+        )
+
+
+def test_instances_are_reused_per_key(monkeypatch):
+    monkeypatch.setattr(plugin_pool, "_POOL", {})
+    client = FakeClient()
+    first = use_pooled_plugin(
+        client, "gpt-4", config={"model": "gpt-4"}, version="0.1.4"
+    )
+    second = use_pooled_plugin(
+        client, "gpt-4", config={"model": "gpt-4"}, version="0.1.4"
+    )
+    assert client.calls == 1
+    assert first.id == second.id
+    assert second.client is client
+
+    use_pooled_plugin(
+        client, "gpt-4", config={"model": "gpt-3.5-turbo"}, version="0.1.4"
+    )
+    use_pooled_plugin(client, "gpt-4", config={"model": "gpt-4"}, version="0.1.5")
+    assert client.calls == 3
+
+    # A new API key is a new config, so it never gets an instance created with the old
+    # one.
+    use_pooled_plugin(client, "fal-ai", config={"api_key": "old"})
+    use_pooled_plugin(client, "fal-ai", config={"api_key": "new"})
+    assert client.calls == 5
+
+    other_workspace = FakeClient("workspace-2")
+    use_pooled_plugin(
+        other_workspace, "gpt-4", config={"model": "gpt-4"}, version="0.1.4"
+    )
+    assert other_workspace.calls == 1
+
+
+def test_instances_expire(monkeypatch):
+    monkeypatch.setattr(plugin_pool, "_POOL", {})
+    client = FakeClient()
+    use_pooled_plugin(client, "dall-e")
+    monkeypatch.setattr(plugin_pool, "PLUGIN_INSTANCE_TTL_S", 0)
+    use_pooled_plugin(client, "dall-e")
+    assert client.calls == 2
@@ -0,0 +1,76 @@
+import pytest
+from steamship import Block, SteamshipError
+
+from schema.characters import HumanCharacter
+from schema.server_settings import ServerSettings
+from utils import generation_utils
+from utils.generation_utils import generate_quest_arc, parse_quest_arc
+
+
+def test_complete_objects_are_salvaged_from_truncated_json():
+    text = (
+        'Sure! [{"goal": "Find the key", "location": "Old Mill."}, '
+        '{"goal": "Cross the river", "location": "Ford"}, {"goal": "Climb'
+    )
+    assert [(quest.goal, quest.location) for quest in parse_quest_arc(text)] == [
+        ("Find the key", "Old Mill"),
+        ("Cross the river", "Ford"),
+    ]
+
+
+def test_quest_goal_list_is_still_understood():
+    text = (
+        "QUEST GOAL: Find the key QUEST LOCATION: Old Mill.\n"
+        "QUEST GOAL: Cross the river QUEST LOCATION: Ford"
+    )
+    assert [quest.location for quest in parse_quest_arc(text)] == ["Old Mill", "Ford"]
+
+
+def _generate(monkeypatch, responses):
+    prompts = []
+
+    def generation(context, prompt, **kwargs):
+        prompts.append(prompt)
+        return Block(text=responses[len(prompts) - 1])
+
+    monkeypatch.setattr(generation_utils, "do_generation", generation)
+    monkeypatch.setattr(
+        generation_utils,
+        "get_server_settings",
+        lambda context: ServerSettings(
+            quests_per_arc=3, adventure_goal="save the town"
+        ),
+    )
+    return generate_quest_arc(HumanCharacter(name="Ada"), None), prompts
+
+
+def test_missing_quests_are_topped_up(monkeypatch):
+    arc, prompts = _generate(
+        monkeypatch,
+        [
+            '[{"goal": "Find the key", "location": "Old Mill"}, {"goal": "Cross',
+            '[{"goal": "Find the key", "location": "Old Mill"}, '
+            '{"goal": "Cross the river", "location": "Ford"}, '
+            '{"goal": "Face the mayor", "location": "Town Hall"}]',
+        ],
+    )
+    assert [quest.goal for quest in arc] == [
+        "Find the key",
+        "Cross the river",
+        "Face the mayor",
+    ]
+    assert len(prompts) == 2
+    assert "remaining 2 quests" in prompts[1]
+    assert "Find the key" in prompts[1]
+
+
+def test_generation_attempts_are_bounded(monkeypatch):
+    arc, prompts = _generate(
+        monkeypatch,
+        ['[{"goal": "Find the key", "location": "Old Mill"}]'] + ["no quests"] * 5,
+    )
+    assert len(prompts) == generation_utils.QUEST_ARC_MAX_GENERATIONS
+    assert [quest.goal for quest in arc] == ["Find the key"]
+
+    with pytest.raises(SteamshipError):
+        _generate(monkeypatch, ["no quests"] * 5)
@@ -0,0 +1,114 @@
+from steamship import Block, File, SteamshipError
+from steamship.data.block import StreamState
+
+from utils import stream_waiter
+from utils.stream_waiter import await_stream, await_streams, refresh_file_with
+
+
+class FakeEngine:
+    """Serves block states, finishing each block after a number of fetches."""
+
+    def __init__(self, fetches_until_complete, batched=True):
+        self.remaining = dict(fetches_until_complete)
+        self.batched = batched
+        self.gets = []
+        self.queries = []
+
+    def _block(self, block_id):
+        self.remaining[block_id] -= 1
+        state = (
+            StreamState.COMPLETE
+            if self.remaining[block_id] <= 0
+            else StreamState.STARTED
+        )
+        return Block(id=block_id, text="done", stream_state=state)
+
+    def get(self, client, _id):
+        self.gets.append(_id)
+        return self._block(_id)
+
+    def query(self, client, tag_filter_query):
+        self.queries.append(tag_filter_query)
+        if not self.batched:
+            raise SteamshipError("unsupported query")
+        ids = [part.split('"')[1] for part in tag_filter_query.split("block_id ")[1:]]
+
+        class Response:
+            blocks = [self._block(block_id) for block_id in ids]
+
+        return Response()
+
+
+def _install(monkeypatch, engine):
+    monkeypatch.setattr(stream_waiter, "_batched_query_supported", True)
+    monkeypatch.setattr(stream_waiter, "INITIAL_POLL_INTERVAL_S", 0)
+    monkeypatch.setattr(stream_waiter.Block, "get", staticmethod(engine.get))
+    monkeypatch.setattr(stream_waiter.Block, "query", staticmethod(engine.query))
+
+
+def _started(block_id):
+    return Block(id=block_id, stream_state=StreamState.STARTED)
+
+
+def test_single_stream_is_polled_until_complete(monkeypatch):
+    engine = FakeEngine({"a": 3})
+    _install(monkeypatch, engine)
+    block = await_stream(_started("a"))
+    assert block.stream_state == StreamState.COMPLETE
+    assert engine.gets == ["a", "a", "a"]
+
+    # Finished blocks are returned without a fetch.
+    assert await_stream(block) is block
+    assert len(engine.gets) == 3
+
+
+def test_many_streams_share_one_query(monkeypatch):
+    engine = FakeEngine({"a": 1, "b": 2})
+    _install(monkeypatch, engine)
+    blocks = await_streams([_started("a"), _started("b")])
+    assert [block.id for block in blocks] == ["a", "b"]
+    assert all(block.stream_state == StreamState.COMPLETE for block in blocks)
+    # One batched query for both, then a single get for the one still streaming.
+    assert len(engine.queries) == 1
+    assert engine.gets == ["b"]
+
+
+def test_unsupported_batch_query_falls_back_to_gets(monkeypatch):
+    engine = FakeEngine({"a": 1, "b": 1}, batched=False)
+    _install(monkeypatch, engine)
+    await_streams([_started("a"), _started("b")])
+    await_streams([_started("a"), _started("b")])
+    assert len(engine.queries) == 1
+    assert sorted(engine.gets) == ["a", "a", "b", "b"]
+
+
+def test_timeout_returns_latest_state(monkeypatch):
+    engine = FakeEngine({"a": 10**6})
+    _install(monkeypatch, engine)
+    block = await_stream(_started("a"), timeout_s=0.01)
+    assert block.stream_state == StreamState.STARTED
+
+
+class RefreshCountingFile(File):
+    refreshes: int = 0
+
+    def refresh(self):
+        self.refreshes += 1
+        return self
+
+
+def test_refresh_file_with_merges_new_blocks():
+    file = RefreshCountingFile(
+        id="f",
+        blocks=[Block(id=f"b{i}", file_id="f", index_in_file=i) for i in range(3)],
+    )
+    updated = Block(id="b2", file_id="f", index_in_file=2, text="finished")
+    appended = Block(id="b3", file_id="f", index_in_file=3)
+    refresh_file_with(file, [appended, updated])
+    assert [block.id for block in file.blocks] == ["b0", "b1", "b2", "b3"]
+    assert file.blocks[2] is updated
+    assert file.refreshes == 0
+
+    # A gap means some other block was appended: reload the whole file.
+    refresh_file_with(file, [Block(id="b9", file_id="f", index_in_file=9)])
+    assert file.refreshes == 1
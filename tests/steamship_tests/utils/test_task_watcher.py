@@ -0,0 +1,29 @@
+from utils.task_watcher import watch_task
+
+
+class FakeTask:
+    task_id = "task-1"
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def wait(self, retry_delay_s=1):
+        if self.error:
+            raise self.error
+
+
+def test_completion_handler_runs_after_wait():
+    completed = []
+    task = FakeTask()
+    watch_task(task, "scene image", completed.append).result(timeout=5)
+    assert completed == [task]
+
+
+def test_failed_task_is_logged_not_raised(caplog):
+    completed = []
+    watch_task(
+        FakeTask(RuntimeError("engine down")), "scene music", completed.append
+    ).result(timeout=5)
+    assert completed == []
+    assert "scene music" in caplog.text
+    assert watch_task(None, "chat image") is None
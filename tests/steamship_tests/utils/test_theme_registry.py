@@ -0,0 +1,39 @@
+from schema.image_theme import FluxTheme, GetImgTheme, StableDiffusionTheme
+from utils.theme_registry import theme_registry
+
+
+def test_custom_themes_shadow_premade_ones():
+    custom = [
+        GetImgTheme(name="realistic_vision_v3", model="my-model"),
+        FluxTheme(name="my_flux", model="my-flux-model"),
+    ]
+    registry = theme_registry(custom)
+    assert registry.by_name("realistic_vision_v3") is custom[0]
+    assert registry.by_model("my-flux-model") is custom[1]
+    assert registry.by_name("no such theme") is None
+
+
+def test_registry_is_reused_until_the_themes_change():
+    custom = [FluxTheme(name="my_flux", model="my-flux-model")]
+    registry = theme_registry(custom)
+    assert theme_registry(custom) is registry
+    assert theme_registry(list(custom)) is registry
+    # Settings are parsed anew for every request: equal themes find the same registry.
+    assert (
+        theme_registry([FluxTheme(name="my_flux", model="my-flux-model")]) is registry
+    )
+    assert (
+        theme_registry(custom + [FluxTheme(name="other", model="other")])
+        is not registry
+    )
+    assert theme_registry([FluxTheme(name="my_flux", model="edited")]) is not registry
+
+
+def test_typed_themes_are_converted_once():
+    theme = GetImgTheme(name="my_theme", model="my-model", seed=7)
+    registry = theme_registry([theme])
+    typed = registry.typed(theme, StableDiffusionTheme)
+    assert type(typed) is StableDiffusionTheme
+    assert typed.seed == 7
+    assert registry.typed(theme, StableDiffusionTheme) is typed
+    assert registry.typed(theme, GetImgTheme) is theme
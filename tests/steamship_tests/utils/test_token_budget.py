@@ -0,0 +1,95 @@
+from steamship import Block
+
+from utils.token_budget import (
+    BUDGET_POLICIES,
+    DEFAULT_BUDGET_POLICY,
+    BudgetCandidate,
+    BudgetCategory,
+    BudgetPolicy,
+    CategoryPolicy,
+    allocate_budget,
+    budget_policy_for,
+)
+
+
+def _candidates(costs, category=BudgetCategory.QUEST_MESSAGE):
+    return [
+        BudgetCandidate(
+            block=Block(id=f"block-{i}", text="x", index_in_file=i),
+            category=category,
+            cost=cost,
+        )
+        for i, cost in enumerate(costs)
+    ]
+
+
+def _ids(selected):
+    return [candidate.block.id for candidate in selected]
+
+
+def test_everything_that_fits_is_kept():
+    candidates = _candidates([10, 20, 30])
+    assert _ids(allocate_budget(candidates, 60, DEFAULT_BUDGET_POLICY)) == [
+        "block-0",
+        "block-1",
+        "block-2",
+    ]
+    assert allocate_budget(candidates, 0, DEFAULT_BUDGET_POLICY) == []
+
+
+def test_long_block_does_not_crowd_out_shorter_ones():
+    # Newest last: a long block right before three short, recent ones.
+    candidates = _candidates([5, 5, 90, 20, 20, 20])
+    selected = allocate_budget(candidates, 100, DEFAULT_BUDGET_POLICY)
+    assert _ids(selected) == ["block-0", "block-1", "block-3", "block-4", "block-5"]
+    assert sum(candidate.cost for candidate in selected) <= 100
+
+
+def test_long_newest_message_is_kept():
+    candidates = _candidates([40] * 20 + [500])
+    selected = allocate_budget(candidates, 600, DEFAULT_BUDGET_POLICY)
+    assert _ids(selected) == ["block-18", "block-19", "block-20"]
+
+
+def test_latest_summary_is_kept():
+    candidates = _candidates(
+        [300], category=BudgetCategory.HISTORY_SUMMARY
+    ) + _candidates([20] * 10)
+    candidates[0].block.id = "summary"
+    selected = allocate_budget(candidates, 400, DEFAULT_BUDGET_POLICY)
+    assert _ids(selected)[0] == "summary"
+    assert _ids(selected)[-1] == "block-9"
+
+
+def test_recency_and_weights_come_from_the_policy():
+    messages = _candidates([10, 10, 10])
+    summaries = _candidates([10], category=BudgetCategory.QUEST_SUMMARY)
+    summaries[0].block.id = "summary"
+    candidates = summaries + messages
+
+    policy = BudgetPolicy(
+        categories={
+            BudgetCategory.QUEST_MESSAGE: CategoryPolicy(weight=1.0, half_life=1),
+            BudgetCategory.QUEST_SUMMARY: CategoryPolicy(weight=0.6),
+        }
+    )
+    assert _ids(allocate_budget(candidates, 20, policy)) == ["summary", "block-2"]
+
+    messages_only = BudgetPolicy(
+        categories={BudgetCategory.QUEST_MESSAGE: CategoryPolicy(weight=1.0)}
+    )
+    assert "summary" not in _ids(allocate_budget(candidates, 30, messages_only))
+
+
+def test_large_budgets_are_not_overflowed():
+    candidates = _candidates([1001 + i * 37 for i in range(60)])
+    selected = allocate_budget(candidates, 20_000, DEFAULT_BUDGET_POLICY)
+    assert sum(candidate.cost for candidate in selected) <= 20_000
+    assert _ids(selected)[-1] == "block-59"
+
+
+def test_policies_by_generation():
+    assert budget_policy_for("Generic") is DEFAULT_BUDGET_POLICY
+    assert budget_policy_for("Quest Summary") is not DEFAULT_BUDGET_POLICY
+    for policy in [DEFAULT_BUDGET_POLICY, *BUDGET_POLICIES.values()]:
+        assert policy.categories[BudgetCategory.QUEST_SUMMARY].weight > 0
@@ -0,0 +1,57 @@
+from steamship import Block, Tag
+from steamship.data.tags.tag_constants import TagValueKey
+
+from utils.tags import TagKindExtensions
+from utils.token_count_cache import block_token_count, precount_blocks
+from utils.tokenizer_service import get_tokenizer
+
+
+class WordEncoding:
+    def __init__(self):
+        self.encoded = []
+
+    def encode_ordinary_batch(self, texts):
+        self.encoded.extend(texts)
+        return [text.split() for text in texts]
+
+
+def test_counts_are_cached_by_content():
+    encoding = WordEncoding()
+    get_tokenizer("gpt-4")._encoding = encoding
+    pending = []
+    first = Block(text="the cache test text", tags=[])
+    second = Block(text="the cache test text", tags=[])
+    precount_blocks([first, second], "gpt-4")
+    assert block_token_count(first, pending, "gpt-4") == 4
+    assert block_token_count(second, pending, "gpt-4") == 4
+    assert encoding.encoded == ["the cache test text"]
+
+    # Counted blocks carry a local tag for the model, so they are not counted again.
+    assert block_token_count(first, pending, "gpt-4") == 4
+    token_tags = [t for t in first.tags if t.kind == TagKindExtensions.TOKEN_COUNT]
+    assert len(token_tags) == 1
+    assert token_tags[0].value[TagValueKey.STRING_VALUE] == "gpt-4"
+
+    # Blocks that don't exist in the engine have nothing to write back.
+    assert pending == []
+
+
+def test_existing_tag_is_used_for_its_model():
+    get_tokenizer("gpt-4")._encoding = WordEncoding()
+    block = Block(
+        text="anything",
+        tags=[
+            Tag(
+                kind=TagKindExtensions.TOKEN_COUNT,
+                value={
+                    TagValueKey.NUMBER_VALUE: 42,
+                    TagValueKey.STRING_VALUE: "gpt-4",
+                },
+            )
+        ],
+    )
+    assert block_token_count(block, [], "gpt-4") == 42
+    # Counted for a different model (or without one): ignored.
+    get_tokenizer("gpt-3.5-turbo")._encoding = WordEncoding()
+    assert block_token_count(block, [], "gpt-3.5-turbo") == 1
+    assert block_token_count(Block(text=""), []) == 0
@@ -0,0 +1,44 @@
+from utils.tokenizer_service import DEFAULT_ENCODING, ModelTokenizer, get_tokenizer
+
+
+class WordEncoding:
+    """Stands in for a tiktoken encoding: one token per word."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode_ordinary_batch(self, texts):
+        self.encoded.extend(texts)
+        return [text.split() for text in texts]
+
+
+def test_tokenizer_selection():
+    assert get_tokenizer(None).encoding_name == DEFAULT_ENCODING
+    assert get_tokenizer("gpt-4o-mini").encoding_name == "cl100k_base"
+    assert get_tokenizer("gpt-4o-mini").ratio == 1.0
+    assert get_tokenizer("meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo").ratio == 1.0
+    assert get_tokenizer("Sao10K/L3-70B-Euryale-v2.1").ratio == 1.0
+    assert get_tokenizer("mistralai/Mixtral-8x7B-Instruct-v0.1").ratio > 1.0
+    assert get_tokenizer("gpt-4") is get_tokenizer("gpt-4")
+
+
+def test_batch_counts_are_cached_per_model():
+    tokenizer = ModelTokenizer("test-model-a", "cl100k_base", ratio=1.5)
+    tokenizer._encoding = WordEncoding()
+    assert tokenizer.count_batch(["one two", "", "one two", None, "three"]) == [
+        3,
+        0,
+        3,
+        0,
+        2,
+    ]
+    # Repeated texts are encoded once.
+    assert tokenizer._encoding.encoded == ["one two", "three"]
+
+    assert tokenizer.count("three") == 2
+    assert tokenizer._encoding.encoded == ["one two", "three"]
+
+    other = ModelTokenizer("test-model-b", "cl100k_base")
+    other._encoding = WordEncoding()
+    assert other.count("three") == 1
+    assert other._encoding.encoded == ["three"]